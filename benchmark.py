@@ -0,0 +1,579 @@
+"""benchmark times how bookshelves operations scale with the size
+of the shelf. Synthetic shelves and csv files are generated for each
+size, each operation is timed and its peak memory measured, and results
+can be written to json to compare between commits."""
+
+import argparse
+import csv
+from datetime import date, timedelta
+import json
+import logging
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, Iterator, List, Tuple
+
+from bookshelves import (
+    BOOK_FIELDS,
+    DATA_FOLDER,
+    PATH_TO_DATABASE,
+    PRIMARY_AUTHOR_READS,
+    Book,
+    BookRow,
+    Bookshelves,
+    OpenLibClient,
+    set_open_lib_client,
+)
+from openlib_server import OpenLibServer, fixtures_from_books
+
+DEFAULT_SIZES = [1000, 10000]
+
+# share of reads that are re-reads of a book already on the shelf
+REREAD_RATE = 0.2
+
+# columns looked up by the lookup operations,
+# with the number of values looked up in each
+LOOKUP_COLUMNS = ("isbn_13", "title", "primary_author", "date_finished")
+LOOKUPS = 50
+
+# bookshelves table as created before schema migrations,
+# with untyped columns and no indexes
+UNTYPED_SCHEMA = """CREATE TABLE bookshelves(id integer primary key autoincrement, title, primary_author_key, primary_author, secondary_authors_keys, secondary_authors,isbn_13, edition_publish_date, number_of_pages, publisher, open_lib_key, goodreads_identifier, librarything_identifier, date_added, date_finished, comments)"""
+
+PATH_TO_BOOKSHELVES = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "bookshelves.py"
+)
+
+# commands timed by --startup, none of them use the open library
+STARTUP_COMMANDS = {
+    "top_books": ["-t"],
+    "search": ["-s", "synthetic"],
+    "stats": ["--stats"],
+    "export_csv": ["-e", "-o", os.devnull],
+    "import_csv": ["-i", "{new_csv}", "--yes"],
+}
+
+# most milliseconds the imports of each startup command should take,
+# leaving out modules python imports before running any script
+STARTUP_BUDGET_MS = 75
+
+# modules only needed for open library requests,
+# which none of the startup commands should import
+STARTUP_LAZY_MODULES = ("requests", "email.utils")
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument(
+    "-s",
+    "--sizes",
+    type=int,
+    nargs="+",
+    default=DEFAULT_SIZES,
+    help="Number of rows in each generated shelf",
+)
+parser.add_argument(
+    "-o", "--output", help="Write results as json to this path for later comparison"
+)
+parser.add_argument(
+    "-c", "--compare", help="Compare results against json written by an earlier run"
+)
+parser.add_argument("--operations", nargs="+", help="Only run the named operations")
+parser.add_argument(
+    "--skip_memory",
+    action="store_true",
+    help="Skip the second run of each operation that measures peak memory",
+)
+parser.add_argument("--seed", type=int, default=1, help="Seed for generated shelves")
+parser.add_argument(
+    "--startup",
+    action="store_true",
+    help="Time the imports of each command with python -X importtime",
+)
+parser.add_argument(
+    "--latency",
+    type=float,
+    default=0,
+    help="Seconds the stand-in open library waits before each response",
+)
+parser.add_argument(
+    "--error_rate",
+    type=float,
+    default=0,
+    help="Share of stand-in open library requests answered with a server error",
+)
+parser.add_argument(
+    "--rate_limit_rate",
+    type=float,
+    default=0,
+    help="Share of stand-in open library requests answered with a rate limit",
+)
+
+
+def generate_books(size: int, seed: int = 1) -> Iterator[Dict[str, str]]:
+    """Yield book metadata for a synthetic shelf of size reads.
+    A share of reads are re-reads of earlier books, picked with
+    a preference for books that have already been re-read, so a few
+    titles are read many times like a real shelf."""
+    rng = random.Random(seed)
+    books = []
+    start_date = date(2010, 1, 1)
+
+    for num in range(size):
+        if books and rng.random() < REREAD_RATE:
+            # square of random number favours the start of the list
+            book = books[int(rng.random() ** 2 * len(books))]
+        else:
+            author_num = rng.randrange(max(1, size // 10))
+            book = {
+                "title": f"Synthetic Book {len(books)}",
+                "primary_author_key": f"/authors/OL{author_num}A",
+                "primary_author": f"Author {author_num}",
+                "secondary_authors_keys": "",
+                "secondary_authors": "",
+                "isbn_13": str(9780000000000 + len(books)),
+                "edition_publish_date": str(rng.randrange(1900, 2024)),
+                "number_of_pages": rng.randrange(80, 1200),
+                "publisher": f"Publisher {rng.randrange(200)}",
+                "open_lib_key": f"/books/OL{len(books)}M",
+                "goodreads_identifier": str(rng.randrange(10**6)),
+                "librarything_identifier": str(rng.randrange(10**6)),
+            }
+            books.append(book)
+
+        date_finished = start_date + timedelta(days=num * 5000 // size)
+        yield dict(
+            book,
+            date_added=date_finished.isoformat(),
+            date_finished=date_finished.isoformat(),
+            comments=f"Read number {num}" if rng.random() < 0.1 else "",
+        )
+
+
+def write_csv(path: str, books: Iterator[Dict[str, str]], with_ids: bool = False):
+    """Write books to csv in the database schema. Books are given ids
+    if with_ids is set, otherwise they are imported as new rows."""
+    headers = list(Book.setDefaultDict().keys())
+
+    with open(path, "w", encoding="utf-8", newline="") as output:
+        writer = csv.DictWriter(output, headers)
+        writer.writeheader()
+        for num, book in enumerate(books, start=1):
+            writer.writerow(dict(book, id=num if with_ids else ""))
+
+
+def write_isbn_csv(path: str, books: Iterator[Dict[str, str]]):
+    """Write csv of isbns to be looked up in the open library"""
+    headers = ["isbn_13", "date_finished", "comments"]
+
+    with open(path, "w", encoding="utf-8", newline="") as output:
+        writer = csv.DictWriter(output, headers, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(books)
+
+
+def import_csv(shelf: Bookshelves, path: str):
+    """Import csv without prompting for confirmation"""
+    shelf.importFromCSV(path, confirm=False)
+
+
+class Benchmark:
+    """Class for running operations against generated shelves"""
+
+    def __init__(
+        self, size: int, folder: str, seed: int = 1, server_options: Dict | None = None
+    ):
+        """Generate the csv files used by operations of this size.
+        Server options are passed to the stand-in open library
+        used when importing isbns."""
+        self.size = size
+        self.folder = folder
+        self.seed = seed
+        self.server_options = server_options or {}
+        self.server = None
+
+        self.new_csv = os.path.join(folder, f"new-{size}.csv")
+        self.existing_csv = os.path.join(folder, f"existing-{size}.csv")
+        self.isbn_csv = os.path.join(folder, f"isbns-{size}.csv")
+        self.export_csv = os.path.join(folder, f"export-{size}.csv")
+
+        write_csv(self.new_csv, generate_books(size, seed))
+        write_csv(self.existing_csv, generate_books(size, seed), with_ids=True)
+        write_isbn_csv(self.isbn_csv, generate_books(size, seed))
+
+    def newShelf(self, filled: bool = True) -> Bookshelves:
+        """Create a new shelf database, filled with the generated books"""
+        path_to_database = os.path.join(self.folder, f"shelf-{time.time_ns()}.db")
+        shelf = Bookshelves(path_to_database)
+        if filled:
+            import_csv(shelf, self.new_csv)
+        return shelf
+
+    def operations(self) -> Dict[str, Callable[[], Callable[[], object]]]:
+        """Operations by name. Each is a setup function returning the
+        function that is timed, so setup is left out of the timings."""
+        return {
+            "book_construction": self.bookConstruction,
+            "read_books": self.readBooks,
+            "read_book_rows": self.readBookRows,
+            "import_csv": self.importNew,
+            "reimport_csv": self.importExisting,
+            "import_isbns": self.importIsbns,
+            "export_csv": self.exportCSV,
+            "top_books": self.topBooks,
+            "search": self.search,
+            "stats": self.stats,
+            "lookups_untyped": self.lookupsUntyped,
+            "lookups": self.lookups,
+        }
+
+    def bookConstruction(self):
+        books = list(generate_books(self.size, self.seed))
+        return lambda: [Book(book) for book in books]
+
+    def readBooks(self):
+        """Read every row as a Book, as read paths did before BookRow"""
+        shelf = self.newShelf()
+        return lambda: [
+            Book(dict(row))
+            for row in shelf.connection.execute("SELECT * FROM bookshelves")
+        ]
+
+    def readBookRows(self):
+        """Read every row as a BookRow view"""
+        shelf = self.newShelf()
+        return lambda: [
+            BookRow(row)
+            for row in shelf.connection.execute("SELECT * FROM bookshelves")
+        ]
+
+    def importNew(self):
+        shelf = self.newShelf(filled=False)
+        return lambda: import_csv(shelf, self.new_csv)
+
+    def importExisting(self):
+        shelf = self.newShelf()
+        return lambda: import_csv(shelf, self.existing_csv)
+
+    def importIsbns(self):
+        """Import isbns with lookups made to a stand-in open library,
+        with a new client so no responses or authors are cached."""
+        if self.server is None:
+            fixtures = fixtures_from_books(generate_books(self.size, self.seed))
+            self.server = OpenLibServer(
+                fixtures, seed=self.seed, retry_after=0, **self.server_options
+            ).start()
+
+        set_open_lib_client(OpenLibClient(base_url=self.server.url))
+        shelf = self.newShelf(filled=False)
+        return lambda: import_csv(shelf, self.isbn_csv)
+
+    def close(self):
+        """Stop the stand-in open library if it was started"""
+        if self.server is not None:
+            print(f"stand-in open library responses: {dict(self.server.stats)}")
+            self.server.stop()
+            self.server = None
+
+    def exportCSV(self):
+        shelf = self.newShelf()
+        return lambda: shelf.exportToCSV(self.export_csv)
+
+    def topBooks(self):
+        shelf = self.newShelf()
+        return lambda: shelf.getTopBooks(10)
+
+    def search(self):
+        shelf = self.newShelf()
+        return lambda: shelf.search("synthetic book 1")
+
+    def stats(self):
+        shelf = self.newShelf()
+        return lambda: shelf.getStats()
+
+    def lookupValues(self) -> List[Tuple[str, str]]:
+        """Get column and value of each lookup, spread over the shelf"""
+        books = list(generate_books(self.size, self.seed))
+        return [
+            (column, str(books[num * len(books) // LOOKUPS][column]))
+            for column in LOOKUP_COLUMNS
+            for num in range(LOOKUPS)
+        ]
+
+    def lookupsUntyped(self):
+        """Look up rows of a shelf in the schema used before migrations,
+        to compare with the lookups of the current schema"""
+        path_to_database = os.path.join(self.folder, f"untyped-{time.time_ns()}.db")
+        connection = sqlite3.connect(path_to_database)
+        connection.execute(UNTYPED_SCHEMA)
+        fields = BOOK_FIELDS[1:]
+        connection.executemany(
+            f"""INSERT INTO bookshelves ({", ".join(fields)}) VALUES ({", ".join("?" for _ in fields)})""",
+            (
+                [str(book[field]) for field in fields]
+                for book in generate_books(self.size, self.seed)
+            ),
+        )
+        connection.commit()
+
+        values = self.lookupValues()
+        return lambda: [
+            connection.execute(
+                f"""SELECT * FROM bookshelves WHERE {column} = ?""", (value,)
+            ).fetchall()
+            for column, value in values
+        ]
+
+    def lookups(self):
+        """Look up rows by the columns that have indexes,
+        with primary authors found through the authors table"""
+        shelf = self.newShelf()
+        queries = {
+            column: f"""SELECT * FROM bookshelves WHERE {column} = ?"""
+            for column in LOOKUP_COLUMNS
+        }
+        queries[
+            "primary_author"
+        ] = f"""SELECT bookshelves.* FROM (SELECT reads.id {PRIMARY_AUTHOR_READS}) AS author_reads JOIN bookshelves ON bookshelves.id = author_reads.id"""
+
+        values = self.lookupValues()
+        return lambda: [
+            shelf.connection.execute(queries[column], (value,)).fetchall()
+            for column, value in values
+        ]
+
+    def run(self, name: str, measure_memory: bool = True) -> Dict:
+        """Time operation, then run it again to measure peak memory
+        as tracing memory slows down the operation."""
+        setup = self.operations()[name]
+
+        operation = setup()
+        start_time = time.perf_counter()
+        operation()
+        seconds = time.perf_counter() - start_time
+
+        peak_memory = None
+        if measure_memory:
+            operation = setup()
+            tracemalloc.start()
+            operation()
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        return {
+            "operation": name,
+            "rows": self.size,
+            "seconds": seconds,
+            "rows_per_second": self.size / seconds if seconds > 0 else None,
+            "peak_memory_bytes": peak_memory,
+        }
+
+
+def import_times(command: List[str], cwd: str | None = None) -> Dict[str, int]:
+    """Run command with python -X importtime and return the cumulative
+    microseconds taken importing each top level module"""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", *command],
+        capture_output=True,
+        text=True,
+        cwd=cwd,
+    )
+
+    times = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        # lines are "import time: self | cumulative | name" with names
+        # indented by depth, so top level modules have one leading space
+        _, cumulative, name = line.split("|")
+        if name.startswith("  ") or not cumulative.strip().isdigit():
+            continue
+        times[name.strip()] = int(cumulative)
+
+    return times
+
+
+def time_startup(size: int = 1000, seed: int = 1) -> List[Dict]:
+    """Time the imports of each startup command, run against a shelf
+    of size rows. Modules imported by python before any script
+    is run are left out, so results show the cost of bookshelves."""
+    python_modules = import_times(["-c", "pass"])
+    results = []
+
+    with tempfile.TemporaryDirectory() as folder:
+        new_csv = os.path.join(folder, "new.csv")
+        write_csv(new_csv, generate_books(size, seed))
+        # commands use the default database relative to where they are run
+        os.makedirs(os.path.join(folder, DATA_FOLDER))
+        Bookshelves(os.path.join(folder, PATH_TO_DATABASE)).close()
+
+        for name, args in STARTUP_COMMANDS.items():
+            args = [arg.format(new_csv=new_csv) for arg in args]
+            times = import_times([PATH_TO_BOOKSHELVES, *args], cwd=folder)
+            modules = {
+                module: microseconds
+                for module, microseconds in times.items()
+                if module not in python_modules
+            }
+            results.append(
+                {
+                    "command": name,
+                    "import_ms": sum(modules.values()) / 1000,
+                    "budget_ms": STARTUP_BUDGET_MS,
+                    "modules": sorted(modules),
+                    "lazy_modules_imported": [
+                        module
+                        for module in STARTUP_LAZY_MODULES
+                        if any(
+                            imported == module or imported.startswith(module + ".")
+                            for imported in times
+                        )
+                    ],
+                }
+            )
+
+    return results
+
+
+def print_startup(result: Dict):
+    """Print startup result, flagging commands over budget
+    or importing modules that should be lazy"""
+    line = (
+        f"{'startup_' + result['command']:<20} {result['import_ms']:>9.1f} ms imports"
+    )
+    line += f" {result['budget_ms']:>6} ms budget"
+    if result["import_ms"] > result["budget_ms"]:
+        line += " OVER BUDGET"
+    if result["lazy_modules_imported"]:
+        line += f" imports {', '.join(result['lazy_modules_imported'])}"
+
+    print(line)
+
+
+def over_budget(results: List[Dict]) -> List[str]:
+    """Get startup commands over their import budget
+    or importing modules that should be lazy"""
+    return [
+        result["command"]
+        for result in results
+        if result["import_ms"] > result["budget_ms"] or result["lazy_modules_imported"]
+    ]
+
+
+def git_commit() -> str | None:
+    """Get commit of working directory, if it is a git repo"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(
+    sizes: List[int],
+    operations: List[str] | None = None,
+    measure_memory: bool = True,
+    seed: int = 1,
+    server_options: Dict | None = None,
+) -> Dict:
+    """Run operations for each size and return results with details
+    of the environment they were run in."""
+    results = []
+
+    with tempfile.TemporaryDirectory() as folder:
+        for size in sizes:
+            benchmark = Benchmark(size, folder, seed, server_options)
+
+            try:
+                for name in operations or benchmark.operations():
+                    result = benchmark.run(name, measure_memory)
+                    print_result(result)
+                    results.append(result)
+            finally:
+                benchmark.close()
+
+    return {
+        "commit": git_commit(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "server_options": server_options or {},
+        "results": results,
+    }
+
+
+def print_result(result: Dict, previous: Dict | None = None):
+    """Print a result, with change in time from previous result if given"""
+    line = f"{result['operation']:<20} {result['rows']:>9} rows {result['seconds']:>9.3f} s"
+
+    if result["rows_per_second"]:
+        line += f" {result['rows_per_second']:>12.0f} rows/s"
+    if result["peak_memory_bytes"] is not None:
+        line += f" {result['peak_memory_bytes'] / 2**20:>9.1f} MiB peak"
+        line += f" {result['peak_memory_bytes'] / result['rows']:>7.0f} B/row"
+    if previous is not None and previous["seconds"] > 0:
+        change = (result["seconds"] - previous["seconds"]) / previous["seconds"]
+        line += f" {change:>+8.1%} time"
+
+    print(line)
+
+
+def compare(results: Dict, previous_results: Dict):
+    """Print results alongside change from previous results"""
+    previous = {
+        (result["operation"], result["rows"]): result
+        for result in previous_results["results"]
+    }
+
+    print(f"\nCompared with {previous_results.get('commit') or 'previous run'}")
+    for result in results["results"]:
+        print_result(result, previous.get((result["operation"], result["rows"])))
+
+
+def main():
+    args = parser.parse_args()
+
+    # per row logging would be timed along with the operations
+    logging.getLogger().setLevel(logging.WARNING)
+
+    server_options = {
+        "latency": args.latency,
+        "error_rate": args.error_rate,
+        "rate_limit_rate": args.rate_limit_rate,
+    }
+    results = run_benchmarks(
+        args.sizes, args.operations, not args.skip_memory, args.seed, server_options
+    )
+
+    if args.startup:
+        results["startup"] = time_startup(min(args.sizes), args.seed)
+        for result in results["startup"]:
+            print_startup(result)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(results, output, indent=2)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as previous:
+            compare(results, json.load(previous))
+
+    # timings depend on the machine, so budgets are checked here
+    # rather than by the tests
+    if args.startup:
+        commands = over_budget(results["startup"])
+        if commands:
+            sys.exit(f"Startup commands over budget: {', '.join(commands)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,40 +1,1044 @@
 """bookshelves is a command line app for keeping track of books
 you have read. It keeps them in a sqlite3 database, which can be
 exported and imported to a csv"""
+
 import argparse
 import csv
-from datetime import datetime
-from collections import defaultdict
+from datetime import date, datetime
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+from itertools import chain, islice
+from operator import attrgetter
+import gzip
+import io
+import json
 import logging
 import os
+import queue
+import random
 import sqlite3
 import sys
-from typing import Dict, Type
+import threading
+import time
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    TextIO,
+    Tuple,
+)
+from urllib.parse import parse_qs, urlencode, urlparse
 
-import requests
+# requests, concurrent.futures and email.utils are slow to import and
+# only needed by some commands, so they are imported where they are used
+if TYPE_CHECKING:
+    from concurrent.futures import Future
 
-logging.basicConfig(
-    level=logging.INFO, format=" %(asctime)s -  %(levelname)s -  %(message)s"
-)
+    import requests
 
 DATA_FOLDER = "data"
 
 PATH_TO_DATABASE = os.path.join(DATA_FOLDER, "bookshelves.db")
 
-parser = argparse.ArgumentParser()
+# seconds a connection waits for another connection to finish writing
+DATABASE_BUSY_TIMEOUT = 30
+
+# in WAL mode NORMAL can lose the last commits on power loss
+# but can't corrupt the database, FULL syncs every commit
+DATABASE_SYNCHRONOUS = "NORMAL"
+SYNCHRONOUS_LEVELS = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+# bytes of the database read through memory mapping, 0 turns it off
+DATABASE_MMAP_SIZE = 256 * 2**20
+
+# times to wait out the busy timeout again before a write gives up
+WRITE_RETRIES = 3
+
+# number of rows sent to sqlite per executemany call during bulk imports
+IMPORT_CHUNK_SIZE = 1000
+
+# most chunks of books waiting to be written during csv imports,
+# so memory use stays the same however big the csv
+IMPORT_QUEUE_CHUNKS = 2
+
+# number of rows committed at a time during csv imports,
+# so an interrupted import can be resumed from the last commit
+RESUMABLE_BATCH_SIZE = 1000
+
+# number of rows read from sqlite at a time during exports
+EXPORT_CHUNK_SIZE = 1000
+
+# number of rows between progress messages during exports
+EXPORT_PROGRESS_EVERY = 100000
+
+# most results shown for a search
+SEARCH_LIMIT = 20
+
+# number of authors and publishers shown in reading stats
+STATS_TOP_LIMIT = 10
+
+# number of concurrent open library lookups during isbn imports
+DEFAULT_WORKERS = 8
+
+# number of isbns looked up in one open library books api request
+LOOKUP_BATCH_SIZE = 20
+
+PATH_TO_CACHE = os.path.join(DATA_FOLDER, "openlib-cache.db")
 
-parser.add_argument("-a", "--add", help="Add to database", nargs="+")
-parser.add_argument(
-    "-e", "--export", action="store_true", help="Export database to csv"
+# cached open library responses older than this are fetched again
+CACHE_TTL = 30 * 24 * 60 * 60
+
+# most responses kept in the cache, oldest are removed first
+CACHE_MAX_ENTRIES = 50000
+
+# number of new cache entries between checks for expired or excess entries
+CACHE_EVICT_EVERY = 500
+
+# seconds to wait for the open library to connect or send data
+REQUEST_TIMEOUT = 10
+
+# number of times a request is retried after a connection error or
+# a rate limit / server error response
+REQUEST_RETRIES = 4
+
+# first retry waits up to this many seconds, doubling for each retry after
+RETRY_BACKOFF = 0.5
+
+# longest wait between retries in seconds
+RETRY_MAX_BACKOFF = 60
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# failed imports with these error classes can succeed if tried again
+TRANSIENT_ERROR_CLASSES = {"network", "rate_limited", "server_error"}
+
+PATH_TO_INDEX = os.path.join(DATA_FOLDER, "openlib-index.db")
+
+# number of editions or authors written per executemany call when building the index
+INDEX_CHUNK_SIZE = 10000
+
+# number of dump lines between progress messages when building the index
+INDEX_PROGRESS_EVERY = 1000000
+
+# edition fields kept in the index, enough to make book metadata
+INDEX_EDITION_FIELDS = (
+    "key",
+    "title",
+    "authors",
+    "publish_date",
+    "publishers",
+    "number_of_pages",
+    "identifiers",
 )
-parser.add_argument("-i", "--import_csv", help="Import csv file to database")
-parser.add_argument(
-    "-t", "--top_ten", action="store_true", help="View top 10 most read books ten books"
+
+# open library requests are made to this url unless another is passed,
+# such as a local stand-in server from openlib_server.py
+OPEN_LIB_URL = "https://openlibrary.org"
+
+# formats --profile can write
+PROFILE_FORMATS = ("text", "json", "cprofile")
+
+# number of functions listed in cprofile output
+PROFILE_TOP_FUNCTIONS = 25
+
+# address --serve listens on and --daemon forwards commands to,
+# either the path of a unix socket or host:port for local http
+DAEMON_ADDRESS = os.path.join(DATA_FOLDER, "bookshelves.sock")
+
+# bytes read at a time from daemon responses
+DAEMON_READ_SIZE = 65536
+
+# seconds the daemon waits for a client to send its request before
+# giving up, so stalled clients can't hold on to the pool's threads
+DAEMON_REQUEST_TIMEOUT = 10
+
+
+def positive_int(value: str) -> int:
+    """Argparse type for counts that must be at least 1"""
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be a positive integer: {value}")
+    return number
+
+
+def make_parser() -> argparse.ArgumentParser:
+    """Make parser for command line args, when a command is run
+    rather than when bookshelves is imported."""
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "-a",
+        "--add",
+        help="Add isbns to database, use - to read isbns from stdin",
+        nargs="+",
+    )
+    parser.add_argument(
+        "-y",
+        "--yes",
+        action="store_true",
+        help="Add or import without asking for confirmation or comments",
+    )
+    parser.add_argument(
+        "-e", "--export", action="store_true", help="Export database to csv"
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default="",
+        help="Path to export csv to, use - for stdout",
+    )
+    parser.add_argument(
+        "-z", "--gzip", action="store_true", help="Gzip compress exported csv"
+    )
+    parser.add_argument("-i", "--import_csv", help="Import csv file to database")
+    parser.add_argument(
+        "-b",
+        "--batch_size",
+        type=int,
+        default=0,
+        help=f"Commit csv imports every n rows, by default every {RESUMABLE_BATCH_SIZE}",
+    )
+    parser.add_argument(
+        "--retry-failed",
+        "--retry_failed",
+        action="store_true",
+        help="Retry imports that failed from network errors, rate limits or server errors",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Skip rows finished by an earlier import of the same csv file",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=positive_int,
+        default=DEFAULT_WORKERS,
+        help="Number of concurrent open library lookups when importing isbns",
+    )
+    parser.add_argument(
+        "-l",
+        "--lookup_batch_size",
+        type=positive_int,
+        default=LOOKUP_BATCH_SIZE,
+        help="Number of isbns looked up in each open library request",
+    )
+    parser.add_argument(
+        "--no-cache",
+        "--no_cache",
+        action="store_true",
+        help="Do not read or write cached open library responses",
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Ignore cached open library responses and cache fresh ones",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=REQUEST_TIMEOUT,
+        help="Seconds to wait for open library responses",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=REQUEST_RETRIES,
+        help="Number of retries for failed open library requests",
+    )
+    parser.add_argument(
+        "--open_lib_url",
+        default=OPEN_LIB_URL,
+        help="Base url of the open library, e.g. a local stand-in server",
+    )
+    parser.add_argument(
+        "-t",
+        "--top_ten",
+        action="store_true",
+        help="View top 10 most read books ten books",
+    )
+    parser.add_argument(
+        "-s", "--search", help="Search titles, authors, publishers and comments"
+    )
+    parser.add_argument("--stats", action="store_true", help="View reading stats")
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Recompute reading stats and read counts from the database",
+    )
+    parser.add_argument(
+        "--build_index",
+        nargs="+",
+        help="Build offline index from open library editions and authors dump files",
+    )
+    parser.add_argument(
+        "--index",
+        default=PATH_TO_INDEX,
+        help="Path to offline index, which is searched before the open library if it exists",
+    )
+    parser.add_argument("--top", type=int, help="View top n most read books")
+    parser.add_argument(
+        "--year", help="Only count books finished in year for top books or stats"
+    )
+    parser.add_argument("--author", help="Only count books by author for top books")
+    parser.add_argument(
+        "--busy_timeout",
+        type=float,
+        default=DATABASE_BUSY_TIMEOUT,
+        help="Seconds to wait for other processes writing to the database",
+    )
+    parser.add_argument(
+        "--synchronous",
+        type=str.upper,
+        default=DATABASE_SYNCHRONOUS,
+        choices=SYNCHRONOUS_LEVELS,
+        help="How often sqlite syncs the database to disk",
+    )
+    parser.add_argument(
+        "--mmap_size",
+        type=int,
+        default=DATABASE_MMAP_SIZE,
+        help="Bytes of the database to memory map for reading, 0 to turn off",
+    )
+    parser.add_argument(
+        "--serve",
+        nargs="?",
+        const=DAEMON_ADDRESS,
+        help="Run as a daemon answering commands over a json api, "
+        "on a unix socket path or a local host:port",
+    )
+    parser.add_argument(
+        "--serve_folder",
+        default=DATA_FOLDER,
+        help="Folder the daemon can import csv files from and export to",
+    )
+    parser.add_argument(
+        "--daemon",
+        nargs="?",
+        const=DAEMON_ADDRESS,
+        help="Forward command to a daemon started with --serve",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="text",
+        choices=PROFILE_FORMATS,
+        help="Report time spent in each phase of the command, as text by default",
+    )
+    parser.add_argument(
+        "--profile_output",
+        help="Write json or cprofile stats to this path instead of stderr",
+    )
+
+    return parser
+
+
+class Profiler:
+    """Class for timing the phases of a command, such as open library
+    requests and sqlite writes, and counting what it did, such as
+    rows written. A disabled profiler records nothing and its phases
+    are a shared null context, so instrumented code costs a method
+    call when not profiling."""
+
+    def __init__(self, enabled: bool = False):
+        """Create new profiler, which only records once enabled"""
+        self.enabled = enabled
+        self.start_time = time.perf_counter()
+        # phases are timed from several threads at once
+        self._lock = threading.Lock()
+        self.seconds = defaultdict(float)
+        self.calls = Counter()
+        self.counters = Counter()
+
+    def enable(self):
+        """Start recording, measuring the run time from now"""
+        self.start_time = time.perf_counter()
+        self.enabled = True
+
+    def phase(self, name: str):
+        """Context manager that times the code it wraps as phase name"""
+        if not self.enabled:
+            return NULL_PHASE
+        return self._timePhase(name)
+
+    @contextmanager
+    def _timePhase(self, name: str):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start_time)
+
+    def record(self, name: str, seconds: float):
+        """Add seconds spent in a call to phase name"""
+        with self._lock:
+            self.seconds[name] += seconds
+            self.calls[name] += 1
+
+    def count(self, name: str, amount: int = 1):
+        """Add amount to counter name"""
+        if self.enabled:
+            with self._lock:
+                self.counters[name] += amount
+
+    def timeIter(self, iterable: Iterable, name: str, counter: str) -> Iterable:
+        """Time getting each item from iterable as phase name, counting
+        items in counter. Used for reading rows that are consumed lazily.
+        The iterable is returned as it is when not profiling."""
+        if not self.enabled:
+            return iterable
+        return self._timeIter(iterable, name, counter)
+
+    def _timeIter(self, iterable: Iterable, name: str, counter: str) -> Iterator:
+        iterator = iter(iterable)
+        while True:
+            start_time = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.record(name, time.perf_counter() - start_time)
+            self.count(counter)
+            yield item
+
+    def report(self) -> Dict:
+        """Run time, phases and counters recorded so far"""
+        with self._lock:
+            return {
+                "seconds": time.perf_counter() - self.start_time,
+                "phases": {
+                    name: {"seconds": seconds, "calls": self.calls[name]}
+                    for name, seconds in sorted(
+                        self.seconds.items(), key=lambda item: -item[1]
+                    )
+                },
+                "counters": dict(sorted(self.counters.items())),
+            }
+
+    def printReport(self, output: TextIO | None = None):
+        """Print phases and counters as a table, to stderr by default
+        as stdout can be used for exports. Phases run in several threads
+        at once can add up to more than the run time."""
+        output = output or sys.stderr
+        report = self.report()
+        run_seconds = report["seconds"]
+
+        print(f"\nPROFILE: {run_seconds:.3f} s", file=output)
+        print(
+            f"{'phase':<20} {'calls':>10} {'seconds':>10} {'% of run':>9}", file=output
+        )
+        for name, phase in report["phases"].items():
+            share = phase["seconds"] / run_seconds if run_seconds > 0 else 0
+            print(
+                f"{name:<20} {phase['calls']:>10} {phase['seconds']:>10.3f} {share:>9.1%}",
+                file=output,
+            )
+
+        print(f"\n{'counter':<20} {'value':>10}", file=output)
+        for name, value in report["counters"].items():
+            print(f"{name:<20} {value:>10}", file=output)
+
+    def __repr__(self):
+        """Return a string of the expression that creates the object"""
+        return f"{self.__class__.__qualname__}({self.enabled})"
+
+
+# returned for every phase of a disabled profiler
+NULL_PHASE = nullcontext()
+
+# profiler for the running command, enabled by --profile
+profiler = Profiler()
+
+
+class OpenLibCache:
+    """Class for caching open library responses in a sqlite database"""
+
+    def __init__(
+        self,
+        path_to_cache: str,
+        ttl: float = CACHE_TTL,
+        max_entries: int = CACHE_MAX_ENTRIES,
+    ):
+        """Create new cache object, creating the cache table if needed.
+        Responses are keyed by url. Responses older than ttl seconds
+        are treated as missing and at most max_entries responses are kept,
+        with the oldest removed first."""
+        self.path_to_cache = path_to_cache
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._writes_since_eviction = 0
+
+        # cache lookups are quick so one connection is shared by all threads
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path_to_cache, check_same_thread=False)
+        # losing the last few responses on power loss is fine for a cache
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS open_lib_cache(url TEXT PRIMARY KEY, response TEXT NOT NULL, fetched_at REAL NOT NULL)"""
+        )
+        self.connection.execute(
+            """CREATE INDEX IF NOT EXISTS open_lib_cache_fetched_at ON open_lib_cache(fetched_at)"""
+        )
+        self.connection.commit()
+
+        self.evict()
+
+        logging.debug(self.__repr__())
+
+    def get(self, url: str) -> str | None:
+        """Return cached response text for url or None if there is no
+        cached response or it has expired."""
+        with self._lock, profiler.phase("cache_read"):
+            result = self.connection.execute(
+                """SELECT response FROM open_lib_cache WHERE url = ? AND fetched_at > ?""",
+                (url, time.time() - self.ttl),
+            ).fetchone()
+
+            if result is None:
+                self.misses += 1
+                profiler.count("cache_misses")
+                return None
+
+            self.hits += 1
+            profiler.count("cache_hits")
+            return result[0]
+
+    def set(self, url: str, response: str):
+        """Store response text for url, replacing any existing response."""
+        with self._lock, profiler.phase("cache_write"):
+            self.connection.execute(
+                """INSERT OR REPLACE INTO open_lib_cache (url, response, fetched_at) VALUES (?, ?, ?)""",
+                (url, response, time.time()),
+            )
+            self.connection.commit()
+
+            self._writes_since_eviction += 1
+            if self._writes_since_eviction >= CACHE_EVICT_EVERY:
+                self._evict()
+
+    def evict(self):
+        """Remove expired responses and the oldest responses
+        over the max_entries limit."""
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        """Evict without taking the lock, for callers that already hold it"""
+        self.connection.execute(
+            """DELETE FROM open_lib_cache WHERE fetched_at <= ?""",
+            (time.time() - self.ttl,),
+        )
+        self.connection.execute(
+            """DELETE FROM open_lib_cache WHERE url IN (SELECT url FROM open_lib_cache ORDER BY fetched_at DESC LIMIT -1 OFFSET ?)""",
+            (self.max_entries,),
+        )
+        self.connection.commit()
+        self._writes_since_eviction = 0
+
+    def close(self):
+        """Close connection to cache database."""
+        with self._lock:
+            self.connection.close()
+
+    def __repr__(self):
+        """Return a string of the expression that creates the object"""
+        return f"{self.__class__.__qualname__}({self.path_to_cache}, {self.ttl}, {self.max_entries})"
+
+
+class OpenLibIndex:
+    """Class for looking up editions and authors offline, from an index
+    of open library data dumps kept in a sqlite database"""
+
+    def __init__(self, path_to_index: str):
+        """Create new index object, creating the index tables if needed."""
+        self.path_to_index = path_to_index
+        self.hits = 0
+        self.misses = 0
+
+        # index lookups are quick so one connection is shared by all threads
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path_to_index, check_same_thread=False)
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS editions(isbn_13 TEXT PRIMARY KEY, edition TEXT NOT NULL) WITHOUT ROWID"""
+        )
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS authors(key TEXT PRIMARY KEY, name TEXT NOT NULL) WITHOUT ROWID"""
+        )
+        self.connection.commit()
+
+        logging.debug(self.__repr__())
+
+    def getEdition(self, isbn: str) -> dict | None:
+        """Return edition data for isbn, in the same format as
+        the open library isbn api, or None if isbn is not indexed."""
+        with self._lock, profiler.phase("index_read"):
+            result = self.connection.execute(
+                """SELECT edition FROM editions WHERE isbn_13 = ?""", (isbn,)
+            ).fetchone()
+            self.recordLookup(result)
+
+        return None if result is None else json.loads(result[0])
+
+    def getAuthorName(self, author_key: str) -> str | None:
+        """Return name for author key, or None if author is not indexed."""
+        with self._lock, profiler.phase("index_read"):
+            result = self.connection.execute(
+                """SELECT name FROM authors WHERE key = ?""", (author_key,)
+            ).fetchone()
+            self.recordLookup(result)
+
+        return None if result is None else result[0]
+
+    def recordLookup(self, result):
+        if result is None:
+            self.misses += 1
+            profiler.count("index_misses")
+        else:
+            self.hits += 1
+            profiler.count("index_hits")
+
+    def importDump(self, path_to_dump: str) -> Tuple[int, int]:
+        """Add editions and authors from an open library dump file,
+        gzipped or not, to the index. Either the editions, authors or
+        complete dump can be used. The dump is read a line at a time and
+        written in chunks, so memory use stays the same however big the dump.
+        Editions are indexed under each of their isbns, with isbn 10 values
+        converted to isbn 13. Returns count of editions and authors added."""
+        edition_count = 0
+        author_count = 0
+
+        with self._lock:
+            # an index can be rebuilt from the dump, so skip syncing each write
+            self.connection.execute("PRAGMA synchronous=OFF")
+
+            try:
+                records = read_open_lib_dump(path_to_dump)
+
+                for chunk in chunked(records, INDEX_CHUNK_SIZE):
+                    editions = []
+                    authors = []
+
+                    for record_type, record in chunk:
+                        if record_type == "/type/edition":
+                            edition = json.dumps(
+                                {
+                                    field: record[field]
+                                    for field in INDEX_EDITION_FIELDS
+                                    if field in record
+                                },
+                                separators=(",", ":"),
+                            )
+                            editions.extend(
+                                (isbn, edition) for isbn in edition_isbns(record)
+                            )
+                        elif record.get("name"):
+                            authors.append((record["key"], record["name"]))
+
+                    self.connection.executemany(
+                        """INSERT OR REPLACE INTO editions (isbn_13, edition) VALUES (?, ?)""",
+                        editions,
+                    )
+                    self.connection.executemany(
+                        """INSERT OR REPLACE INTO authors (key, name) VALUES (?, ?)""",
+                        authors,
+                    )
+                    edition_count += len(editions)
+                    author_count += len(authors)
+
+                self.connection.commit()
+            except Exception:
+                self.connection.rollback()
+                raise
+            finally:
+                self.connection.execute("PRAGMA synchronous=FULL")
+
+        logging.info(
+            "Indexed %s editions and %s authors from %s",
+            edition_count,
+            author_count,
+            path_to_dump,
+        )
+
+        return edition_count, author_count
+
+    def close(self):
+        """Close connection to index database."""
+        with self._lock:
+            self.connection.close()
+
+    def __repr__(self):
+        """Return a string of the expression that creates the object"""
+        return f"{self.__class__.__qualname__}({self.path_to_index})"
+
+
+class OpenLibClient:
+    """Class for fetching json data from the open library"""
+
+    def __init__(
+        self,
+        cache: OpenLibCache | None = None,
+        refresh: bool = False,
+        timeout: float = REQUEST_TIMEOUT,
+        retries: int = REQUEST_RETRIES,
+        pool_size: int = DEFAULT_WORKERS,
+        base_url: str = OPEN_LIB_URL,
+        index: OpenLibIndex | None = None,
+    ):
+        """Create new client. If a cache is given then responses are
+        read from it before making requests, and successful responses
+        are stored in it. With refresh set, cached responses are not read
+        but fresh responses are still stored.
+        Requests share one session, made with the first request, keeping
+        up to pool_size connections open for reuse, so pool_size should
+        match the number of threads making requests. Requests are made to base_url, which is
+        the live open library by default. If an index is given then
+        editions and authors are looked up in it before making requests."""
+        self.cache = cache
+        self.refresh = refresh
+        self.timeout = timeout
+        self.retries = retries
+        self.base_url = base_url.rstrip("/")
+        self.index = index
+        self.pool_size = pool_size
+
+        self._session = None
+        self._session_lock = threading.Lock()
+
+        # author names are memoized as futures so threads asking for
+        # an author that is already being fetched wait for that request
+        self._authors = {}
+        self._authors_lock = threading.Lock()
+        self.author_lookups = 0
+        self.author_fetches = 0
+
+        logging.debug(self.__repr__())
+
+    @property
+    def session(self) -> "requests.Session":
+        """Session shared by all requests. It is made on first use
+        so commands that make no requests don't import requests."""
+        with self._session_lock:
+            if self._session is None:
+                import requests
+
+                self._session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=1, pool_maxsize=self.pool_size
+                )
+                self._session.mount("https://", adapter)
+                self._session.mount("http://", adapter)
+
+            return self._session
+
+    def getJSON(self, url: str):
+        """Get json data from url, via the cache if there is one."""
+        cached_response = self.getCached(url)
+        if cached_response is not None:
+            return cached_response
+
+        response = self.get(url)
+
+        if self.cache is not None and response.status_code == 200:
+            self.cache.set(url, response.text)
+
+        return response.json()
+
+    def getEdition(self, isbn: str):
+        """Get edition data for isbn from the index,
+        or from the open library if it is not indexed."""
+        if self.index is not None:
+            edition = self.index.getEdition(isbn)
+            if edition is not None:
+                return edition
+
+        return self.getJSON(self.isbnUrl(isbn))
+
+    def getCached(self, url: str):
+        """Get json data for url from the cache. Returns None if there
+        is no cache, the url is not cached or the cache is being refreshed."""
+        if self.cache is None or self.refresh:
+            return None
+
+        cached_response = self.cache.get(url)
+        if cached_response is None:
+            return None
+
+        logging.debug("Using cached response for %s", url)
+        return json.loads(cached_response)
+
+    def getBooksByIsbn(self, isbns: List[str]) -> Dict[str, dict]:
+        """Get edition data for many isbns with one request to the
+        open library books api. The data for each isbn is cached on its own,
+        under the url for looking up that isbn alone, so later batches
+        of different isbns can still use the cache.
+        Returns dictionary of isbn to edition data, isbns that the open library
+        has no data for are left out."""
+        books = {}
+        missing_isbns = []
+
+        # dict keeps order while dropping repeated isbns
+        for isbn in dict.fromkeys(isbns):
+            cached_book = self.getCached(self.booksApiUrl([isbn]))
+            if cached_book is not None:
+                books[isbn] = cached_book
+            else:
+                missing_isbns.append(isbn)
+
+        if not missing_isbns:
+            return books
+
+        response = self.get(self.booksApiUrl(missing_isbns))
+        response.raise_for_status()
+
+        for bibkey, book in response.json().items():
+            isbn = bibkey.removeprefix("ISBN:")
+            books[isbn] = book
+
+            if self.cache is not None:
+                self.cache.set(self.booksApiUrl([isbn]), json.dumps(book))
+
+        return books
+
+    def booksApiUrl(self, isbns: List[str]) -> str:
+        """Url for looking up isbns with the open library books api"""
+        bibkeys = ",".join(f"ISBN:{isbn}" for isbn in isbns)
+        return f"{self.base_url}/api/books?bibkeys={bibkeys}&format=json&jscmd=data"
+
+    def isbnUrl(self, isbn: str) -> str:
+        """Url for the open library edition of isbn"""
+        return f"{self.base_url}/isbn/{isbn}.json"
+
+    def authorUrl(self, author_key: str) -> str:
+        """Url for open library author key, e.g. /authors/OL1387961A"""
+        return f"{self.base_url}{author_key}.json"
+
+    def get(self, url: str) -> "requests.Response":
+        """Make get request to url. Connection errors, timeouts and
+        rate limit or server error responses are retried with
+        exponential backoff, waiting for as long as the server asks
+        if a Retry-After header is sent. Once out of retries the
+        last error is raised."""
+        import requests
+
+        for attempt in range(self.retries + 1):
+            logging.debug("Request url: %s", url)
+
+            profiler.count("http_requests")
+
+            try:
+                with profiler.phase("http"):
+                    response = self.session.get(url, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.retries:
+                    raise
+                error = e
+                delay = self.backoff(attempt)
+            else:
+                if response.status_code not in RETRY_STATUS_CODES:
+                    if profiler.enabled:
+                        profiler.count("http_bytes", len(response.content))
+                    return response
+                if attempt == self.retries:
+                    response.raise_for_status()
+                error = f"{response.status_code} response"
+                delay = self.retryAfter(response)
+                if delay is None:
+                    delay = self.backoff(attempt)
+
+            logging.warning(
+                "Request to %s failed with %s, retrying in %.1f seconds",
+                url,
+                error,
+                delay,
+            )
+            profiler.count("http_retries")
+            with profiler.phase("retry_wait"):
+                time.sleep(delay)
+
+    @staticmethod
+    def backoff(attempt: int) -> float:
+        """Seconds to wait before retrying, picked at random up to
+        a limit that doubles with each attempt so clients that failed
+        together do not all retry together."""
+        return random.uniform(0, min(RETRY_MAX_BACKOFF, RETRY_BACKOFF * 2**attempt))
+
+    @staticmethod
+    def retryAfter(response: "requests.Response") -> float | None:
+        """Seconds to wait from Retry-After header of response,
+        which can be a number of seconds or a date."""
+        retry_after = response.headers.get("Retry-After")
+
+        if retry_after is None:
+            return None
+
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            from email.utils import parsedate_to_datetime
+
+            try:
+                retry_date = parsedate_to_datetime(retry_after)
+            except (TypeError, ValueError):
+                return None
+            delay = retry_date.timestamp() - time.time()
+
+        return min(RETRY_MAX_BACKOFF, max(0, delay))
+
+    def getAuthorName(self, author_key: str) -> str:
+        """Get author name from open library author key, e.g. /authors/OL1387961A.
+        Names are remembered for the lifetime of the client so each author
+        is only fetched once, even when several threads ask at the same time.
+        Authors in the index are not fetched from the open library."""
+        with self._authors_lock:
+            self.author_lookups += 1
+            author_future = self._authors.get(author_key)
+
+            if author_future is None:
+                from concurrent.futures import Future
+
+                author_future = Future()
+                self._authors[author_key] = author_future
+                fetch_author = True
+            else:
+                fetch_author = False
+
+        if not fetch_author:
+            return author_future.result()
+
+        try:
+            author = None
+            if self.index is not None:
+                author = self.index.getAuthorName(author_key)
+            if author is None:
+                author = self.getJSON(self.authorUrl(author_key))["name"]
+        except Exception as e:
+            # failures are not remembered so later lookups can try again
+            with self._authors_lock:
+                del self._authors[author_key]
+            author_future.set_exception(e)
+            raise
+
+        with self._authors_lock:
+            self.author_fetches += 1
+        author_future.set_result(author)
+
+        return author
+
+    @property
+    def author_fetches_saved(self) -> int:
+        """Number of author lookups served without fetching the author"""
+        return self.author_lookups - self.author_fetches
+
+    def logStats(self):
+        """Log how many requests were avoided by the index,
+        cache and author lookups"""
+        if self.index is not None:
+            logging.info(
+                "Open library index hits: %s, misses: %s",
+                self.index.hits,
+                self.index.misses,
+            )
+        if self.cache is not None:
+            logging.info(
+                "Open library cache hits: %s, misses: %s",
+                self.cache.hits,
+                self.cache.misses,
+            )
+        logging.info(
+            "Author lookups: %s, fetched: %s, saved: %s",
+            self.author_lookups,
+            self.author_fetches,
+            self.author_fetches_saved,
+        )
+
+    def close(self):
+        """Close the session and cache used by the client."""
+        if self._session is not None:
+            self._session.close()
+        if self.cache is not None:
+            self.cache.close()
+        if self.index is not None:
+            self.index.close()
+
+    def __repr__(self):
+        """Return a string of the expression that creates the object"""
+        return (
+            f"{self.__class__.__qualname__}({self.cache}, {self.refresh}, "
+            f"base_url={self.base_url!r})"
+        )
+
+
+_open_lib_client = None
+_open_lib_client_lock = threading.Lock()
+
+
+def get_open_lib_client() -> OpenLibClient:
+    """Return the client used for open library lookups. If one has
+    not been set a client using the default cache is created,
+    along with the default index if it has been built."""
+    global _open_lib_client
+
+    with _open_lib_client_lock:
+        if _open_lib_client is None:
+            os.makedirs(DATA_FOLDER, exist_ok=True)
+            _open_lib_client = OpenLibClient(
+                OpenLibCache(PATH_TO_CACHE), index=open_lib_index(PATH_TO_INDEX)
+            )
+
+        return _open_lib_client
+
+
+def set_open_lib_client(client: OpenLibClient):
+    """Set the client used for open library lookups."""
+    global _open_lib_client
+
+    with _open_lib_client_lock:
+        _open_lib_client = client
+
+
+# book metadata in the order of the database schema
+BOOK_FIELDS = (
+    "id",
+    "title",
+    "primary_author_key",
+    "primary_author",
+    "secondary_authors_keys",
+    "secondary_authors",
+    "isbn_13",
+    "edition_publish_date",
+    "number_of_pages",
+    "publisher",
+    "open_lib_key",
+    "goodreads_identifier",
+    "librarything_identifier",
+    "date_added",
+    "date_finished",
+    "comments",
 )
 
+# book metadata values default to blank, except dates which default to today
+BOOK_DEFAULTS = dict.fromkeys(BOOK_FIELDS, "")
+BOOK_DATE_FIELDS = ("date_added", "date_finished")
+
+# gets tuple of a book's values in the order of the database schema
+book_values = attrgetter(*BOOK_FIELDS)
+
 
 class Book:
-    """Class for individual book entries"""
+    """Class for individual book entries. Books are created for every
+    row of an import, so values are kept in slots rather than a dict."""
+
+    __slots__ = BOOK_FIELDS
 
     def __init__(self, book_metadata: Dict[str, str]):
         """Create new book object from book metadata or from isbn.
@@ -60,34 +1064,40 @@ class Book:
             logging.critical("No book metadata found")
             terminate_program()
 
-        book_metadata_default_schema = self.setDefaultDict()
-        book_metadata_default_schema.update(book_metadata)
-
-        book_metadata = book_metadata_default_schema
-
-        self.id = book_metadata["id"]
-        self.title = book_metadata["title"]
-        self.primary_author_key = book_metadata["primary_author_key"]
-        self.primary_author = book_metadata["primary_author"]
-        self.secondary_authors_keys = book_metadata["secondary_authors_keys"]
-        self.secondary_authors = book_metadata["secondary_authors"]
-        self.isbn_13 = book_metadata["isbn_13"]
-        self.edition_publish_date = book_metadata["edition_publish_date"]
-        self.number_of_pages = book_metadata["number_of_pages"]
-        self.publisher = book_metadata["publisher"]
-        self.open_lib_key = book_metadata["open_lib_key"]
-        self.goodreads_identifier = book_metadata["goodreads_identifier"]
-        self.librarything_identifier = book_metadata["librarything_identifier"]
-        self.date_added = book_metadata["date_added"]
-        self.date_finished = book_metadata["date_finished"]
-        self.comments = book_metadata["comments"]
-
-        # these are stored for debugging
-        self.complete_book_metadata = book_metadata
-
-        logging.debug("Book init, complete metadata: %s", self.complete_book_metadata)
+        # missing values are blank, without copying into a default dict
+        get = book_metadata.get
 
-        logging.debug(self.__repr__())
+        self.id = get("id", "")
+        self.title = get("title", "")
+        self.primary_author_key = get("primary_author_key", "")
+        self.primary_author = get("primary_author", "")
+        self.secondary_authors_keys = get("secondary_authors_keys", "")
+        self.secondary_authors = get("secondary_authors", "")
+        self.isbn_13 = get("isbn_13", "")
+        self.edition_publish_date = get("edition_publish_date", "")
+        self.number_of_pages = get("number_of_pages", "")
+        self.publisher = get("publisher", "")
+        self.open_lib_key = get("open_lib_key", "")
+        self.goodreads_identifier = get("goodreads_identifier", "")
+        self.librarything_identifier = get("librarything_identifier", "")
+        self.comments = get("comments", "")
+
+        # only look up today's date when a date is missing
+        if "date_added" in book_metadata and "date_finished" in book_metadata:
+            self.date_added = book_metadata["date_added"]
+            self.date_finished = book_metadata["date_finished"]
+        else:
+            datestamp = date.today().isoformat()
+            self.date_added = get("date_added", datestamp)
+            self.date_finished = get("date_finished", datestamp)
+
+        # repr is only made if debug logging is on
+        logging.debug("%r", self)
+
+    @property
+    def complete_book_metadata(self) -> Dict[str, str]:
+        """Dictionary of book metadata in the database schema"""
+        return dict(zip(BOOK_FIELDS, book_values(self)))
 
     @staticmethod
     def setDefaultDict():
@@ -99,42 +1109,37 @@ class Book:
 
         # define datestamp to be used for default date values
         # if dates are not supplied
-        datestamp = datetime.today().strftime("%Y-%m-%d")
-
-        default_dict = {
-            "id": "",
-            "title": "",
-            "primary_author_key": "",
-            "primary_author": "",
-            "secondary_authors_keys": "",
-            "secondary_authors": "",
-            "isbn_13": "",
-            "edition_publish_date": "",
-            "number_of_pages": "",
-            "publisher": "",
-            "open_lib_key": "",
-            "goodreads_identifier": "",
-            "librarything_identifier": "",
-            "date_added": datestamp,
-            "date_finished": datestamp,
-            "comments": "",
-        }
+        datestamp = date.today().isoformat()
 
         book_metadata_default_schema = defaultdict()
-        book_metadata_default_schema.update(default_dict)
+        book_metadata_default_schema.update(BOOK_DEFAULTS)
+        for field in BOOK_DATE_FIELDS:
+            book_metadata_default_schema[field] = datestamp
         return book_metadata_default_schema
 
     @classmethod
-    def openLibIsbnSearch(cls, isbn: str) -> Dict[str, str] | None:
-        """get data back from open library api via isbn"""
-        url = f"https://openlibrary.org/isbn/{isbn}.json"
+    def openLibIsbnSearch(
+        cls, isbn: str, client: OpenLibClient | None = None
+    ) -> Dict[str, str] | None:
+        """get data back from open library api via isbn.
+        Requests are made with the shared open library client
+        unless a client is passed."""
+        if client is None:
+            client = get_open_lib_client()
 
-        logging.debug("Request url: %s", url)
+        profiler.count("isbn_lookups")
 
         # get response as json
-        response = requests.get(url)
-        open_lib_data = response.json()
+        open_lib_data = client.getEdition(isbn)
+
+        return cls.editionMetadata(isbn, open_lib_data, client)
 
+    @staticmethod
+    def editionMetadata(
+        isbn: str, open_lib_data: dict, client: OpenLibClient
+    ) -> Dict[str, str] | None:
+        """Convert edition data from the open library isbn api
+        into book metadata, looking up author names with client."""
         try:
             # authors goes via different page
             authors_open_lib_keys = open_lib_data["authors"]
@@ -146,27 +1151,14 @@ class Book:
         secondary_authors = ""
         secondary_authors_keys = ""
 
-        if len(authors_open_lib_keys) == 1:
-            author_key = authors_open_lib_keys[0]["key"]
-            author_url = "https://openlibrary.org" + author_key + ".json"
-
-            response = requests.get(author_url)
-            response_dict = response.json()
-            author = response_dict["name"]
-        else:
-            for count, author in enumerate(authors_open_lib_keys):
-                if count == 0:
-                    continue
-                author_key = authors_open_lib_keys[count]["key"]
-
-                author_url = "https://openlibrary.org" + author_key + ".json"
+        author = client.getAuthorName(authors_open_lib_keys[0]["key"])
 
-                response = requests.get(author_url)
-                response_dict = response.json()
-                author = response_dict["name"]
+        for secondary_author_open_lib_key in authors_open_lib_keys[1:]:
+            author_key = secondary_author_open_lib_key["key"]
+            secondary_author = client.getAuthorName(author_key)
 
-                secondary_authors = secondary_authors + ", " + author
-                secondary_authors_keys = secondary_authors_keys + ", " + author_key
+            secondary_authors = secondary_authors + ", " + secondary_author
+            secondary_authors_keys = secondary_authors_keys + ", " + author_key
 
         # not every title has goodreads / librarything identifiers
         # so set to blank if they don't exist
@@ -210,22 +1202,114 @@ class Book:
 
         return book_metadata
 
-    @staticmethod
-    def validateISBN(isbn: str) -> bool:
-        """Test for valid isbn"""
-        isbn = isbn.strip()
+    @classmethod
+    def openLibBatchSearch(
+        cls, isbns: List[str], client: OpenLibClient | None = None
+    ) -> Dict[str, Dict[str, str] | None]:
+        """get data back from open library books api for many isbns
+        with a single request. Requests are made with the shared
+        open library client unless a client is passed.
+        Returns dictionary of isbn to book metadata, in the same format
+        as openLibIsbnSearch, with None for isbns that couldn't be found."""
+        if client is None:
+            client = get_open_lib_client()
 
-        if isbn.isdigit() is False:
-            logging.critical("ISBN contains characters that aren't numbers")
-            return False
-        else:
-            if len(isbn) == 13:
-                return True
-            else:
-                logging.info("ISBN is invalid length")
-                return False
+        profiler.count("isbn_lookups", len(isbns))
+        books_metadata = {}
 
-    def addComments(self):
+        # only isbns missing from the index are requested
+        if client.index is not None:
+            for isbn in isbns:
+                open_lib_data = client.index.getEdition(isbn)
+                if open_lib_data is not None:
+                    books_metadata[isbn] = cls.editionMetadata(
+                        isbn, open_lib_data, client
+                    )
+
+        open_lib_books = client.getBooksByIsbn(
+            [isbn for isbn in isbns if isbn not in books_metadata]
+        )
+
+        for isbn in isbns:
+            if isbn in books_metadata:
+                continue
+
+            open_lib_data = open_lib_books.get(isbn)
+
+            if open_lib_data is None:
+                logging.critical("%s not found in open library", isbn)
+                books_metadata[isbn] = None
+            else:
+                books_metadata[isbn] = cls.booksApiMetadata(isbn, open_lib_data)
+
+        return books_metadata
+
+    @staticmethod
+    def booksApiMetadata(isbn: str, open_lib_data: dict) -> Dict[str, str] | None:
+        """Convert edition data from the open library books api
+        into book metadata. The books api includes author names
+        so no further requests are needed."""
+        try:
+            authors = open_lib_data["authors"]
+        except KeyError as e:
+            logging.critical("No author for %s in open library: %s", isbn, e)
+            return None
+
+        # author urls are in the form of
+        # https://openlibrary.org/authors/OL1387961A/Susanna_Clarke
+        authors_keys = [
+            "/authors/" + urlparse(author["url"]).path.split("/")[2]
+            for author in authors
+        ]
+
+        secondary_authors = ""
+        secondary_authors_keys = ""
+
+        for author_key, author in zip(authors_keys[1:], authors[1:]):
+            secondary_authors = secondary_authors + ", " + author["name"]
+            secondary_authors_keys = secondary_authors_keys + ", " + author_key
+
+        identifiers = open_lib_data.get("identifiers", {})
+
+        try:
+            book_metadata = {
+                "title": open_lib_data["title"],
+                "primary_author_key": authors_keys[0],
+                "primary_author": authors[0]["name"],
+                "secondary_authors_keys": secondary_authors_keys,
+                "secondary_authors": secondary_authors,
+                "isbn_13": isbn,
+                "edition_publish_date": open_lib_data["publish_date"],
+                "number_of_pages": open_lib_data.get("number_of_pages", ""),
+                "publisher": open_lib_data["publishers"][0]["name"],
+                "open_lib_key": open_lib_data["key"],
+                "goodreads_identifier": identifiers.get("goodreads", [""])[0],
+                "librarything_identifier": identifiers.get("librarything", [""])[0],
+            }
+        except (KeyError, IndexError) as e:
+            logging.critical("Key value not found for %s: %s", isbn, e)
+            return None
+
+        logging.debug("Book_metadata returned: %s", book_metadata)
+
+        return book_metadata
+
+    @staticmethod
+    def validateISBN(isbn: str) -> bool:
+        """Test for valid isbn"""
+        isbn = isbn.strip()
+
+        if isbn.isdigit() is False:
+            logging.critical("ISBN contains characters that aren't numbers")
+            return False
+        else:
+            if len(isbn) == 13:
+                return True
+            else:
+                logging.info("ISBN is invalid length")
+                return False
+
+    def addComments(self):
         """Check to add comments to book object"""
         comments = input(
             f"""Would you like to add any comments for {self}?
@@ -246,34 +1330,675 @@ Press enter to skip. Otherwise type comments below:
 
     def __iter__(self):
         """Create iterable of book metadata."""
-        return iter(
-            [
-                self.id,
-                self.title,
-                self.primary_author_key,
-                self.primary_author,
-                self.secondary_authors_keys,
-                self.secondary_authors,
-                self.isbn_13,
-                self.edition_publish_date,
-                self.number_of_pages,
-                self.publisher,
-                self.open_lib_key,
-                self.goodreads_identifier,
-                self.librarything_identifier,
-                self.date_added,
-                self.date_finished,
-                self.comments,
-            ]
+        return iter(book_values(self))
+
+
+class BookRow:
+    """Read only view of a book row from the database. Values are read
+    from the sqlite3.Row when used rather than copied, so query results
+    can be shown without making a Book for each row."""
+
+    __slots__ = ("row",)
+
+    def __init__(self, row: sqlite3.Row):
+        self.row = row
+
+    def __getattr__(self, name: str):
+        """Get book metadata value from row by name, e.g. view.title"""
+        if name in BOOK_DEFAULTS:
+            return self.row[name]
+        raise AttributeError(
+            f"{self.__class__.__qualname__!r} object has no attribute {name!r}"
+        )
+
+    @property
+    def complete_book_metadata(self) -> Dict[str, str]:
+        """Dictionary of book metadata in the database schema"""
+        return {field: self.row[field] for field in BOOK_FIELDS}
+
+    def toBook(self) -> Book:
+        """Copy row into a Book that can be changed"""
+        return Book(self.complete_book_metadata)
+
+    def __repr__(self):
+        """Return a string of the expression that creates the object"""
+        return f"{self.__class__.__qualname__}({self.complete_book_metadata})"
+
+    __str__ = Book.__str__
+
+    def __iter__(self):
+        """Create iterable of book metadata."""
+        return (self.row[field] for field in BOOK_FIELDS)
+
+
+def migrate_typed_columns(cursor: sqlite3.Cursor):
+    """Rebuild bookshelves table with typed columns"""
+    table_info = cursor.execute("""PRAGMA table_info('bookshelves')""").fetchall()
+
+    # databases created after this migration already have typed columns
+    if all(column["type"] for column in table_info):
+        return
+
+    cursor.execute(
+        """CREATE TABLE bookshelves_typed(id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT, primary_author_key TEXT, primary_author TEXT, secondary_authors_keys TEXT, secondary_authors TEXT, isbn_13 TEXT, edition_publish_date TEXT, number_of_pages INTEGER, publisher TEXT, open_lib_key TEXT, goodreads_identifier TEXT, librarything_identifier TEXT, date_added TEXT, date_finished TEXT, comments TEXT)"""
+    )
+    cursor.execute(
+        """INSERT INTO bookshelves_typed (id, title, primary_author_key, primary_author, secondary_authors_keys, secondary_authors, isbn_13, edition_publish_date, number_of_pages, publisher, open_lib_key, goodreads_identifier, librarything_identifier, date_added, date_finished, comments) SELECT id, title, primary_author_key, primary_author, secondary_authors_keys, secondary_authors, isbn_13, edition_publish_date, number_of_pages, publisher, open_lib_key, goodreads_identifier, librarything_identifier, date_added, date_finished, comments FROM bookshelves"""
+    )
+    # ids of deleted rows are still never reused
+    cursor.execute(
+        """INSERT INTO sqlite_sequence (name, seq) SELECT 'bookshelves_typed', 0 WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'bookshelves_typed')"""
+    )
+    cursor.execute(
+        """UPDATE sqlite_sequence SET seq = max(seq, ifnull((SELECT seq FROM sqlite_sequence WHERE name = 'bookshelves'), 0)) WHERE name = 'bookshelves_typed'"""
+    )
+    cursor.execute("""DROP TABLE bookshelves""")
+    cursor.execute("""ALTER TABLE bookshelves_typed RENAME TO bookshelves""")
+
+
+def migrate_lookup_indexes(cursor: sqlite3.Cursor):
+    """Add indexes on isbn_13, title, primary_author and date_finished"""
+    for column in ["isbn_13", "title", "primary_author", "date_finished"]:
+        cursor.execute(
+            f"""CREATE INDEX IF NOT EXISTS bookshelves_{column} ON bookshelves({column})"""
+        )
+
+
+def read_count_statements(new_id: str = "new.id") -> Tuple[str, str]:
+    """SQL for triggers counting the new row in the read count tables,
+    and uncounting the old row. new_id is the id of the new row."""
+    add_read = f"""
+        INSERT INTO read_counts (title, read_count, last_id) VALUES (ifnull(new.title, ''), 1, {new_id})
+            ON CONFLICT(title) DO UPDATE SET read_count = read_count + 1, last_id = max(last_id, excluded.last_id);
+        INSERT INTO year_read_counts (year, title, read_count, last_id) VALUES (ifnull(substr(new.date_finished, 1, 4), ''), ifnull(new.title, ''), 1, {new_id})
+            ON CONFLICT(year, title) DO UPDATE SET read_count = read_count + 1, last_id = max(last_id, excluded.last_id);
+    """
+    remove_read = """
+        UPDATE read_counts SET read_count = read_count - 1, last_id = ifnull((SELECT max(id) FROM bookshelves WHERE title = old.title), last_id)
+            WHERE title = ifnull(old.title, '');
+        DELETE FROM read_counts WHERE title = ifnull(old.title, '') AND read_count <= 0;
+        UPDATE year_read_counts SET read_count = read_count - 1, last_id = ifnull((SELECT max(id) FROM bookshelves WHERE title = old.title AND substr(date_finished, 1, 4) = year), last_id)
+            WHERE year = ifnull(substr(old.date_finished, 1, 4), '') AND title = ifnull(old.title, '');
+        DELETE FROM year_read_counts WHERE year = ifnull(substr(old.date_finished, 1, 4), '') AND title = ifnull(old.title, '') AND read_count <= 0;
+    """
+    return add_read, remove_read
+
+
+def migrate_read_counts(cursor: sqlite3.Cursor):
+    """Add read count tables kept up to date by triggers"""
+    # last_id is the newest row read for each title, used to show the book
+    cursor.execute(
+        """CREATE TABLE read_counts(title TEXT PRIMARY KEY, read_count INTEGER NOT NULL, last_id INTEGER NOT NULL)"""
+    )
+    cursor.execute("""CREATE INDEX read_counts_read_count ON read_counts(read_count)""")
+    cursor.execute(
+        """CREATE TABLE year_read_counts(year TEXT NOT NULL, title TEXT NOT NULL, read_count INTEGER NOT NULL, last_id INTEGER NOT NULL, PRIMARY KEY (year, title))"""
+    )
+    cursor.execute(
+        """CREATE INDEX year_read_counts_read_count ON year_read_counts(year, read_count)"""
+    )
+
+    cursor.execute(
+        """INSERT INTO read_counts (title, read_count, last_id) SELECT ifnull(title, ''), count(*), max(id) FROM bookshelves GROUP BY ifnull(title, '')"""
+    )
+    cursor.execute(
+        """INSERT INTO year_read_counts (year, title, read_count, last_id) SELECT ifnull(substr(date_finished, 1, 4), ''), ifnull(title, ''), count(*), max(id) FROM bookshelves GROUP BY 1, 2"""
+    )
+
+    add_read, remove_read = read_count_statements()
+
+    cursor.execute(
+        f"""CREATE TRIGGER bookshelves_read_counts_insert AFTER INSERT ON bookshelves BEGIN {add_read} END"""
+    )
+    cursor.execute(
+        f"""CREATE TRIGGER bookshelves_read_counts_delete AFTER DELETE ON bookshelves BEGIN {remove_read} END"""
+    )
+    cursor.execute(
+        f"""CREATE TRIGGER bookshelves_read_counts_update AFTER UPDATE OF title, date_finished ON bookshelves BEGIN {remove_read} {add_read} END"""
+    )
+
+
+def full_text_statements(new_id: str = "new.id") -> Tuple[str, str]:
+    """SQL for triggers adding the new row to the full text search table,
+    and removing the old row. new_id is the id of the new row."""
+    add_text = f"""
+        INSERT INTO bookshelves_fts (rowid, title, primary_author, secondary_authors, publisher, comments)
+            VALUES ({new_id}, new.title, new.primary_author, new.secondary_authors, new.publisher, new.comments);
+    """
+    remove_text = """
+        INSERT INTO bookshelves_fts (bookshelves_fts, rowid, title, primary_author, secondary_authors, publisher, comments)
+            VALUES ('delete', old.id, old.title, old.primary_author, old.secondary_authors, old.publisher, old.comments);
+    """
+    return add_text, remove_text
+
+
+def migrate_full_text_search(cursor: sqlite3.Cursor):
+    """Add full text search table kept up to date by triggers"""
+    # external content table so the text isn't stored twice
+    cursor.execute(
+        """CREATE VIRTUAL TABLE bookshelves_fts USING fts5(title, primary_author, secondary_authors, publisher, comments, content='bookshelves', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3')"""
+    )
+    cursor.execute(
+        """INSERT INTO bookshelves_fts (bookshelves_fts) VALUES ('rebuild')"""
+    )
+
+    add_text, remove_text = full_text_statements()
+
+    cursor.execute(
+        f"""CREATE TRIGGER bookshelves_fts_insert AFTER INSERT ON bookshelves BEGIN {add_text} END"""
+    )
+    cursor.execute(
+        f"""CREATE TRIGGER bookshelves_fts_delete AFTER DELETE ON bookshelves BEGIN {remove_text} END"""
+    )
+    cursor.execute(
+        f"""CREATE TRIGGER bookshelves_fts_update AFTER UPDATE OF title, primary_author, secondary_authors, publisher, comments ON bookshelves BEGIN {remove_text} {add_text} END"""
+    )
+
+
+# pages of a book row for reading stats, with missing or invalid values as 0
+STATS_PAGES = "max(ifnull(CAST({row}.number_of_pages AS INTEGER), 0), 0)"
+
+# stats tables with the expression each row is grouped by
+STATS_GROUPS = {
+    "monthly_stats": {
+        "year": "ifnull(substr({row}.date_finished, 1, 4), '')",
+        "month": "ifnull(substr({row}.date_finished, 6, 2), '')",
+    },
+    "author_stats": {"primary_author": "ifnull({row}.primary_author, '')"},
+    "publisher_stats": {"publisher": "ifnull({row}.publisher, '')"},
+}
+
+
+def reading_stats_statements() -> Tuple[str, str]:
+    """SQL for triggers adding the new row to the reading stats tables,
+    and removing the old row"""
+    add_read = ""
+    remove_read = ""
+
+    for table, groups in STATS_GROUPS.items():
+        columns = ", ".join(groups)
+        new_groups = [expression.format(row="new") for expression in groups.values()]
+        new_pages = STATS_PAGES.format(row="new")
+        add_read += f"""
+            INSERT INTO {table} ({columns}, books, pages, paged_books) VALUES ({", ".join(new_groups)}, 1, {new_pages}, {new_pages} > 0)
+                ON CONFLICT({columns}) DO UPDATE SET books = books + 1, pages = pages + excluded.pages, paged_books = paged_books + excluded.paged_books;
+        """
+
+        old_match = " AND ".join(
+            f"{column} = {expression.format(row='old')}"
+            for column, expression in groups.items()
+        )
+        old_pages = STATS_PAGES.format(row="old")
+        remove_read += f"""
+            UPDATE {table} SET books = books - 1, pages = pages - {old_pages}, paged_books = paged_books - ({old_pages} > 0) WHERE {old_match};
+            DELETE FROM {table} WHERE {old_match} AND books <= 0;
+        """
+
+    return add_read, remove_read
+
+
+def migrate_reading_stats(cursor: sqlite3.Cursor):
+    """Add reading stats tables kept up to date by triggers"""
+    for table, groups in STATS_GROUPS.items():
+        columns = ", ".join(groups)
+        # paged_books counts books with a page count, for average length
+        cursor.execute(
+            f"""CREATE TABLE {table}({", ".join(f"{column} TEXT NOT NULL" for column in groups)}, books INTEGER NOT NULL, pages INTEGER NOT NULL, paged_books INTEGER NOT NULL, PRIMARY KEY ({columns}))"""
+        )
+
+        select_groups = ", ".join(
+            expression.format(row="bookshelves") for expression in groups.values()
         )
+        pages = STATS_PAGES.format(row="bookshelves")
+        cursor.execute(
+            f"""INSERT INTO {table} ({columns}, books, pages, paged_books) SELECT {select_groups}, count(*), sum({pages}), sum({pages} > 0) FROM bookshelves GROUP BY {select_groups}"""
+        )
+
+    add_read, remove_read = reading_stats_statements()
+
+    cursor.execute(
+        f"""CREATE TRIGGER bookshelves_stats_insert AFTER INSERT ON bookshelves BEGIN {add_read} END"""
+    )
+    cursor.execute(
+        f"""CREATE TRIGGER bookshelves_stats_delete AFTER DELETE ON bookshelves BEGIN {remove_read} END"""
+    )
+    cursor.execute(
+        f"""CREATE TRIGGER bookshelves_stats_update AFTER UPDATE OF date_finished, number_of_pages, primary_author, publisher ON bookshelves BEGIN {remove_read} {add_read} END"""
+    )
+
+
+def migrate_import_checkpoints(cursor: sqlite3.Cursor):
+    """Add table recording progress of csv imports, so they can be resumed"""
+    cursor.execute(
+        """CREATE TABLE import_checkpoints(file_hash TEXT PRIMARY KEY, path TEXT NOT NULL, rows_done INTEGER NOT NULL, done_after TEXT NOT NULL, updated_at TEXT NOT NULL)"""
+    )
+
+
+def migrate_failed_imports(cursor: sqlite3.Cursor):
+    """Add table of failed imports, with the class of error
+    so transient failures can be retried"""
+    cursor.execute(
+        """CREATE TABLE failed_imports(id INTEGER PRIMARY KEY, run_id TEXT NOT NULL, isbn_13 TEXT, row TEXT NOT NULL, error_class TEXT NOT NULL, error_message TEXT NOT NULL, transient INTEGER NOT NULL, failed_at TEXT NOT NULL)"""
+    )
+    cursor.execute("""CREATE INDEX failed_imports_run_id ON failed_imports(run_id)""")
+    cursor.execute(
+        """CREATE INDEX failed_imports_transient ON failed_imports(transient)"""
+    )
+
+
+# columns of the bookshelves view stored once for each edition
+EDITION_FIELDS = (
+    "title",
+    "isbn_13",
+    "edition_publish_date",
+    "number_of_pages",
+    "publisher",
+    "open_lib_key",
+    "goodreads_identifier",
+    "librarything_identifier",
+)
+
+# columns of the bookshelves view stored for each read of an edition
+READ_FIELDS = ("date_added", "date_finished", "comments")
+
+# secondary authors of an edition joined back into a list, blank entries
+# have no author. Lists kept unsplit on the edition are used as they are
+SECONDARY_AUTHORS = """CASE WHEN editions.unsplit_secondary_authors_keys IS NOT NULL OR editions.unsplit_secondary_authors IS NOT NULL THEN editions.unsplit_{column} ELSE (SELECT group_concat(CASE WHEN edition_authors.author_id IS NULL THEN '' ELSE authors.{author_column} END, ', ') FROM edition_authors LEFT JOIN authors ON authors.id = edition_authors.author_id WHERE edition_authors.edition_id = editions.id AND edition_authors.position > 0) END"""
+
+# primary author of an edition, with a blank entry having no author
+PRIMARY_AUTHOR = """CASE WHEN primary_author.edition_id IS NOT NULL AND primary_author.author_id IS NULL THEN '' ELSE author.{column} END"""
+
+# reads of editions by a primary author, found through the authors_name and
+# edition_authors_author_id indexes. Filtering the primary_author column of
+# the bookshelves view instead scans every read, as the column is computed
+PRIMARY_AUTHOR_READS = """FROM authors JOIN edition_authors ON edition_authors.author_id = authors.id AND edition_authors.position = 0 JOIN reads ON reads.edition_id = edition_authors.edition_id WHERE authors.name = ?"""
+
+
+def authors_json_sql(value: str) -> str:
+    """SQL making a json array of the entries in a list of authors joined
+    with ", ". The value is quoted as json first, so no name can break it."""
+    return f"""(CASE WHEN {value} IS NULL THEN '[]' ELSE '[' || replace(json_quote(CAST({value} AS TEXT)), ', ', '", "') || ']' END)"""
+
+
+def secondary_authors_split_sql() -> str:
+    """SQL condition that the secondary author keys and names of the new
+    row split into lists of the same length, so they can be paired"""
+    keys = authors_json_sql("new.secondary_authors_keys")
+    names = authors_json_sql("new.secondary_authors")
+    return f"""json_array_length({keys}) = json_array_length({names})"""
+
+
+def new_authors_sql() -> str:
+    """SQL table of the position, key and name of each author of the new
+    row, with the primary author at position 0. Secondary author keys
+    and names are paired by position. Lists of different lengths, like
+    a name including ", ", can't be paired so have no authors and are
+    kept unsplit on the edition instead."""
+    keys = authors_json_sql("new.secondary_authors_keys")
+    names = authors_json_sql("new.secondary_authors")
+    return f"""(
+        SELECT 0 AS position, new.primary_author_key AS author_key, new.primary_author AS name
+            WHERE new.primary_author_key IS NOT NULL OR new.primary_author IS NOT NULL
+        UNION ALL
+        SELECT entries.key + 1, entries.value, json_extract({names}, '$[' || entries.key || ']')
+            FROM json_each({keys}) AS entries WHERE {secondary_authors_split_sql()}
+    )"""
+
+
+def migrate_normalized_schema(cursor: sqlite3.Cursor):
+    """Split bookshelves table into editions, authors and reads"""
+    cursor.execute(
+        """CREATE TABLE authors(id INTEGER PRIMARY KEY, author_key TEXT, name TEXT)"""
+    )
+    # authors are keyed by key and name together, as editions can spell the
+    # name of the same open library author differently and rows must be
+    # read back as they were written
+    cursor.execute(
+        """CREATE UNIQUE INDEX authors_author_key ON authors(author_key, name)"""
+    )
+    cursor.execute("""CREATE INDEX authors_name ON authors(name)""")
+    cursor.execute(
+        """CREATE TABLE editions(id INTEGER PRIMARY KEY, title TEXT, isbn_13 TEXT, edition_publish_date TEXT, number_of_pages INTEGER, publisher TEXT, open_lib_key TEXT, goodreads_identifier TEXT, librarything_identifier TEXT, unsplit_secondary_authors_keys TEXT, unsplit_secondary_authors TEXT)"""
+    )
+    cursor.execute("""CREATE INDEX editions_isbn_13 ON editions(isbn_13, title)""")
+    cursor.execute("""CREATE INDEX editions_title ON editions(title)""")
+    # position 0 is the primary author, blank entries have no author_id
+    cursor.execute(
+        """CREATE TABLE edition_authors(edition_id INTEGER NOT NULL, position INTEGER NOT NULL, author_id INTEGER, PRIMARY KEY (edition_id, position)) WITHOUT ROWID"""
+    )
+    cursor.execute(
+        """CREATE INDEX edition_authors_author_id ON edition_authors(author_id, position)"""
+    )
+    cursor.execute(
+        """CREATE TABLE reads(id INTEGER PRIMARY KEY AUTOINCREMENT, edition_id INTEGER NOT NULL, date_added TEXT, date_finished TEXT, comments TEXT)"""
+    )
+    cursor.execute("""CREATE INDEX reads_edition_id ON reads(edition_id)""")
+    cursor.execute("""CREATE INDEX reads_date_finished ON reads(date_finished)""")
+
+    # the bookshelves table is replaced by a view of the same columns
+    for trigger in ["read_counts", "fts", "stats"]:
+        for event in ["insert", "delete", "update"]:
+            cursor.execute(f"""DROP TRIGGER bookshelves_{trigger}_{event}""")
+    cursor.execute("""ALTER TABLE bookshelves RENAME TO bookshelves_unnormalized""")
+
+    edition_columns = ", ".join(f"editions.{field}" for field in EDITION_FIELDS)
+    cursor.execute(
+        f"""CREATE VIEW edition_details AS SELECT editions.id, {PRIMARY_AUTHOR.format(column="author_key")} AS primary_author_key, {PRIMARY_AUTHOR.format(column="name")} AS primary_author, {SECONDARY_AUTHORS.format(column="secondary_authors_keys", author_column="author_key")} AS secondary_authors_keys, {SECONDARY_AUTHORS.format(column="secondary_authors", author_column="name")} AS secondary_authors, {edition_columns} FROM editions LEFT JOIN edition_authors AS primary_author ON primary_author.edition_id = editions.id AND primary_author.position = 0 LEFT JOIN authors AS author ON author.id = primary_author.author_id"""
+    )
+    cursor.execute(
+        f"""CREATE VIEW bookshelves AS SELECT {", ".join(f"reads.{field}" if field in ("id",) + READ_FIELDS else f"edition_details.{field}" for field in BOOK_FIELDS)} FROM reads JOIN edition_details ON edition_details.id = reads.edition_id"""
+    )
+
+    # editions are never changed once written, a changed row is written
+    # as a new edition, so reads of the same edition that differ are kept
+    new_edition = " AND ".join(
+        f"edition_details.{field} IS new.{field}"
+        for field in BOOK_FIELDS
+        if field not in ("id",) + READ_FIELDS
+    )
+    new_edition_id = (
+        f"(SELECT edition_details.id FROM edition_details WHERE {new_edition})"
+    )
+    new_authors = new_authors_sql()
+    unsplit = (
+        f"""CASE WHEN NOT {secondary_authors_split_sql()} THEN new.{{column}} END"""
+    )
+    author_id = """(SELECT authors.id FROM authors WHERE authors.author_key IS new_author.author_key AND authors.name IS new_author.name)"""
+    # authors are only looked at when the edition is new, when is a
+    # condition on the row, and changes() is the number of editions added
+    write_edition = f"""
+        INSERT INTO authors (author_key, name)
+            SELECT DISTINCT author_key, name FROM {new_authors} AS new_author
+            WHERE {{when}} AND {new_edition_id} IS NULL AND NOT (author_key IS '' AND name IS '') AND {author_id} IS NULL;
+        INSERT INTO editions ({", ".join(EDITION_FIELDS)}, unsplit_secondary_authors_keys, unsplit_secondary_authors)
+            SELECT {", ".join(f"new.{field}" for field in EDITION_FIELDS)}, {unsplit.format(column="secondary_authors_keys")}, {unsplit.format(column="secondary_authors")}
+            WHERE {{when}} AND {new_edition_id} IS NULL;
+        INSERT INTO edition_authors (edition_id, position, author_id)
+            SELECT last_insert_rowid(), position, CASE WHEN author_key IS '' AND name IS '' THEN NULL ELSE {author_id} END
+            FROM {new_authors} AS new_author WHERE changes() > 0;
+    """
+
+    # editions no other read is of are removed with the read,
+    # along with their authors that no other edition has
+    old_edition_id = """(SELECT reads.edition_id FROM reads WHERE reads.id = old.id)"""
+    remove_edition = """
+        DELETE FROM authors WHERE {when} AND {old_edition_id} IS NOT {keep_edition_id}
+            AND id IN (SELECT author_id FROM edition_authors WHERE edition_id = {old_edition_id})
+            AND NOT EXISTS (SELECT 1 FROM reads WHERE reads.edition_id = {old_edition_id} AND reads.id != old.id)
+            AND NOT EXISTS (SELECT 1 FROM edition_authors WHERE edition_authors.author_id = authors.id AND edition_authors.edition_id != {old_edition_id});
+        DELETE FROM edition_authors WHERE {when} AND edition_id = {old_edition_id} AND edition_id IS NOT {keep_edition_id}
+            AND NOT EXISTS (SELECT 1 FROM reads WHERE reads.edition_id = edition_authors.edition_id AND reads.id != old.id);
+        DELETE FROM editions WHERE {when} AND id = {old_edition_id} AND id IS NOT {keep_edition_id}
+            AND NOT EXISTS (SELECT 1 FROM reads WHERE reads.edition_id = editions.id AND reads.id != old.id);
+    """
+    edition_changed = (
+        "NOT ("
+        + " AND ".join(
+            f"old.{field} IS new.{field}"
+            for field in BOOK_FIELDS
+            if field not in ("id",) + READ_FIELDS
+        )
+        + ")"
+    )
+
+    read_columns = ", ".join(READ_FIELDS)
+    # new rows without an id are given the next id by sqlite
+    new_id = "ifnull(new.id, (SELECT max(id) FROM reads))"
+    add_read, remove_read = read_count_statements()
+    add_text, remove_text = full_text_statements()
+    add_stats, remove_stats = reading_stats_statements()
+    insert_read_count, _ = read_count_statements(new_id)
+    insert_text, _ = full_text_statements(new_id)
+
+    cursor.execute(
+        f"""CREATE TRIGGER bookshelves_insert INSTEAD OF INSERT ON bookshelves WHEN NOT EXISTS (SELECT 1 FROM reads WHERE id = new.id) BEGIN
+            {write_edition.format(when="true")}
+            INSERT INTO reads (id, edition_id, {read_columns}) VALUES (new.id, {new_edition_id}, {", ".join(f"new.{field}" for field in READ_FIELDS)});
+            {insert_read_count} {insert_text} {add_stats}
+        END"""
+    )
+    # inserting a row with an existing id updates it, like an upsert,
+    # unless the row is unchanged
+    unchanged = " AND ".join(f"{field} IS new.{field}" for field in BOOK_FIELDS)
+    cursor.execute(
+        f"""CREATE TRIGGER bookshelves_upsert INSTEAD OF INSERT ON bookshelves WHEN EXISTS (SELECT 1 FROM reads WHERE id = new.id) AND NOT EXISTS (SELECT 1 FROM bookshelves WHERE {unchanged}) BEGIN
+            UPDATE bookshelves SET {", ".join(f"{field} = new.{field}" for field in BOOK_FIELDS[1:])} WHERE id = new.id;
+        END"""
+    )
+    cursor.execute(
+        f"""CREATE TRIGGER bookshelves_update INSTEAD OF UPDATE ON bookshelves BEGIN
+            {write_edition.format(when=edition_changed)}
+            {remove_edition.format(when=edition_changed, old_edition_id=old_edition_id, keep_edition_id=new_edition_id)}
+            UPDATE reads SET id = new.id, edition_id = CASE WHEN {edition_changed} THEN {new_edition_id} ELSE edition_id END, {", ".join(f"{field} = new.{field}" for field in READ_FIELDS)} WHERE id = old.id;
+            {remove_read} {add_read} {remove_text} {add_text} {remove_stats} {add_stats}
+        END"""
+    )
+    cursor.execute(
+        f"""CREATE TRIGGER bookshelves_delete INSTEAD OF DELETE ON bookshelves BEGIN
+            {remove_edition.format(when="true", old_edition_id=old_edition_id, keep_edition_id="NULL")}
+            DELETE FROM reads WHERE id = old.id;
+            {remove_read} {remove_text} {remove_stats}
+        END"""
+    )
+
+    # counts are made again as the rows are written through the view
+    cursor.execute("""DELETE FROM read_counts""")
+    cursor.execute("""DELETE FROM year_read_counts""")
+    for table in STATS_GROUPS:
+        cursor.execute(f"""DELETE FROM {table}""")
+    cursor.execute(
+        """INSERT INTO bookshelves_fts (bookshelves_fts) VALUES ('delete-all')"""
+    )
+
+    fields = ", ".join(BOOK_FIELDS)
+    cursor.execute(
+        f"""INSERT INTO bookshelves ({fields}) SELECT {fields} FROM bookshelves_unnormalized ORDER BY id"""
+    )
+    # ids of deleted rows are still never reused
+    cursor.execute(
+        """UPDATE sqlite_sequence SET seq = max(seq, (SELECT seq FROM sqlite_sequence WHERE name = 'bookshelves_unnormalized')) WHERE name = 'reads'"""
+    )
+    cursor.execute("""DROP TABLE bookshelves_unnormalized""")
+
+
+# migrations are applied in order and the schema version of a database
+# is the number it has had applied, so only ever add to the end of this list
+MIGRATIONS = [
+    migrate_typed_columns,
+    migrate_lookup_indexes,
+    migrate_read_counts,
+    migrate_full_text_search,
+    migrate_reading_stats,
+    migrate_import_checkpoints,
+    migrate_failed_imports,
+    migrate_normalized_schema,
+]
+
+
+class ImportCheckpoint:
+    """Class for recording which rows of a csv import have been finished,
+    so an interrupted import can be resumed. Rows are numbered from 1
+    in the order they are read. Lookups can finish out of order, so
+    the checkpoint keeps the number of rows that have all finished,
+    along with any finished rows after them. Rows that failed to import
+    count as finished, as they have been written to the failed imports file."""
+
+    def __init__(
+        self,
+        file_hash: str | None = None,
+        path: str = "",
+        rows_done: int = 0,
+        done_after: Iterable[int] = (),
+    ):
+        """Create new checkpoint for the file with file_hash. Without
+        a file_hash the checkpoint only tracks rows and is never saved."""
+        self.file_hash = file_hash
+        self.path = path
+        self.rows_done = rows_done
+        self.done_after = set(done_after)
+
+        # rows done when the import started, which are skipped
+        self._skip_until = rows_done
+        self._skip = frozenset(self.done_after)
+
+    def remaining(self, rows: Iterable[Dict[str, str]]) -> Iterator[Tuple[int, dict]]:
+        """Yield row number and row for rows that were not
+        finished when the import started."""
+        for row_number, row in enumerate(rows, start=1):
+            if row_number > self._skip_until and row_number not in self._skip:
+                yield row_number, row
+
+    def markDone(self, row_number: int):
+        """Record row as finished"""
+        self.done_after.add(row_number)
+        while self.rows_done + 1 in self.done_after:
+            self.rows_done += 1
+            self.done_after.remove(self.rows_done)
+
+    def track(self, items: Iterable[Tuple[int, Book | None]]) -> Iterator[Book]:
+        """Yield books from row number and book pairs, marking each row
+        as finished as it is taken. None is passed for rows that failed.
+        Books taken before a commit are written by it, so the checkpoint
+        saved with the commit matches what has been written."""
+        for row_number, book in items:
+            self.markDone(row_number)
+            if book is not None:
+                yield book
+
+    def save(self, cursor: sqlite3.Cursor):
+        """Save checkpoint, as part of the transaction being committed"""
+        if self.file_hash is None:
+            return
+
+        cursor.execute(
+            """INSERT INTO import_checkpoints (file_hash, path, rows_done, done_after, updated_at) VALUES (?, ?, ?, ?, ?) ON CONFLICT(file_hash) DO UPDATE SET path = excluded.path, rows_done = excluded.rows_done, done_after = excluded.done_after, updated_at = excluded.updated_at""",
+            (
+                self.file_hash,
+                self.path,
+                self.rows_done,
+                json.dumps(sorted(self.done_after)),
+                datetime.now().isoformat(timespec="seconds"),
+            ),
+        )
+
+    def __repr__(self):
+        """Return a string of the expression that creates the object"""
+        return f"{self.__class__.__qualname__}({self.file_hash}, {self.path}, {self.rows_done}, {sorted(self.done_after)})"
+
+
+class RetryCheckpoint(ImportCheckpoint):
+    """Checkpoint for retrying failed imports. Each row is a failed import,
+    and finishing a row removes the failed import, so each failure
+    is retried once however the retry ends."""
+
+    def __init__(self, failure_ids: List[int]):
+        """Create new checkpoint for retrying the failed imports with
+        failure_ids, in the order their rows are passed to the import."""
+        super().__init__()
+        self.failure_ids = failure_ids
+        self._finished_ids = []
+
+    def markDone(self, row_number: int):
+        super().markDone(row_number)
+        self._finished_ids.append(self.failure_ids[row_number - 1])
+
+    def save(self, cursor: sqlite3.Cursor):
+        """Remove finished failed imports, as part of the transaction
+        being committed"""
+        cursor.executemany(
+            """DELETE FROM failed_imports WHERE id = ?""",
+            ((failure_id,) for failure_id in self._finished_ids),
+        )
+        self._finished_ids = []
+
+
+class FailedImports:
+    """Class for recording the failed imports of one import run.
+    Failures are passed to the writer thread along with books and
+    buffered until the next commit, when they are written to the
+    failed_imports table in one go."""
+
+    def __init__(self, run_id: str | None = None):
+        """Create new failed imports for run_id, by default
+        a new run id is made from the current time."""
+        if run_id is None:
+            run_id = f"{datetime.now():%Y%m%d-%H%M%S-%f}"
+
+        self.run_id = run_id
+        self._buffer = []
+
+    def failure(
+        self, row: Dict[str, str], error, error_class: str | None = None
+    ) -> tuple:
+        """Make failed import record for row. If no error class is
+        given it is worked out from the error."""
+        if error_class is None:
+            error_class = classify_error(error)
+
+        logging.critical("Failed to import %s, %s: %s", row, error_class, error)
+
+        return (
+            self.run_id,
+            row.get("isbn_13"),
+            json.dumps(row),
+            error_class,
+            str(error),
+            error_class in TRANSIENT_ERROR_CLASSES,
+            datetime.now().isoformat(timespec="seconds"),
+        )
+
+    def collect(self, items: Iterable[Tuple[int, Book | tuple]]) -> Iterator:
+        """Pass on row number and book pairs, buffering failed import
+        records passed in place of books and passing None in their place."""
+        for row_number, item in items:
+            if isinstance(item, Book):
+                yield row_number, item
+            else:
+                self._buffer.append(item)
+                yield row_number, None
+
+    def flush(self, cursor: sqlite3.Cursor):
+        """Write buffered failures, as part of the transaction being committed"""
+        profiler.count("failed_imports", len(self._buffer))
+        cursor.executemany(
+            """INSERT INTO failed_imports (run_id, isbn_13, row, error_class, error_message, transient, failed_at) VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            self._buffer,
+        )
+        self._buffer = []
+
+    def __repr__(self):
+        """Return a string of the expression that creates the object"""
+        return f"{self.__class__.__qualname__}({self.run_id})"
 
 
 class Bookshelves:
     """Class for database of books"""
 
-    def __init__(self, path_to_database: str):
-        """Create new bookshelves database object"""
+    def __init__(
+        self,
+        path_to_database: str,
+        busy_timeout: float = DATABASE_BUSY_TIMEOUT,
+        synchronous: str = DATABASE_SYNCHRONOUS,
+        mmap_size: int = DATABASE_MMAP_SIZE,
+    ):
+        """Create new bookshelves database object.
+        The object owns one long lived connection per thread that uses it,
+        these are opened on first use and closed with close(), or on exit
+        when used as a context manager.
+        The database is put in WAL mode so reading never waits for writing.
+        Connections wait up to busy_timeout seconds for other connections,
+        including those of other processes, to finish writing, and use
+        the given synchronous level and mmap size."""
+        if synchronous.upper() not in SYNCHRONOUS_LEVELS:
+            raise ValueError(f"Invalid synchronous level: {synchronous}")
+
         self.path_to_database = path_to_database
+        self.busy_timeout = busy_timeout
+        self.synchronous = synchronous.upper()
+        self.mmap_size = mmap_size
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
 
         if os.path.exists(path_to_database):
             database = path_to_database
@@ -282,6 +2007,14 @@ class Bookshelves:
 
         self.db = database
 
+        # the journal mode is kept in the database file so this only
+        # changes databases made by older versions of bookshelves
+        journal_mode = self.connection.execute("""PRAGMA journal_mode=WAL""").fetchone()
+        if journal_mode[0] != "wal":
+            logging.warning("Could not use WAL mode for %s", self.db)
+
+        self.migrate()
+
         logging.debug(self.__repr__())
 
     @classmethod
@@ -290,50 +2023,184 @@ class Bookshelves:
         connection = sqlite3.connect(path_to_database)
         cursor = connection.cursor()
         cursor.execute(
-            "CREATE TABLE bookshelves(id integer primary key autoincrement, title, primary_author_key, primary_author, secondary_authors_keys, secondary_authors,isbn_13, edition_publish_date, number_of_pages, publisher, open_lib_key, goodreads_identifier, librarything_identifier, date_added, date_finished, comments)"
+            "CREATE TABLE bookshelves(id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT, primary_author_key TEXT, primary_author TEXT, secondary_authors_keys TEXT, secondary_authors TEXT, isbn_13 TEXT, edition_publish_date TEXT, number_of_pages INTEGER, publisher TEXT, open_lib_key TEXT, goodreads_identifier TEXT, librarything_identifier TEXT, date_added TEXT, date_finished TEXT, comments TEXT)"
         )
         connection.close()
         return path_to_database
 
+    def getSchemaVersion(self) -> int:
+        """Get schema version of database, this is the number of
+        migrations from MIGRATIONS that have been applied."""
+        connection, cursor = self.getConnection()
+        return cursor.execute("""PRAGMA user_version""").fetchone()[0]
+
+    def migrate(self):
+        """Apply migrations the database hasn't had yet in order.
+        Each migration is applied in its own transaction, along with
+        updating the schema version stored in PRAGMA user_version,
+        so a failed migration leaves the database at the previous version."""
+        if self.getSchemaVersion() >= len(MIGRATIONS):
+            return
+
+        connection, cursor = self.getConnection()
+
+        while True:
+            # take the write lock before checking the version so two
+            # processes can't apply the same migration
+            self.beginWrite(connection)
+            schema_version = self.getSchemaVersion()
+
+            if schema_version >= len(MIGRATIONS):
+                connection.commit()
+                return
+
+            migration = MIGRATIONS[schema_version]
+            logging.info(
+                "Migrating %s to schema version %s: %s",
+                self.db,
+                schema_version + 1,
+                migration.__doc__,
+            )
+
+            try:
+                with profiler.phase("migrate"):
+                    migration(cursor)
+                    cursor.execute(f"""PRAGMA user_version = {schema_version + 1}""")
+                    connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """Connection to the database for the current thread.
+        Reusing the same connection means sqlite only parses the schema
+        once and the statement cache of the connection can be used
+        for repeated queries."""
+        connection = getattr(self._local, "connection", None)
+
+        if connection is None:
+            # connections are only used by the thread that opened them
+            # but may be closed from another thread by close()
+            connection = sqlite3.connect(
+                self.db, timeout=self.busy_timeout, check_same_thread=False
+            )
+            connection.row_factory = sqlite3.Row
+            connection.execute(f"""PRAGMA synchronous={self.synchronous}""")
+            connection.execute(f"""PRAGMA mmap_size={int(self.mmap_size)}""")
+            self._local.connection = connection
+
+            with self._connections_lock:
+                self._connections.append(connection)
+
+            logging.debug(
+                "Opened connection to %s for %s",
+                self.db,
+                threading.current_thread().name,
+            )
+
+        return connection
+
     def getConnection(self):
-        """In order to execute commands you have to create a connection
+        """In order to execute commands you have to use a connection
         and then a database cursor"""
-        connection = sqlite3.connect(self.db)
-        connection.row_factory = sqlite3.Row
+        connection = self.connection
         cursor = connection.cursor()
         return connection, cursor
 
-    def closeDB(self, connection: Type[sqlite3.Connection]):
-        """Close existing database connection."""
+    def beginWrite(self, connection: sqlite3.Connection):
+        """Begin a write transaction on connection. The write lock is
+        taken straight away, rather than by the first write, so waiting
+        for other writers happens here under the busy timeout and
+        a transaction never fails part way through because another
+        process got the lock first. If the database is still locked
+        after the busy timeout, it is waited for WRITE_RETRIES more times."""
+        for attempt in range(WRITE_RETRIES + 1):
+            try:
+                with profiler.phase("sqlite_lock_wait"):
+                    connection.execute("""BEGIN IMMEDIATE""")
+                return
+            except sqlite3.OperationalError as e:
+                if e.sqlite_errorcode != sqlite3.SQLITE_BUSY:
+                    raise
+                if attempt == WRITE_RETRIES:
+                    raise
+                logging.warning(
+                    "%s is locked by another writer, waiting again (%s of %s)",
+                    self.db,
+                    attempt + 1,
+                    WRITE_RETRIES,
+                )
+
+    @contextmanager
+    def writeTransaction(self) -> Iterator[sqlite3.Cursor]:
+        """Run block in a write transaction begun with beginWrite,
+        committing when it finishes and rolling back if it raises."""
+        connection, cursor = self.getConnection()
+        self.beginWrite(connection)
+
+        try:
+            yield cursor
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+
+    def closeThreadConnection(self):
+        """Close the connection of the current thread, for threads that
+        are finishing, like import writers, so long running processes
+        don't keep a connection for every thread that has used the object."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            return
+
+        with self._connections_lock:
+            self._connections.remove(connection)
         connection.close()
+        self._local.connection = None
+
+    def close(self):
+        """Close all database connections opened by this object.
+        Any later use of the object opens new connections."""
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+
+        self._local = threading.local()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
     def addToDatabase(self, book: Book):
         """Add a book to the database."""
         logging.info("Inserting %s into %s", book, PATH_TO_DATABASE)
-        connection, cursor = self.getConnection()
 
-        cursor.execute(
-            """INSERT into "bookshelves" (title, primary_author_key, primary_author, secondary_authors_keys, secondary_authors,isbn_13, edition_publish_date, number_of_pages, publisher, open_lib_key, goodreads_identifier, librarything_identifier, date_added, date_finished, comments) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-            (
-                book.title,
-                book.primary_author_key,
-                book.primary_author,
-                book.secondary_authors_keys,
-                book.secondary_authors,
-                book.isbn_13,
-                book.edition_publish_date,
-                book.number_of_pages,
-                book.publisher,
-                book.open_lib_key,
-                book.goodreads_identifier,
-                book.librarything_identifier,
-                book.date_added,
-                book.date_finished,
-                book.comments,
-            ),
-        )
-        connection.commit()
-        self.closeDB(connection)
+        with profiler.phase("sqlite_write"), self.writeTransaction() as cursor:
+            cursor.execute(
+                """INSERT into "bookshelves" (title, primary_author_key, primary_author, secondary_authors_keys, secondary_authors,isbn_13, edition_publish_date, number_of_pages, publisher, open_lib_key, goodreads_identifier, librarything_identifier, date_added, date_finished, comments) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (
+                    book.title,
+                    book.primary_author_key,
+                    book.primary_author,
+                    book.secondary_authors_keys,
+                    book.secondary_authors,
+                    book.isbn_13,
+                    book.edition_publish_date,
+                    book.number_of_pages,
+                    book.publisher,
+                    book.open_lib_key,
+                    book.goodreads_identifier,
+                    book.librarything_identifier,
+                    book.date_added,
+                    book.date_finished,
+                    book.comments,
+                ),
+            )
+        profiler.count("rows_written")
 
     def checkIfIDExists(self, id_value: str) -> bool:
         """Used to check if an ID value exists to avoid
@@ -354,206 +2221,1076 @@ class Bookshelves:
         """Update values in database to match import"""
         logging.info("Updating values for %s in %s", book, self.db)
         logging.debug("New values for book: %s", book.complete_book_metadata)
+
+        with profiler.phase("sqlite_write"), self.writeTransaction() as cursor:
+            cursor.execute(
+                """UPDATE "bookshelves" SET title = ?, primary_author_key = ?, primary_author = ?, secondary_authors_keys = ?, secondary_authors = ?, isbn_13 = ?, edition_publish_date = ?, number_of_pages = ?, publisher = ?, open_lib_key = ?, goodreads_identifier = ?, librarything_identifier = ?, date_added = ?, date_finished = ?, comments = ? WHERE id = ?""",
+                (
+                    book.title,
+                    book.primary_author_key,
+                    book.primary_author,
+                    book.secondary_authors_keys,
+                    book.secondary_authors,
+                    book.isbn_13,
+                    book.edition_publish_date,
+                    book.number_of_pages,
+                    book.publisher,
+                    book.open_lib_key,
+                    book.goodreads_identifier,
+                    book.librarything_identifier,
+                    book.date_added,
+                    book.date_finished,
+                    book.comments,
+                    book.id,
+                ),
+            )
+        profiler.count("rows_written")
+
+    def upsertBooks(
+        self,
+        books: Iterable[Book],
+        batch_size: int = 0,
+        before_commit: Callable[[sqlite3.Cursor], None] | None = None,
+    ) -> int:
+        """Insert or update many books using as few transactions as possible.
+        Books with an id that already exists in the database are updated,
+        books without an id are added as new rows. Rows are passed to sqlite
+        in chunks with executemany. By default everything is committed as
+        a single transaction, if a batch_size is given then a commit
+        is made every batch_size rows instead. If before_commit is given
+        it is called with the cursor before each commit, so it can write
+        to the same transaction. Returns number of rows written."""
+        chunk_size = batch_size if batch_size > 0 else IMPORT_CHUNK_SIZE
+        row_count = 0
+
         connection, cursor = self.getConnection()
 
-        cursor.execute(
-            """UPDATE "bookshelves" SET title = ?, primary_author_key = ?, primary_author = ?, secondary_authors_keys = ?, secondary_authors = ?, isbn_13 = ?, edition_publish_date = ?, number_of_pages = ?, publisher = ?, open_lib_key = ?, goodreads_identifier = ?, librarything_identifier = ?, date_added = ?, date_finished = ?, comments = ? WHERE id = ?""",
-            (
-                book.title,
-                book.primary_author_key,
-                book.primary_author,
-                book.secondary_authors_keys,
-                book.secondary_authors,
-                book.isbn_13,
-                book.edition_publish_date,
-                book.number_of_pages,
-                book.publisher,
-                book.open_lib_key,
-                book.goodreads_identifier,
-                book.librarything_identifier,
-                book.date_added,
-                book.date_finished,
-                book.comments,
-                book.id,
-            ),
-        )
-        connection.commit()
-        self.closeDB(connection)
+        try:
+            for chunk in chunked(books, chunk_size):
+                rows = []
+                for book in chunk:
+                    row = list(book)
+                    # blank ids are new rows so let sqlite assign the id
+                    if row[0] == "":
+                        row[0] = None
+                    rows.append(row)
+
+                # the first chunk and the chunk after each commit
+                # begin a new transaction
+                if not connection.in_transaction:
+                    self.beginWrite(connection)
+
+                with profiler.phase("sqlite_write"):
+                    cursor.executemany(
+                        """INSERT INTO "bookshelves" (id, title, primary_author_key, primary_author, secondary_authors_keys, secondary_authors, isbn_13, edition_publish_date, number_of_pages, publisher, open_lib_key, goodreads_identifier, librarything_identifier, date_added, date_finished, comments) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                        rows,
+                    )
+                row_count += len(rows)
+                profiler.count("rows_written", len(rows))
+
+                if batch_size > 0:
+                    with profiler.phase("sqlite_commit"):
+                        if before_commit is not None:
+                            before_commit(cursor)
+                        connection.commit()
+                    logging.info("Committed %s rows to %s", row_count, self.db)
+
+            if not connection.in_transaction:
+                self.beginWrite(connection)
+
+            with profiler.phase("sqlite_commit"):
+                if before_commit is not None:
+                    before_commit(cursor)
+                connection.commit()
+        except BaseException:
+            # nothing from an uncommitted batch should be kept,
+            # including when the import is interrupted
+            connection.rollback()
+            # the traceback keeps the cursor, and its statement would keep
+            # the connection from closing fully until it is collected
+            cursor.close()
+            raise
 
-    def exportToCSV(self, path_to_csv: str = ""):
-        """Export database to csv file."""
+        return row_count
+
+    def exportToCSV(self, path_to_csv: str = "", compress: bool = False) -> int:
+        """Export database to csv file.
+        Pass - as the path to write to stdout. Output is gzipped if compress
+        is set or the path ends in .gz. Rows are read from the database
+        EXPORT_CHUNK_SIZE at a time so memory use doesn't grow with the
+        size of the database. Returns number of rows exported."""
         if path_to_csv == "":
             datestamp = datetime.today().strftime("%Y%m%d")
             output_filename = "bookshelves-" + datestamp + ".csv"
+            if compress:
+                output_filename += ".gz"
             output_filepath = os.path.join(DATA_FOLDER, output_filename)
         else:
             output_filepath = path_to_csv
 
+        compress = compress or output_filepath.endswith(".gz")
+
         connection, cursor = self.getConnection()
         bookshelves = cursor.execute("""SELECT * from bookshelves""")
 
-        logging.info("Writing to %s", output_filepath)
+        logging.info("Writing to %s", output_filepath)
+
+        default_header_rows = list(Book.setDefaultDict().keys())
+        row_count = 0
+        next_progress_log = EXPORT_PROGRESS_EVERY
+
+        with open_csv_output(output_filepath, compress) as output:
+            writer = csv.writer(output)
+            writer.writerow(default_header_rows)
+
+            while True:
+                with profiler.phase("sqlite_read"):
+                    books = bookshelves.fetchmany(EXPORT_CHUNK_SIZE)
+                if not books:
+                    break
+
+                with profiler.phase("csv_write"):
+                    writer.writerows(books)
+                row_count += len(books)
+
+                if row_count >= next_progress_log:
+                    logging.info("Written %s rows to %s", row_count, output_filepath)
+                    next_progress_log += EXPORT_PROGRESS_EVERY
+
+        logging.info("Exported %s rows to %s", row_count, output_filepath)
+        profiler.count("rows_exported", row_count)
+        if profiler.enabled and output_filepath != "-":
+            profiler.count("bytes_exported", os.path.getsize(output_filepath))
+
+        return row_count
+
+    def importFromCSV(
+        self,
+        import_csv_file: str,
+        batch_size: int = 0,
+        workers: int = DEFAULT_WORKERS,
+        lookup_batch_size: int = LOOKUP_BATCH_SIZE,
+        resume: bool = False,
+        confirm: bool = True,
+    ):
+        """Import a csv file to bookshelves database.
+        Csv files matching the database schema are written with upsertBooks.
+        Other csv files are imported with importFromOpenLib, using
+        the given number of workers and lookup batch size
+        to fetch book metadata. Both commit every RESUMABLE_BATCH_SIZE rows
+        unless a batch_size is given.
+        Progress is saved with each commit, and if resume is set rows
+        finished by an earlier import of the same file are skipped.
+        Unless confirm is False the user is asked before importing.
+        Returns count of successful imports and count of failed imports."""
+        if not confirm:
+            check = "y"
+        else:
+            check = input(
+                """If your CSV has the following columns in order,
+then it will be directly imported into the database:
+
+id
+title
+primary_author_key
+primary_author
+secondary_authors_keys
+secondary_authors
+isbn_13
+edition_publish_date
+number_of_pages
+publisher
+open_lib_key
+goodreads_identifier
+librarything_identifier
+date_added
+date_finished
+comments
+
+Otherwise, it must have a column titled isbn_13.
+And an isbn listed for each title and the book metadata will be fetched from the open library.
+
+Would you like to continue? y/n: "
+"""
+            )
+
+        if confirm_user_input(check):
+            fail_count = 0
+            success_count = 0
+            start_time = time.perf_counter()
+            checkpoint = self.loadCheckpoint(import_csv_file, resume)
+            failed_imports = FailedImports()
+
+            with open(import_csv_file, "r", encoding="utf-8", newline="") as csv_file:
+                reader = csv.DictReader(csv_file)
+                rows = profiler.timeIter(reader, "csv_read", "csv_rows_read")
+
+                default_header_rows = list(Book.setDefaultDict().keys())
+
+                # if headings on csv match default database schema
+                # import directly from csv
+                if reader.fieldnames == default_header_rows:
+                    logging.info("Importing data directly from csv file")
+
+                    success_count, fail_count = self.importBooks(
+                        rows,
+                        batch_size or RESUMABLE_BATCH_SIZE,
+                        checkpoint,
+                        failed_imports,
+                    )
+
+                else:
+                    logging.info("Getting data from open library")
+
+                    success_count, fail_count = self.importFromOpenLib(
+                        rows,
+                        batch_size or RESUMABLE_BATCH_SIZE,
+                        workers,
+                        lookup_batch_size,
+                        checkpoint,
+                        failed_imports,
+                    )
+
+                logging.info("%s number of titles successfully imported", success_count)
+                logging.info("With %s number of titles failed import", fail_count)
+                log_throughput(success_count + fail_count, start_time)
+
+            if fail_count:
+                self.exportFailedImports(failed_imports.run_id)
+
+            return success_count, fail_count
+        else:
+            terminate_program()
+
+    def loadCheckpoint(self, path: str, resume: bool = False) -> ImportCheckpoint:
+        """Get checkpoint for importing the file at path. Files are
+        identified by a hash of their contents, so a file that has been
+        moved can still be resumed. If resume is not set a new checkpoint
+        is returned, replacing any saved checkpoint when it is saved."""
+        file_hash = hash_file(path)
+
+        if resume:
+            connection, cursor = self.getConnection()
+            result = cursor.execute(
+                """SELECT rows_done, done_after FROM import_checkpoints WHERE file_hash = ?""",
+                (file_hash,),
+            ).fetchone()
+
+            if result is not None:
+                logging.info(
+                    "Resuming import of %s after %s rows",
+                    path,
+                    result["rows_done"],
+                )
+                return ImportCheckpoint(
+                    file_hash,
+                    path,
+                    result["rows_done"],
+                    json.loads(result["done_after"]),
+                )
+
+            logging.info("No earlier import of %s to resume", path)
+
+        return ImportCheckpoint(file_hash, path)
+
+    def importBooks(
+        self,
+        rows: Iterable[Dict[str, str]],
+        batch_size: int = 0,
+        checkpoint: ImportCheckpoint | None = None,
+        failed_imports: FailedImports | None = None,
+    ) -> Tuple[int, int]:
+        """Add rows matching the database schema to the database.
+        Rows are read, checked and made into books in chunks, which are
+        passed through a bounded queue to a single writer thread that
+        adds them with upsertBooks. Writing starts with the first chunk
+        and reading waits while the writer catches up, so only a few
+        chunks are held in memory however many rows there are.
+        Rows with missing or extra values or an invalid id are recorded
+        in failed_imports. If a checkpoint is given, rows it has finished
+        are skipped and it is saved with each commit.
+        Returns count of successful imports and count of failed imports."""
+        from concurrent.futures import ThreadPoolExecutor
+
+        if checkpoint is None:
+            checkpoint = ImportCheckpoint()
+        if failed_imports is None:
+            failed_imports = FailedImports()
+
+        fail_count = 0
+        chunk_queue = queue.Queue(maxsize=IMPORT_QUEUE_CHUNKS)
+
+        def numbered_books() -> Iterator[Tuple[int, Book | tuple]]:
+            """Yield row number and book for each row,
+            or failed import record for invalid rows"""
+            nonlocal fail_count
+
+            for row_number, row in checkpoint.remaining(rows):
+                # csv.DictReader fills short rows with None
+                # and puts values past the last heading under None
+                if None in row:
+                    error_message = "Row has more values than headings"
+                elif None in row.values():
+                    error_message = "Row has fewer values than headings"
+                elif row["id"] != "" and not row["id"].isdigit():
+                    error_message = "Invalid id"
+                else:
+                    yield row_number, Book(row)
+                    continue
+
+                row.pop(None, None)
+                fail_count += 1
+                yield row_number, failed_imports.failure(
+                    row, error_message, "invalid_row"
+                )
+
+        with ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="bookshelves-writer"
+        ) as writer:
+            written = writer.submit(
+                self.writeImport,
+                chain.from_iterable(iter_queue(chunk_queue)),
+                batch_size,
+                checkpoint,
+                failed_imports,
+            )
+
+            try:
+                for chunk in chunked(numbered_books(), IMPORT_CHUNK_SIZE):
+                    put_while_running(chunk_queue, chunk, written)
+            finally:
+                # always let the writer finish so read books are kept
+                put_while_running(chunk_queue, None, written)
+
+            success_count = written.result()
+
+        return success_count, fail_count
+
+    def importFromOpenLib(
+        self,
+        rows: Iterable[Dict[str, str]],
+        batch_size: int = 0,
+        workers: int = DEFAULT_WORKERS,
+        lookup_batch_size: int = LOOKUP_BATCH_SIZE,
+        checkpoint: ImportCheckpoint | None = None,
+        failed_imports: FailedImports | None = None,
+    ) -> Tuple[int, int]:
+        """Fetch metadata from the open library for rows with an isbn_13 value
+        and add the books to the database.
+        Isbns are looked up lookup_batch_size at a time with
+        Book.openLibBatchSearch. Lookups are made concurrently by a pool of
+        worker threads, with at most a few lookups per worker waiting at any
+        one time. Finished books are passed to a single writer thread,
+        which adds them to the database with upsertBooks in whatever order
+        they arrive. Failures are recorded in failed_imports, classed by
+        error so network and server errors can be retried later.
+        If a checkpoint is given, rows it has finished are skipped
+        and it is saved with each commit.
+        Returns count of successful imports and count of failed imports."""
+        from concurrent.futures import (
+            FIRST_COMPLETED,
+            ThreadPoolExecutor,
+            as_completed,
+            wait,
+        )
+
+        if checkpoint is None:
+            checkpoint = ImportCheckpoint()
+        if failed_imports is None:
+            failed_imports = FailedImports()
+
+        fail_count = 0
+        book_queue = queue.Queue(maxsize=IMPORT_CHUNK_SIZE)
+
+        def record_failure(
+            row_number: int,
+            row: Dict[str, str],
+            error,
+            error_class: str | None = None,
+        ):
+            """Pass failed import to the writer in place of a book"""
+            nonlocal fail_count
+
+            fail_count += 1
+            failure = failed_imports.failure(row, error, error_class)
+            put_while_running(book_queue, (row_number, failure), written)
+
+        def valid_rows() -> Iterator[Tuple[int, Dict[str, str]]]:
+            """Yield rows with valid isbns, recording failure for the rest"""
+            for row_number, row in checkpoint.remaining(rows):
+                isbn = row["isbn_13"]
+
+                if Book.validateISBN(isbn):
+                    yield row_number, row
+                else:
+                    record_failure(
+                        row_number, row, "Invalid ISBN passed", "invalid_isbn"
+                    )
+
+        def handle_result(
+            future: "Future", batch_rows: List[Tuple[int, Dict[str, str]]]
+        ):
+            """Queue books for writing or record failures for finished lookup"""
+            try:
+                books_metadata = future.result()
+            except Exception as e:
+                for row_number, row in batch_rows:
+                    record_failure(row_number, row, e)
+                return
+
+            for row_number, row in batch_rows:
+                isbn = row["isbn_13"].strip()
+                book_metadata = books_metadata.get(isbn)
+
+                if book_metadata is None:
+                    record_failure(
+                        row_number, row, "No book metadata found", "not_found"
+                    )
+                    continue
+
+                book = Book(book_metadata)
+
+                # if spreadsheet includes user defined
+                # comments and date finished rows
+                # then update values for book
+                # before adding to database
+                try:
+                    comments = row["comments"]
+                    book.comments = comments
+                except KeyError:
+                    pass
+
+                try:
+                    date_finished = row["date_finished"]
+                    book.date_finished = date_finished
+                except KeyError:
+                    pass
+
+                put_while_running(book_queue, (row_number, book), written)
+
+        # made before starting the writer, so a bad batch size writes nothing
+        batches = chunked(valid_rows(), lookup_batch_size)
+
+        with ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="bookshelves-writer"
+        ) as writer, ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="bookshelves-fetch"
+        ) as fetchers:
+            written = writer.submit(
+                self.writeImport,
+                iter_queue(book_queue),
+                batch_size,
+                checkpoint,
+                failed_imports,
+            )
+
+            try:
+                in_flight = {}
+
+                for batch_rows in batches:
+                    # stop reading the csv while enough lookups are waiting
+                    if len(in_flight) >= workers * 2:
+                        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            handle_result(future, in_flight.pop(future))
+
+                    isbns = [row["isbn_13"].strip() for _, row in batch_rows]
+                    future = fetchers.submit(Book.openLibBatchSearch, isbns)
+                    in_flight[future] = batch_rows
+
+                for future in as_completed(in_flight):
+                    handle_result(future, in_flight[future])
+            finally:
+                # lookups that have not finished are left for a resumed import
+                for future in in_flight:
+                    future.cancel()
+                # always let the writer finish so fetched books are kept
+                put_while_running(book_queue, None, written)
+
+            success_count = written.result()
+
+        return success_count, fail_count
+
+    def writeImport(
+        self,
+        items: Iterable[Tuple[int, Book | tuple]],
+        batch_size: int,
+        checkpoint: ImportCheckpoint,
+        failed_imports: FailedImports,
+    ) -> int:
+        """Write row number and book pairs from an import with upsertBooks.
+        Failed import records can be passed in place of books. Rows are
+        marked finished in checkpoint as they are taken, and failures and
+        checkpoint are saved with each commit, so they always match
+        the books written. Returns number of books written."""
+
+        def save_progress(cursor: sqlite3.Cursor):
+            failed_imports.flush(cursor)
+            checkpoint.save(cursor)
+
+        try:
+            return self.upsertBooks(
+                checkpoint.track(failed_imports.collect(items)),
+                batch_size,
+                save_progress,
+            )
+        finally:
+            # each import has a new writer thread
+            self.closeThreadConnection()
+
+    def retryFailedImports(
+        self,
+        batch_size: int = 0,
+        workers: int = DEFAULT_WORKERS,
+        lookup_batch_size: int = LOOKUP_BATCH_SIZE,
+    ) -> Tuple[int, int]:
+        """Import rows that failed from network errors, rate limits or
+        server errors again with importFromOpenLib. Retried failures are
+        removed as their rows finish, and rows that fail again are recorded
+        as failures of this run. Returns count of successful imports and
+        count of failed imports."""
+        connection, cursor = self.getConnection()
+        failures = cursor.execute(
+            """SELECT id, row FROM failed_imports WHERE transient = 1 ORDER BY id"""
+        ).fetchall()
+
+        if not failures:
+            logging.info("No failed imports to retry")
+            return 0, 0
+
+        logging.info("Retrying %s failed imports", len(failures))
+
+        checkpoint = RetryCheckpoint([failure["id"] for failure in failures])
+        failed_imports = FailedImports()
+
+        success_count, fail_count = self.importFromOpenLib(
+            (json.loads(failure["row"]) for failure in failures),
+            batch_size or RESUMABLE_BATCH_SIZE,
+            workers,
+            lookup_batch_size,
+            checkpoint,
+            failed_imports,
+        )
+
+        logging.info("%s number of titles successfully imported", success_count)
+        logging.info("With %s number of titles failed import", fail_count)
+
+        if fail_count:
+            self.exportFailedImports(failed_imports.run_id)
+
+        return success_count, fail_count
+
+    def exportFailedImports(self, run_id: str, path_to_csv: str = "") -> str:
+        """Write failed imports of run_id to csv, with the error class and
+        message after the values of each row. By default the csv is written
+        next to the database. Returns path of the csv."""
+        if path_to_csv == "":
+            path_to_csv = os.path.join(
+                os.path.dirname(self.path_to_database), f"failed-imports-{run_id}.csv"
+            )
+
+        connection, cursor = self.getConnection()
+        failures = cursor.execute(
+            """SELECT row, error_class, error_message FROM failed_imports WHERE run_id = ? ORDER BY id""",
+            (run_id,),
+        ).fetchall()
+
+        rows = [
+            dict(
+                json.loads(failure["row"]),
+                error_class=failure["error_class"],
+                error_message=failure["error_message"],
+            )
+            for failure in failures
+        ]
+        # rows from different csv files can have different headings
+        headings = dict.fromkeys(heading for row in rows for heading in row)
+
+        with open(path_to_csv, "w", encoding="utf-8", newline="") as output:
+            writer = csv.DictWriter(output, headings)
+            writer.writeheader()
+            writer.writerows(rows)
+
+        logging.info("%s failed imports written to %s", len(rows), path_to_csv)
+        if any(row["error_class"] in TRANSIENT_ERROR_CLASSES for row in rows):
+            logging.info(
+                "Failures from network or server errors can be retried with --retry-failed"
+            )
+
+        return path_to_csv
+
+    def getTopBooks(
+        self, limit: int = 10, year: str | None = None, author: str | None = None
+    ) -> List[Tuple[BookRow, int]]:
+        """Get most read books in database with their read count,
+        optionally only counting books finished in year or by author.
+        Counts for all years and for single years are kept up to date
+        by triggers in the read_counts tables, so these are read straight
+        from an index. Author counts are made from the reads of editions
+        the author is the primary author of, found via the authors table
+        rather than the primary_author column of the view."""
+        connection, cursor = self.getConnection()
+
+        if author is not None:
+            query = f"""SELECT bookshelves.*, count(*) AS read_count FROM (SELECT reads.id {PRIMARY_AUTHOR_READS}"""
+            parameters = [author]
+            if year is not None:
+                query += """ AND substr(reads.date_finished, 1, 4) = ?"""
+                parameters.append(year)
+            query += """) AS author_reads JOIN bookshelves ON bookshelves.id = author_reads.id GROUP BY bookshelves.title ORDER BY read_count DESC LIMIT ?"""
+            parameters.append(limit)
+        elif year is not None:
+            query = """SELECT bookshelves.*, year_read_counts.read_count FROM year_read_counts JOIN bookshelves ON bookshelves.id = year_read_counts.last_id WHERE year_read_counts.year = ? ORDER BY year_read_counts.read_count DESC LIMIT ?"""
+            parameters = [year, limit]
+        else:
+            query = """SELECT bookshelves.*, read_counts.read_count FROM read_counts JOIN bookshelves ON bookshelves.id = read_counts.last_id ORDER BY read_counts.read_count DESC LIMIT ?"""
+            parameters = [limit]
+
+        with profiler.phase("sqlite_read"):
+            return [
+                (BookRow(row), row["read_count"])
+                for row in cursor.execute(query, parameters)
+            ]
+
+    def search(self, query: str, limit: int = SEARCH_LIMIT) -> List[BookRow]:
+        """Search titles, authors, publishers and comments in the database.
+        Every word in the query must match the start of a word in the book,
+        so partial words can be searched for. Results are ranked by relevance
+        with matches in the title and authors ranked above other matches."""
+        connection, cursor = self.getConnection()
+
+        # quote each word so punctuation in the query is matched as text
+        # rather than treated as search syntax, * matches words starting with it
+        match = " ".join('"' + word.replace('"', '""') + '"*' for word in query.split())
+
+        if not match:
+            return []
+
+        with profiler.phase("sqlite_read"):
+            results = cursor.execute(
+                # matches are ranked before joining so only the rows shown
+                # are read from the bookshelves view
+                """SELECT bookshelves.* FROM (SELECT rowid, bm25(bookshelves_fts, 10.0, 5.0, 5.0, 2.0, 1.0) AS rank FROM bookshelves_fts WHERE bookshelves_fts MATCH ? ORDER BY rank LIMIT ?) AS matches JOIN bookshelves ON bookshelves.id = matches.rowid ORDER BY matches.rank""",
+                (match, limit),
+            )
+
+            return [BookRow(row) for row in results]
+
+    def printSearch(self, query: str, limit: int = SEARCH_LIMIT):
+        """Print search results for query"""
+        print_search(query, self.search(query, limit))
+
+    def getStats(self, year: str | None = None) -> Dict:
+        """Get reading stats from the stats tables, which are kept up to
+        date by triggers so this only reads one row per group.
+        Monthly stats are only for year if one is given."""
+        connection, cursor = self.getConnection()
+
+        years = cursor.execute(
+            """SELECT year, sum(books) AS books, sum(pages) AS pages FROM monthly_stats GROUP BY year ORDER BY year"""
+        ).fetchall()
+
+        if year is None:
+            months = cursor.execute(
+                """SELECT year, month, books, pages FROM monthly_stats ORDER BY year, month"""
+            ).fetchall()
+        else:
+            months = cursor.execute(
+                """SELECT year, month, books, pages FROM monthly_stats WHERE year = ? ORDER BY month""",
+                (year,),
+            ).fetchall()
+
+        totals = cursor.execute(
+            """SELECT ifnull(sum(books), 0) AS books, ifnull(sum(pages), 0) AS pages, ifnull(sum(paged_books), 0) AS paged_books FROM monthly_stats"""
+        ).fetchone()
+
+        top_authors = cursor.execute(
+            """SELECT primary_author, books, pages FROM author_stats WHERE primary_author != '' ORDER BY books DESC, pages DESC LIMIT ?""",
+            (STATS_TOP_LIMIT,),
+        ).fetchall()
+        top_publishers = cursor.execute(
+            """SELECT publisher, books, pages FROM publisher_stats WHERE publisher != '' ORDER BY books DESC, pages DESC LIMIT ?""",
+            (STATS_TOP_LIMIT,),
+        ).fetchall()
+
+        if totals["paged_books"]:
+            average_pages = totals["pages"] / totals["paged_books"]
+        else:
+            average_pages = 0
+
+        return {
+            "books": totals["books"],
+            "pages": totals["pages"],
+            "average_pages": average_pages,
+            "years": [tuple(row) for row in years],
+            "months": [tuple(row) for row in months],
+            "top_authors": [tuple(row) for row in top_authors],
+            "top_publishers": [tuple(row) for row in top_publishers],
+        }
+
+    def rebuildStats(self):
+        """Recompute the reading stats and read count tables from the
+        bookshelves view, in case they have got out of step with it.
+        All tables are recomputed from a single pass over the database,
+        made inside the write transaction so no other process can add
+        books between reading them and writing the stats."""
+        with self.writeTransaction() as cursor:
+            read_counts = {}
+            year_read_counts = {}
+            stats = {table: {} for table in STATS_GROUPS}
+
+            pages = STATS_PAGES.format(row="bookshelves")
+            group_columns = ", ".join(
+                expression.format(row="bookshelves")
+                for groups in STATS_GROUPS.values()
+                for expression in groups.values()
+            )
+            rows = cursor.execute(
+                f"""SELECT id, ifnull(title, ''), ifnull(substr(date_finished, 1, 4), ''), {pages}, {group_columns} FROM bookshelves"""
+            )
+
+            for id_value, title, year, book_pages, *group_values in rows:
+                for counts, key in [
+                    (read_counts, title),
+                    (year_read_counts, (year, title)),
+                ]:
+                    read_count, last_id = counts.get(key, (0, id_value))
+                    counts[key] = (read_count + 1, max(last_id, id_value))
+
+                for table, groups in STATS_GROUPS.items():
+                    key = tuple(group_values[: len(groups)])
+                    group_values = group_values[len(groups) :]
+
+                    books, total_pages, paged_books = stats[table].get(key, (0, 0, 0))
+                    stats[table][key] = (
+                        books + 1,
+                        total_pages + book_pages,
+                        paged_books + (book_pages > 0),
+                    )
+
+            cursor.execute("""DELETE FROM read_counts""")
+            cursor.executemany(
+                """INSERT INTO read_counts (title, read_count, last_id) VALUES (?, ?, ?)""",
+                ((title, *counts) for title, counts in read_counts.items()),
+            )
+            cursor.execute("""DELETE FROM year_read_counts""")
+            cursor.executemany(
+                """INSERT INTO year_read_counts (year, title, read_count, last_id) VALUES (?, ?, ?, ?)""",
+                ((*key, *counts) for key, counts in year_read_counts.items()),
+            )
+
+            for table, groups in STATS_GROUPS.items():
+                placeholders = ", ".join("?" * (len(groups) + 3))
+                cursor.execute(f"""DELETE FROM {table}""")
+                cursor.executemany(
+                    f"""INSERT INTO {table} ({", ".join(groups)}, books, pages, paged_books) VALUES ({placeholders})""",
+                    ((*key, *values) for key, values in stats[table].items()),
+                )
+
+        logging.info("Rebuilt reading stats for %s", self.db)
+
+    def printStats(self, year: str | None = None):
+        """Print reading stats"""
+        print_stats(self.getStats(year))
+
+    def printTopBooks(
+        self, limit: int = 10, year: str | None = None, author: str | None = None
+    ):
+        """Print most read books in database"""
+        print_top_books(self.getTopBooks(limit, year, author), limit, year, author)
+
+    def getTopTenBooks(self):
+        """Get top ten most read books in database"""
+        self.printTopBooks(10)
+
+    def __repr__(self):
+        """Return a string of the expression that creates the object"""
+        return f"{self.__class__.__qualname__}({self.path_to_database})"
+
+
+class BookshelvesAPI:
+    """Class for answering the json api of a bookshelves daemon.
+    It has no http code of its own, the daemon passes each request
+    to handle, so the api can be used and tested without a server."""
+
+    def __init__(
+        self,
+        bookshelves: Bookshelves,
+        lookup_batch_size: int = LOOKUP_BATCH_SIZE,
+        workers: int = DEFAULT_WORKERS,
+        folder: str = DATA_FOLDER,
+    ):
+        """Create new api answering requests from bookshelves. Adds and
+        imports look up isbns with the given batch size and workers.
+        Csv files can only be imported from and exported to folder."""
+        self.bookshelves = bookshelves
+        self.folder = os.path.realpath(folder)
+        self.lookup_batch_size = lookup_batch_size
+        self.workers = workers
+        self.routes = {
+            ("GET", "/health"): self.health,
+            ("GET", "/search"): self.search,
+            ("GET", "/top"): self.topBooks,
+            ("GET", "/stats"): self.stats,
+            ("POST", "/add"): self.add,
+            ("POST", "/import"): self.importCSV,
+            ("POST", "/export"): self.export,
+        }
+
+    def handle(self, method: str, path: str, body: bytes = b"") -> Tuple[int, Dict]:
+        """Answer request, returning status code and json data.
+        GET requests take parameters from the query string and
+        POST requests from a json object in the body."""
+        url = urlparse(path)
+        route = self.routes.get((method, url.path))
+
+        if route is None:
+            return 404, {"error": f"No route for {method} {url.path}"}
+
+        try:
+            if method == "GET":
+                params = {
+                    key: values[-1] for key, values in parse_qs(url.query).items()
+                }
+            else:
+                params = json.loads(body or b"{}")
+                if not isinstance(params, dict):
+                    raise ValueError("Body must be a json object")
+
+            return 200, route(params)
+        except (KeyError, TypeError, ValueError) as e:
+            return 400, {"error": f"Invalid request: {e!r}"}
+        except (Exception, SystemExit) as e:
+            # commands exit the program on errors they can't handle
+            logging.exception("Failed to answer %s %s", method, path)
+            return 500, {"error": f"{e.__class__.__name__}: {e}"}
+
+    def health(self, params: Dict) -> Dict:
+        return {"status": "ok", "database": self.bookshelves.db, "pid": os.getpid()}
+
+    def search(self, params: Dict) -> Dict:
+        books = self.bookshelves.search(
+            params["q"], int(params.get("limit", SEARCH_LIMIT))
+        )
+        return {"books": [book.complete_book_metadata for book in books]}
 
-        default_header_rows = list(Book.setDefaultDict().keys())
+    def topBooks(self, params: Dict) -> Dict:
+        top_books = self.bookshelves.getTopBooks(
+            int(params.get("limit", 10)), params.get("year"), params.get("author")
+        )
+        return {
+            "books": [
+                {"book": book.complete_book_metadata, "read_count": read_count}
+                for book, read_count in top_books
+            ]
+        }
 
-        with open(output_filepath, "w", encoding="utf-8", newline="") as output:
-            writer = csv.writer(output)
-            writer.writerow(default_header_rows)
-            for book in bookshelves:
-                logging.info("Writing %s to csv", book["title"])
-                writer.writerow(book)
+    def stats(self, params: Dict) -> Dict:
+        return self.bookshelves.getStats(params.get("year"))
 
-        self.closeDB(connection)
+    def add(self, params: Dict) -> Dict:
+        """Look up and add isbns without asking for confirmation"""
+        isbns = [str(isbn) for isbn in params["isbns"]]
+        invalid_isbns = [isbn for isbn in isbns if not Book.validateISBN(isbn)]
+        if not isbns or invalid_isbns:
+            raise ValueError(f"Invalid ISBNs: {invalid_isbns}")
 
-    def importFromCSV(self, import_csv_file: str):
-        """Import a csv file to bookshelves database."""
-        check = input(
-            """If your CSV has the following columns in order,
-then it will be directly imported into the database:
+        date_finished = params.get("date_finished")
+        if date_finished and validate_date(date_finished) is not True:
+            raise ValueError(f"Invalid date finished: {date_finished}")
 
-id
-title
-primary_author_key
-primary_author
-secondary_authors_keys
-secondary_authors
-isbn_13
-edition_publish_date
-number_of_pages
-publisher
-open_lib_key
-goodreads_identifier
-librarything_identifier
-date_added
-date_finished
-comments
+        added = add_many_books(
+            isbns,
+            date_finished,
+            params.get("comments"),
+            self.lookup_batch_size,
+            self.workers,
+            confirm=False,
+            bookshelves=self.bookshelves,
+        )
+        return {"added": added, "isbns": len(isbns)}
 
-Otherwise, it must have a column titled isbn_13.
-And an isbn listed for each title and the book metadata will be fetched from the open library.
+    def checkPath(self, path: str):
+        """Raise ValueError unless path is absolute and inside the api folder,
+        as anyone who can reach the daemon can send it paths"""
+        if not os.path.isabs(path):
+            raise ValueError(f"Path must be absolute: {path}")
+        if os.path.commonpath([self.folder, os.path.realpath(path)]) != self.folder:
+            raise ValueError(f"Path must be inside {self.folder}: {path}")
 
-Would you like to continue? y/n: "
-"""
+    def importCSV(self, params: Dict) -> Dict:
+        """Import csv at the absolute path given without asking for confirmation"""
+        path = params["path"]
+        self.checkPath(path)
+        if not os.path.exists(path):
+            raise ValueError(f"CSV filepath does not exist: {path}")
+
+        success_count, fail_count = self.bookshelves.importFromCSV(
+            path,
+            int(params.get("batch_size", 0)),
+            self.workers,
+            self.lookup_batch_size,
+            bool(params.get("resume", False)),
+            confirm=False,
         )
+        return {"imported": success_count, "failed": fail_count}
 
-        if confirm_user_input(check):
-            fail_count = 0
-            success_count = 0
+    def export(self, params: Dict) -> Dict:
+        """Export to the absolute path given, or the default export path.
+        Existing files are never overwritten."""
+        path = params.get("path") or ""
+        if path:
+            self.checkPath(path)
+            if os.path.exists(path):
+                raise ValueError(f"Export path already exists: {path}")
 
-            with open(import_csv_file, "r", encoding="utf-8", newline="") as csv_file:
-                reader = csv.DictReader(csv_file)
+        rows = self.bookshelves.exportToCSV(path, bool(params.get("compress", False)))
+        return {"rows": rows}
 
-                default_header_rows = list(Book.setDefaultDict().keys())
+    def __repr__(self):
+        """Return a string of the expression that creates the object"""
+        return f"{self.__class__.__qualname__}({self.bookshelves})"
 
-                # if headings on csv match default database schema
-                # import directly from csv
-                if reader.fieldnames == default_header_rows:
-                    logging.info("Importing data directly from csv file")
 
-                    books_metadata = list(reader)
+class BookshelvesDaemon:
+    """Class for serving a BookshelvesAPI on a unix socket or local http.
+    Requests are answered by a fixed pool of threads, so the database
+    connection each thread opens is reused by later requests."""
+
+    def __init__(
+        self,
+        api: BookshelvesAPI,
+        address: str = DAEMON_ADDRESS,
+        workers: int = DEFAULT_WORKERS,
+        request_timeout: float = DAEMON_REQUEST_TIMEOUT,
+    ):
+        """Create new daemon listening on address, a unix socket path
+        or host:port, where port 0 picks a free port. The api has no
+        authentication, so only loopback hosts are allowed and ValueError
+        is raised for others. The daemon is not started until start or
+        serveForever are called."""
+        # http.server takes longer to import than most commands take to run,
+        # so it is only imported when making a daemon
+        import socketserver
+        from concurrent.futures import ThreadPoolExecutor
+        from http.server import BaseHTTPRequestHandler, HTTPServer
 
-                    for book_metadata in books_metadata:
-                        # must explicitly pass book metadata to book obj
-                        book = Book(book_metadata)
+        self.api = api
+        self.pool = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="bookshelves-serve"
+        )
+        self._thread = None
+        tcp_address = parse_tcp_address(address)
+        if tcp_address is not None and not is_loopback_host(tcp_address[0]):
+            raise ValueError(f"Daemon can only listen on loopback hosts: {address}")
+        daemon = self
 
-                        result = self.checkIfIDExists(book.id)
+        class RequestHandler(BaseHTTPRequestHandler):
+            timeout = request_timeout
 
-                        if result:
-                            logging.info(
-                                "id already exists in database for: %s. Id value: %s",
-                                book_metadata["title"],
-                                book_metadata["id"],
-                            )
-                            # id already exists
-                            self.updateValues(book)
-                        else:
-                            self.addToDatabase(book)
-                            success_count += 1
+            def do_GET(self):
+                self.answer()
 
+            def do_POST(self):
+                self.answer()
+
+            def answer(self):
+                try:
+                    body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                except TimeoutError:
+                    # the body was shorter than its Content-Length
+                    self.close_connection = True
+                    status_code, data = 408, {"error": "Timed out reading request"}
                 else:
-                    logging.info("Getting data from open library")
+                    status_code, data = daemon.api.handle(self.command, self.path, body)
+                response = json.dumps(data).encode("utf-8")
 
-                    for row in reader:
-                        isbn = row["isbn_13"]
-
-                        if Book.validateISBN(isbn):
-                            try:
-                                book_metadata = Book.openLibIsbnSearch(isbn)
-                            except Exception as e:
-                                logging.critical(
-                                    "Except when fetching data for %s. Error message: %s",
-                                    isbn,
-                                    e,
-                                )
-                                self.writeFailedImportsToFile(row, e)
-                                fail_count += 1
-                                continue
-
-                            book = Book(book_metadata)
-
-                            # if spreadsheet includes user defined
-                            # comments and date finished rows
-                            # then update values for book
-                            # before adding to database
-                            try:
-                                comments = row["comments"]
-                                book.comments = comments
-                            except KeyError:
-                                pass
-
-                            try:
-                                date_finished = row["date_finished"]
-                                book.date_finished = date_finished
-                            except KeyError:
-                                pass
-
-                            self.addToDatabase(book)
-                            success_count += 1
-                        else:
-                            error_message = "Invalid ISBN passed"
-                            self.writeFailedImportsToFile(row, error_message)
-                            logging.critical("Invalid ISBN passed: %s", isbn)
-                            fail_count += 1
-                            continue
-                logging.info("%s number of titles successfully imported", success_count)
-                logging.info("With %s number of titles failed import", fail_count)
+                self.send_response(status_code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+            def address_string(self):
+                # clients of unix sockets have no address
+                return self.client_address[0] if self.client_address else address
+
+            def log_message(self, format, *args):
+                logging.debug("%s - %s", self.address_string(), format % args)
+
+        if tcp_address is None:
+            if os.path.exists(address):
+                if daemon_running(address):
+                    raise OSError(f"A daemon is already running at {address}")
+                # left by a daemon that didn't stop cleanly
+                os.remove(address)
+            server_class = socketserver.UnixStreamServer
         else:
-            terminate_program()
+            server_class = HTTPServer
 
-    def writeFailedImportsToFile(self, row, error_message):
-        """Used to write failed imports from import csv
-        to failed imports file"""
-        failed_imports_path = os.path.join("data", "failed-imports.csv")
+        class Server(server_class):
+            def process_request(self, request, client_address):
+                daemon.pool.submit(self.processInPool, request, client_address)
 
-        # add error message to row dictionary
-        row["error_message"] = str(error_message)
+            def processInPool(self, request, client_address):
+                try:
+                    self.finish_request(request, client_address)
+                except Exception:
+                    self.handle_error(request, client_address)
+                finally:
+                    self.shutdown_request(request)
 
-        if os.path.exists(failed_imports_path) is False:
-            with open(failed_imports_path, "w", encoding="utf-8", newline="") as output:
-                writer = csv.DictWriter(output, row.keys())
-                writer.writeheader()
-                writer.writerow(row)
+        if tcp_address is None:
+            # only the user running the daemon can send it commands, the
+            # socket is made with these permissions so it is never open
+            old_umask = os.umask(0o177)
+            try:
+                self.server = Server(address, RequestHandler)
+            finally:
+                os.umask(old_umask)
+            self.address = address
         else:
-            with open(failed_imports_path, "a", encoding="utf-8", newline="") as output:
-                writer = csv.DictWriter(output, row.keys())
-                writer.writerow(row)
+            self.server = Server(tcp_address, RequestHandler)
+            host, port = self.server.server_address[:2]
+            self.address = f"{host}:{port}"
 
-    def getTopTenBooks(self):
-        """Get top ten most read books in database"""
+        logging.debug(self.__repr__())
 
-        connection, cursor = self.getConnection()
-        top_ten = cursor.execute(
-            """SELECT *, count(title) FROM "bookshelves" GROUP BY title ORDER by count(title) DESC LIMIT 10"""
+    def serveForever(self):
+        """Answer requests until stopped, polling often
+        so stopping the daemon is not held up"""
+        self.server.serve_forever(poll_interval=0.05)
+
+    def start(self):
+        """Answer requests from a background thread, returns the daemon"""
+        self._thread = threading.Thread(
+            target=self.serveForever, name="bookshelves-daemon", daemon=True
         )
-        print("\nTOP TEN")
-        print("~~~~~~~")
-        for row in top_ten:
-            count = row[-1]
-            book = Book(row)
-            print(f"{book} has been read {count} times.")
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop answering requests, waiting for those being answered,
+        and close the socket"""
+        if self._thread is not None:
+            self.server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.server.server_close()
+        self.pool.shutdown()
+
+        if parse_tcp_address(self.address) is None and os.path.exists(self.address):
+            os.remove(self.address)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
 
     def __repr__(self):
-        """Return a string of the expression that creates the object"""
-        return f"{self.__class__.__qualname__}({self.path_to_database})"
+        """Return a string describing the daemon"""
+        return f"{self.__class__.__qualname__}({self.api}, {self.address})"
 
 
 def validate_date(date: str):
@@ -568,6 +3305,259 @@ def validate_date(date: str):
         return False
 
 
+@contextmanager
+def open_csv_output(path: str, compress: bool = False) -> Iterator[TextIO]:
+    """Open path for writing csv text, with - meaning stdout,
+    optionally gzip compressing the output."""
+    if path == "-":
+        if compress:
+            with gzip.open(
+                sys.stdout.buffer, "wt", encoding="utf-8", newline=""
+            ) as output:
+                yield output
+        else:
+            output = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8", newline="")
+            try:
+                yield output
+            finally:
+                output.flush()
+                # leave stdout open for anything else writing to it
+                output.detach()
+    elif compress:
+        with gzip.open(path, "wt", encoding="utf-8", newline="") as output:
+            yield output
+    else:
+        with open(path, "w", encoding="utf-8", newline="") as output:
+            yield output
+
+
+def chunked(iterable: Iterable, size: int) -> Iterator[List]:
+    """Split an iterable into lists of at most size items
+    without reading the whole iterable into memory.
+    Raises ValueError if size is less than 1."""
+    if size < 1:
+        raise ValueError(f"Chunk size must be at least 1: {size}")
+    iterator = iter(iterable)
+    return iter(lambda: list(islice(iterator, size)), [])
+
+
+def read_open_lib_dump(
+    path_to_dump: str,
+    record_types: Tuple[str, ...] = ("/type/edition", "/type/author"),
+) -> Iterator[Tuple[str, dict]]:
+    """Yield type and json record for each line of an open library dump
+    with one of record_types. Dump lines are tab separated type, key,
+    revision, last modified and json record. Gzipped dumps are
+    decompressed as they are read. Malformed lines are skipped."""
+    with open(path_to_dump, "rb") as dump_file:
+        compressed = dump_file.read(2) == b"\x1f\x8b"
+
+    if compressed:
+        dump = gzip.open(path_to_dump, "rt", encoding="utf-8")
+    else:
+        dump = open(path_to_dump, "r", encoding="utf-8")
+
+    with dump:
+        for line_number, line in enumerate(dump, start=1):
+            if line_number % INDEX_PROGRESS_EVERY == 0:
+                logging.info("Read %s lines of %s", line_number, path_to_dump)
+
+            record_type, _, rest = line.partition("\t")
+            # skip parsing json of other record types, such as works
+            if record_type not in record_types:
+                continue
+
+            try:
+                record = json.loads(rest.split("\t", 3)[3])
+            except (IndexError, ValueError) as e:
+                logging.warning("Skipping line %s of dump: %s", line_number, e)
+                continue
+
+            yield record_type, record
+
+
+def edition_isbns(edition: dict) -> List[str]:
+    """Isbn 13 values of an open library edition, including
+    isbn 10 values converted to isbn 13."""
+    isbns = [isbn.replace("-", "").strip() for isbn in edition.get("isbn_13", [])]
+    isbns += [
+        isbn_10_to_13(isbn.replace("-", "").strip())
+        for isbn in edition.get("isbn_10", [])
+    ]
+    # dict keeps order while dropping repeated and invalid isbns
+    return [isbn for isbn in dict.fromkeys(isbns) if isbn and len(isbn) == 13]
+
+
+def isbn_10_to_13(isbn: str) -> str:
+    """Convert isbn 10 to isbn 13, returns empty string for invalid isbns"""
+    if len(isbn) != 10 or not isbn[:9].isdigit():
+        return ""
+
+    digits = "978" + isbn[:9]
+    total = sum(int(digit) * (3 if num % 2 else 1) for num, digit in enumerate(digits))
+    return digits + str((10 - total % 10) % 10)
+
+
+def classify_error(error) -> str:
+    """Class of error that caused an import to fail. Connection errors,
+    timeouts, rate limits and server errors are transient and worth retrying."""
+    import requests
+
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        status_code = error.response.status_code
+        if status_code == 429:
+            return "rate_limited"
+        if status_code in RETRY_STATUS_CODES:
+            return "server_error"
+        return "http_error"
+    if isinstance(
+        error,
+        (requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError),
+    ):
+        return "network"
+    return "error"
+
+
+def hash_file(path: str) -> str:
+    """Sha256 hash of the contents of file at path, read in blocks"""
+    import hashlib
+
+    file_hash = hashlib.sha256()
+    with open(path, "rb") as hashed_file:
+        for block in iter(lambda: hashed_file.read(2**20), b""):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def iter_queue(source_queue: queue.Queue) -> Iterator:
+    """Yield items from a queue until None is taken from it."""
+    while True:
+        item = source_queue.get()
+        if item is None:
+            return
+        yield item
+
+
+def put_while_running(target_queue: queue.Queue, item, consumer: "Future"):
+    """Put item on a bounded queue that is read by consumer.
+    If the consumer stops before there is space its exception is raised
+    rather than waiting forever."""
+    while True:
+        try:
+            target_queue.put(item, timeout=0.5)
+            return
+        except queue.Full:
+            if consumer.done():
+                consumer.result()
+                raise RuntimeError("Queue consumer finished before reading item")
+
+
+def log_throughput(row_count: int, start_time: float):
+    """Log number of rows processed per second since start_time,
+    start_time should be taken from time.perf_counter."""
+    elapsed = time.perf_counter() - start_time
+    rows_per_second = row_count / elapsed if elapsed > 0 else 0
+    logging.info(
+        "Processed %s rows in %.2f seconds (%.0f rows/sec)",
+        row_count,
+        elapsed,
+        rows_per_second,
+    )
+
+
+def parse_tcp_address(address: str) -> Tuple[str, int] | None:
+    """Get host and port from a host:port daemon address,
+    or None if the address is the path of a unix socket"""
+    host, separator, port = address.rpartition(":")
+    if separator and port.isdigit() and "/" not in host and os.sep not in host:
+        return host or "127.0.0.1", int(port)
+    return None
+
+
+def is_loopback_host(host: str) -> bool:
+    """Check if host is localhost or a loopback ip address"""
+    # only daemons need to check addresses
+    import ipaddress
+
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def connect_to_daemon(address: str, timeout: float | None = None):
+    """Open socket connected to the daemon at address"""
+    # only commands talking to a daemon need sockets
+    import socket
+
+    tcp_address = parse_tcp_address(address)
+    if tcp_address is not None:
+        return socket.create_connection(tcp_address, timeout)
+
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.settimeout(timeout)
+    try:
+        connection.connect(address)
+    except OSError:
+        connection.close()
+        raise
+    return connection
+
+
+def daemon_running(address: str) -> bool:
+    """Check if a daemon is listening at address"""
+    try:
+        connect_to_daemon(address, timeout=1).close()
+    except OSError:
+        return False
+    return True
+
+
+def daemon_request(
+    address: str, method: str, path: str, params: Dict | None = None
+) -> Dict:
+    """Make request to the daemon at address and return its json data.
+    Requests are written by hand, as http.client takes longer to import
+    than the daemon takes to answer. Raises RuntimeError if the daemon
+    can't be reached or fails to answer."""
+    body = b""
+    if params is not None:
+        params = {key: value for key, value in params.items() if value is not None}
+        if method == "GET":
+            path = f"{path}?{urlencode(params)}"
+        else:
+            body = json.dumps(params).encode("utf-8")
+
+    request = (
+        f"{method} {path} HTTP/1.0\r\n"
+        "Host: bookshelves\r\n"
+        "Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n"
+    ).encode("utf-8")
+
+    chunks = []
+    try:
+        with connect_to_daemon(address) as connection:
+            connection.sendall(request + body)
+            while chunk := connection.recv(DAEMON_READ_SIZE):
+                chunks.append(chunk)
+    except OSError as e:
+        raise RuntimeError(f"Could not reach daemon at {address}: {e}") from e
+
+    head, _, response = b"".join(chunks).partition(b"\r\n\r\n")
+    try:
+        status_code = int(head.split(None, 2)[1])
+        data = json.loads(response)
+    except (IndexError, ValueError) as e:
+        raise RuntimeError(f"Invalid response from daemon: {head[:100]!r}") from e
+
+    if status_code != 200:
+        raise RuntimeError(f"Daemon failed: {data.get('error', status_code)}")
+    return data
+
+
 def confirm_user_input(check: str):
     """Used to check user input for yes or no."""
     if check[0].lower() == "y":
@@ -576,6 +3566,63 @@ def confirm_user_input(check: str):
         terminate_program()
 
 
+def print_search(query: str, books: Iterable[Book | BookRow]):
+    """Print search results for query"""
+    heading = f"SEARCH RESULTS FOR {query.upper()}"
+
+    print(f"\n{heading}")
+    print("~" * len(heading))
+    for book in books:
+        print(f"{book}, finished {book.date_finished}. Id: {book.id}")
+
+
+def print_top_books(
+    top_books: Iterable[Tuple[Book | BookRow, int]],
+    limit: int = 10,
+    year: str | None = None,
+    author: str | None = None,
+):
+    """Print most read books with their read counts"""
+    heading = "TOP TEN" if limit == 10 else f"TOP {limit}"
+    if author is not None:
+        heading += f" BY {author.upper()}"
+    if year is not None:
+        heading += f" IN {year}"
+
+    print(f"\n{heading}")
+    print("~" * len(heading))
+    for book, count in top_books:
+        print(f"{book} has been read {count} times.")
+
+
+def print_stats(stats: Dict):
+    """Print reading stats from Bookshelves.getStats"""
+    print("\nREADING STATS")
+    print("~~~~~~~~~~~~~")
+    print(f"{stats['books']} books read, {stats['pages']} pages read.")
+    print(f"Average length of {stats['average_pages']:.0f} pages.")
+
+    print("\nBY YEAR")
+    print("~~~~~~~")
+    for stats_year, books, pages in stats["years"]:
+        print(f"{stats_year or 'No date'}: {books} books, {pages} pages")
+
+    print("\nBY MONTH")
+    print("~~~~~~~~")
+    for stats_year, month, books, pages in stats["months"]:
+        print(f"{stats_year}-{month}: {books} books, {pages} pages")
+
+    print("\nTOP AUTHORS")
+    print("~~~~~~~~~~~")
+    for author, books, pages in stats["top_authors"]:
+        print(f"{author}: {books} books, {pages} pages")
+
+    print("\nTOP PUBLISHERS")
+    print("~~~~~~~~~~~~~~")
+    for publisher, books, pages in stats["top_publishers"]:
+        print(f"{publisher}: {books} books, {pages} pages")
+
+
 def usage():
     logging.info(
         """
@@ -586,96 +3633,509 @@ Usage:
     # Add book to database with optional args:
     bookshelves.py -a [valid-isbn] [date-book-finished: yyyy-mm-dd] ["comments on book"]
     bookshelves.py -a [valid-isbn]
+    # Add many books to database, looking them up together:
+    bookshelves.py -a [valid-isbn] [valid-isbn] [valid-isbn]
+    # Add isbns from stdin without any prompts:
+    cat isbns.txt | bookshelves.py -a - --yes
     # import to database from csv
     bookshelves.py -i [path-to-csv]
+    # import to database from csv committing every 5000 rows
+    bookshelves.py -i [path-to-csv] -b 5000
+    # retry imports that failed from network or server errors
+    bookshelves.py --retry-failed
+    # carry on with an import that was interrupted
+    bookshelves.py -i [path-to-csv] --resume
+    # import isbns from csv with 16 concurrent open library lookups
+    bookshelves.py -i [path-to-csv] -w 16
+    # add book or import ignoring cached open library responses
+    bookshelves.py -a [valid-isbn] --refresh
+    bookshelves.py -i [path-to-csv] --no-cache
+    # build offline index from open library dumps, used before the open library
+    bookshelves.py --build_index [path-to-editions-dump] [path-to-authors-dump]
     # export database to csv
     bookshelves.py -e
+    # export database to gzipped csv or to stdout
+    bookshelves.py -e -z
+    bookshelves.py -e -o -
+    # search database
+    bookshelves.py -s "clarke strange"
+    # view reading stats, with monthly stats for one year
+    bookshelves.py --stats
+    bookshelves.py --stats --year 2023
+    # recompute reading stats
+    bookshelves.py --rebuild
     # view top ten books
     bookshelves.py -t
+    # view top 25 books finished in 2023, or by an author
+    bookshelves.py --top 25 --year 2023
+    bookshelves.py --top 25 --author "Susanna Clarke"
+    # show time spent in each phase of a command, or write it as json
+    bookshelves.py -i [path-to-csv] --profile
+    bookshelves.py -e --profile json --profile_output profile.json
+    # profile every function call with cProfile
+    bookshelves.py -e --profile cprofile --profile_output export.prof
+    # run as a daemon on data/bookshelves.sock, or on local http
+    bookshelves.py --serve
+    bookshelves.py --serve 127.0.0.1:8765
+    # send commands to a running daemon
+    bookshelves.py -t --daemon
+    bookshelves.py -a [valid-isbn] --yes --daemon 127.0.0.1:8765
     """
     )
 
 
+def read_isbns(lines: Iterable[str]) -> List[str]:
+    """Get isbns from lines of text, such as stdin. Isbns can be
+    separated by spaces, commas or new lines and may contain hyphens."""
+    isbns = []
+
+    for line in lines:
+        for value in line.replace(",", " ").split():
+            isbn = value.replace("-", "")
+            if Book.validateISBN(isbn):
+                isbns.append(isbn)
+            else:
+                logging.critical("Skipping invalid ISBN: %s", value)
+
+    return isbns
+
+
+def lookup_isbns(
+    isbns: List[str],
+    lookup_batch_size: int = LOOKUP_BATCH_SIZE,
+    workers: int = DEFAULT_WORKERS,
+) -> Dict[str, Dict[str, str] | None]:
+    """Look up isbns in batches with Book.openLibBatchSearch, with
+    batches looked up concurrently by a pool of worker threads.
+    Returns dictionary of isbn to book metadata, with None for isbns
+    that couldn't be found or whose lookup failed."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    def search(batch_isbns: List[str]) -> Dict[str, Dict[str, str] | None]:
+        try:
+            return Book.openLibBatchSearch(batch_isbns)
+        except Exception as e:
+            logging.critical("Lookup of %s failed: %s", ", ".join(batch_isbns), e)
+            return dict.fromkeys(batch_isbns)
+
+    books_metadata = {}
+    batches = chunked(isbns, lookup_batch_size)
+
+    with ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix="bookshelves-fetch"
+    ) as fetchers:
+        for batch_metadata in fetchers.map(search, batches):
+            books_metadata.update(batch_metadata)
+
+    return books_metadata
+
+
+def add_many_books(
+    isbns: List[str],
+    date_finished: str | None = None,
+    comments: str | None = None,
+    lookup_batch_size: int = LOOKUP_BATCH_SIZE,
+    workers: int = DEFAULT_WORKERS,
+    confirm: bool = True,
+    bookshelves: Bookshelves | None = None,
+) -> int:
+    """Look up many isbns concurrently with batched open library requests
+    and add the books to the database in one transaction.
+    If confirm is set each book is checked with the user, who is asked
+    for comments unless comments are passed. Otherwise every book found
+    is added without any prompts. Books are written to bookshelves,
+    by default the database at PATH_TO_DATABASE.
+    Returns number of books added."""
+    logging.info("Searching for %s isbns", len(isbns))
+    books_metadata = lookup_isbns(isbns, lookup_batch_size, workers)
+    books = []
+
+    for isbn in isbns:
+        book_metadata = books_metadata.get(isbn)
+
+        if book_metadata is None:
+            logging.critical("No book metadata found for %s", isbn)
+            continue
+
+        book = Book(book_metadata)
+
+        if confirm:
+            check = input(
+                f"Is {book} the book you want to add to your bookshelves? y/n: "
+            )
+
+            if check[:1].lower() != "y":
+                logging.info("Skipping %s", book)
+                continue
+
+            if comments is None:
+                book.addComments()
+
+        if comments is not None:
+            book.comments = comments
+
+        if date_finished:
+            book.date_finished = date_finished
+
+        books.append(book)
+
+    if not books:
+        logging.info("No books to add to bookshelves")
+        return 0
+
+    if bookshelves is None:
+        with Bookshelves(PATH_TO_DATABASE) as bookshelves:
+            logging.info("Writing %s books to bookshelves", len(books))
+            bookshelves.upsertBooks(books)
+    else:
+        logging.info("Writing %s books to bookshelves", len(books))
+        bookshelves.upsertBooks(books)
+
+    return len(books)
+
+
+def open_lib_index(path_to_index: str) -> OpenLibIndex | None:
+    """Open index at path if it has been built"""
+    if os.path.exists(path_to_index):
+        return OpenLibIndex(path_to_index)
+    return None
+
+
+def build_index(dump_paths: List[str], path_to_index: str):
+    """Add each open library dump file to the index at path_to_index"""
+    for dump_path in dump_paths:
+        if os.path.exists(dump_path) is False:
+            logging.critical("Dump filepath does not exist: %s", dump_path)
+            terminate_program()
+
+    os.makedirs(os.path.dirname(path_to_index) or ".", exist_ok=True)
+    index = OpenLibIndex(path_to_index)
+
+    try:
+        for dump_path in dump_paths:
+            start_time = time.perf_counter()
+            logging.info("Indexing %s", dump_path)
+            edition_count, author_count = index.importDump(dump_path)
+            log_throughput(edition_count + author_count, start_time)
+    finally:
+        index.close()
+
+
+def setup_open_lib_client(args: argparse.Namespace) -> OpenLibClient:
+    """Set and return the shared open library client
+    from the cache and index args passed."""
+    if args.no_cache:
+        cache = None
+    else:
+        os.makedirs(DATA_FOLDER, exist_ok=True)
+        cache = OpenLibCache(PATH_TO_CACHE)
+
+    client = OpenLibClient(
+        cache,
+        refresh=args.refresh,
+        timeout=args.timeout,
+        retries=args.retries,
+        pool_size=args.workers,
+        base_url=args.open_lib_url,
+        index=open_lib_index(args.index),
+    )
+    set_open_lib_client(client)
+    return client
+
+
+def open_bookshelves(args: argparse.Namespace) -> Bookshelves:
+    """Open the database at PATH_TO_DATABASE with the busy timeout,
+    synchronous level and mmap size args passed."""
+    return Bookshelves(
+        PATH_TO_DATABASE, args.busy_timeout, args.synchronous, args.mmap_size
+    )
+
+
+def serve(args: argparse.Namespace):
+    """Answer commands sent to the address given by --serve until interrupted"""
+    import signal
+
+    client = setup_open_lib_client(args)
+
+    with open_bookshelves(args) as bookshelves:
+        api = BookshelvesAPI(
+            bookshelves, args.lookup_batch_size, args.workers, args.serve_folder
+        )
+        try:
+            daemon = BookshelvesDaemon(api, args.serve, args.workers)
+        except (OSError, ValueError) as e:
+            logging.critical("Could not listen on %s: %s", args.serve, e)
+            terminate_program()
+
+        def stop_serving(signal_number, frame):
+            raise KeyboardInterrupt
+
+        # stop cleanly when stopped by service managers as well as ctrl-c
+        signal.signal(signal.SIGTERM, stop_serving)
+
+        logging.info("Serving %s on %s", bookshelves.db, daemon.address)
+        try:
+            daemon.serveForever()
+        except KeyboardInterrupt:
+            logging.info("Stopping daemon")
+        finally:
+            daemon.stop()
+
+    client.logStats()
+
+
+def forward_command(args: argparse.Namespace) -> bool:
+    """Send command to the daemon given by --daemon and print its result.
+    Commands that would ask for confirmation are only sent with --yes.
+    Returns False if the command isn't sent, so it can be run locally."""
+    address = args.daemon
+
+    if args.add and args.yes:
+        isbns, date_finished, comments = parse_add_args(args.add)
+        data = daemon_request(
+            address,
+            "POST",
+            "/add",
+            {"isbns": isbns, "date_finished": date_finished, "comments": comments},
+        )
+        logging.info("Daemon added %s of %s books", data["added"], data["isbns"])
+    elif args.export and args.output != "-":
+        path = os.path.abspath(args.output) if args.output else None
+        data = daemon_request(
+            address, "POST", "/export", {"path": path, "compress": args.gzip}
+        )
+        logging.info("Daemon exported %s rows", data["rows"])
+    elif args.import_csv and args.yes:
+        data = daemon_request(
+            address,
+            "POST",
+            "/import",
+            {
+                "path": os.path.abspath(args.import_csv),
+                "batch_size": args.batch_size,
+                "resume": args.resume,
+            },
+        )
+        logging.info(
+            "Daemon imported %s titles, %s failed", data["imported"], data["failed"]
+        )
+    elif args.search:
+        data = daemon_request(address, "GET", "/search", {"q": args.search})
+        print_search(args.search, [Book(book) for book in data["books"]])
+    elif args.stats and not args.rebuild:
+        print_stats(daemon_request(address, "GET", "/stats", {"year": args.year}))
+    elif args.top_ten or args.top:
+        limit = args.top or 10
+        data = daemon_request(
+            address,
+            "GET",
+            "/top",
+            {"limit": limit, "year": args.year, "author": args.author},
+        )
+        top_books = [(Book(top["book"]), top["read_count"]) for top in data["books"]]
+        print_top_books(top_books, limit, args.year, args.author)
+    else:
+        return False
+
+    return True
+
+
+def parse_add_args(values: List[str]) -> Tuple[List[str], str | None, str | None]:
+    """Get isbns, date finished and comments from the values passed to -a,
+    where - reads isbns from stdin. Exits if no isbn is given."""
+    isbns = []
+    date_finished = None
+    comments = None
+
+    for value in values:
+        if value == "-":
+            isbns.extend(read_isbns(sys.stdin))
+        elif Book.validateISBN(value) is True:
+            isbns.append(value.strip())
+        elif validate_date(value) is True:
+            date_finished = value
+        else:
+            comments = value
+
+    if not isbns:
+        logging.critical("No valid ISBN passed for adding book to database")
+        terminate_program()
+
+    return isbns, date_finished, comments
+
+
 def terminate_program():
     """Wrapper function to quickly and clearly exit program"""
     logging.critical("Terminating program")
     sys.exit(1)
 
 
+def profile_command(args: argparse.Namespace):
+    """Run command with the profiler enabled, then write the time spent
+    in each phase and the counters in the format given by --profile.
+    The cprofile format also profiles every function call, which
+    slows down the command."""
+    profiler.enable()
+
+    if args.profile == "cprofile":
+        # only needed when profiling
+        import cProfile
+        import pstats
+
+        function_profile = cProfile.Profile()
+        try:
+            function_profile.runcall(run_command, args)
+        finally:
+            profiler.printReport()
+            if args.profile_output:
+                function_profile.dump_stats(args.profile_output)
+                logging.info("cProfile stats written to %s", args.profile_output)
+            else:
+                stats = pstats.Stats(function_profile, stream=sys.stderr)
+                stats.sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+    else:
+        try:
+            run_command(args)
+        finally:
+            if args.profile == "json":
+                report = dict(command=sys.argv[1:], **profiler.report())
+                if args.profile_output:
+                    with open(args.profile_output, "w", encoding="utf-8") as output:
+                        json.dump(report, output, indent=2)
+                    logging.info("Profile written to %s", args.profile_output)
+                else:
+                    json.dump(report, sys.stderr, indent=2)
+                    print(file=sys.stderr)
+            else:
+                profiler.printReport()
+
+
 def main():
+    logging.basicConfig(
+        level=logging.INFO, format=" %(asctime)s -  %(levelname)s -  %(message)s"
+    )
+
     if (len(sys.argv)) == 1:
         logging.info("Invalid usage: no args passed\n")
         usage()
         terminate_program()
     else:
-        args = parser.parse_args()
-        if args.add:
-            isbn = None
-            date_finished = None
-            comments = None
-
-            for arg in args.add:
-                if Book.validateISBN(arg) is True:
-                    isbn = arg
-                elif validate_date(arg) is True:
-                    date_finished = arg
-                else:
-                    comments = arg
+        args = make_parser().parse_args()
+        if args.profile:
+            profile_command(args)
+        else:
+            run_command(args)
 
-            if isbn is None:
-                logging.critical("No valid ISBN passed for adding book to database")
-                terminate_program()
 
-            logging.info("searching for %s", isbn)
+def run_command(args: argparse.Namespace):
+    """Run the command given by args, or send it to a daemon with --daemon"""
+    if args.daemon:
+        try:
+            if forward_command(args):
+                return
+        except RuntimeError as e:
+            logging.critical(e)
+            terminate_program()
+        logging.info("Running command locally, as it can't be sent to a daemon")
 
-            book = Book(isbn)
+    if args.add:
+        isbns, date_finished, comments = parse_add_args(args.add)
 
-            logging.info(book)
+        setup_open_lib_client(args)
 
-            check = input(
-                f"Is {book} the book you want to add to your bookshelves? y/n: "
-            )
+        if len(isbns) > 1 or args.yes:
+            with open_bookshelves(args) as bookshelves:
+                add_many_books(
+                    isbns,
+                    date_finished,
+                    comments,
+                    args.lookup_batch_size,
+                    args.workers,
+                    confirm=not args.yes,
+                    bookshelves=bookshelves,
+                )
+            return
 
-            check = confirm_user_input(check)
+        isbn = isbns[0]
 
-            if comments is None:
-                logging.info("Checking for user comments")
-                book.addComments()
-            else:
-                logging.info("Assigning user comments from args passed")
-                book.comments = comments
+        logging.info("searching for %s", isbn)
+
+        book = Book(isbn)
+
+        logging.info(book)
 
-            if date_finished:
-                logging.info("Assigning date finished for book from args passed")
-                book.date_finished = date_finished
+        check = input(f"Is {book} the book you want to add to your bookshelves? y/n: ")
 
-            if check:
-                logging.info("Establishing Bookshelves class")
-                bookshelves = Bookshelves(PATH_TO_DATABASE)
+        check = confirm_user_input(check)
 
+        if comments is None:
+            logging.info("Checking for user comments")
+            book.addComments()
+        else:
+            logging.info("Assigning user comments from args passed")
+            book.comments = comments
+
+        if date_finished:
+            logging.info("Assigning date finished for book from args passed")
+            book.date_finished = date_finished
+
+        if check:
+            logging.info("Establishing Bookshelves class")
+            with open_bookshelves(args) as bookshelves:
                 logging.info("Writing %s to bookshelves", book.isbn_13)
                 bookshelves.addToDatabase(book)
-        elif args.export:
-            logging.info("Establishing bookshelves class")
-            bookshelves = Bookshelves(PATH_TO_DATABASE)
+    elif args.export:
+        logging.info("Establishing bookshelves class")
+        with open_bookshelves(args) as bookshelves:
+            bookshelves.exportToCSV(args.output, args.gzip)
+    elif args.import_csv:
+        import_csv_filepath = args.import_csv
+
+        if os.path.exists(import_csv_filepath) is False:
+            logging.critical("CSV filepath does not exist: %s", import_csv_filepath)
+            terminate_program()
 
-            bookshelves.exportToCSV()
-        elif args.import_csv:
-            import_csv_filepath = args.import_csv
+        client = setup_open_lib_client(args)
 
-            if os.path.exists(import_csv_filepath) is False:
-                logging.critical("CSV filepath does not exist: %s", import_csv_filepath)
-                terminate_program()
+        with open_bookshelves(args) as bookshelves:
+            bookshelves.importFromCSV(
+                import_csv_filepath,
+                args.batch_size,
+                args.workers,
+                args.lookup_batch_size,
+                args.resume,
+                confirm=not args.yes,
+            )
 
-            bookshelves.importFromCSV(import_csv_filepath)
-        elif args.top_ten:
-            bookshelves = Bookshelves(PATH_TO_DATABASE)
+        client.logStats()
+    elif args.retry_failed:
+        client = setup_open_lib_client(args)
 
-            bookshelves.getTopTenBooks()
+        with open_bookshelves(args) as bookshelves:
+            bookshelves.retryFailedImports(
+                args.batch_size, args.workers, args.lookup_batch_size
+            )
 
-        else:
-            logging.critical("Invalid args given.")
-            terminate_program()
+        client.logStats()
+    elif args.build_index:
+        build_index(args.build_index, args.index)
+    elif args.search:
+        with open_bookshelves(args) as bookshelves:
+            bookshelves.printSearch(args.search)
+    elif args.stats or args.rebuild:
+        with open_bookshelves(args) as bookshelves:
+            if args.rebuild:
+                bookshelves.rebuildStats()
+            if args.stats:
+                bookshelves.printStats(args.year)
+    elif args.top_ten or args.top:
+        with open_bookshelves(args) as bookshelves:
+            bookshelves.printTopBooks(args.top or 10, args.year, args.author)
+    elif args.serve:
+        serve(args)
+    else:
+        logging.critical("Invalid args given.")
+        terminate_program()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,330 @@
+"""openlib_server is a local stand-in for the open library, so imports
+can be tested and load tested without the live service. It serves
+/isbn/[isbn].json, /authors/[key].json and /api/books from fixture data,
+and can add latency, server errors and rate limiting to responses."""
+
+import argparse
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from typing import Dict, Iterable
+from urllib.parse import parse_qs, urlparse
+
+PATH_TO_FIXTURES = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "fixtures", "openlib.json"
+)
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument("--host", default="127.0.0.1", help="Address to serve on")
+parser.add_argument("-p", "--port", type=int, default=8080, help="Port to serve on")
+parser.add_argument(
+    "-f",
+    "--fixtures",
+    default=PATH_TO_FIXTURES,
+    help="Json file of editions and authors to serve",
+)
+parser.add_argument(
+    "-g",
+    "--generate",
+    type=int,
+    help="Serve this many synthetic books from benchmark.py instead of fixtures",
+)
+parser.add_argument(
+    "--latency", type=float, default=0, help="Seconds to wait before each response"
+)
+parser.add_argument(
+    "--error_rate",
+    type=float,
+    default=0,
+    help="Share of requests answered with a 503 server error",
+)
+parser.add_argument(
+    "--rate_limit_rate",
+    type=float,
+    default=0,
+    help="Share of requests answered with a 429 rate limit",
+)
+parser.add_argument(
+    "--retry_after",
+    type=float,
+    default=1,
+    help="Seconds sent in Retry-After header of rate limited responses",
+)
+parser.add_argument("--seed", type=int, default=1, help="Seed for injected faults")
+
+
+def load_fixtures(path: str) -> Dict[str, Dict[str, dict]]:
+    """Load fixtures json, with editions keyed by isbn
+    and authors keyed by author key."""
+    with open(path, "r", encoding="utf-8") as fixtures_file:
+        return json.load(fixtures_file)
+
+
+def fixtures_from_books(books: Iterable[Dict[str, str]]) -> Dict[str, Dict[str, dict]]:
+    """Build fixtures from book metadata in the database schema,
+    so the books fetched from the server match the books given."""
+    editions = {}
+    authors = {}
+
+    for book in books:
+        author_keys = [book["primary_author_key"]]
+        author_names = [book["primary_author"]]
+        # secondary authors are stored with a leading comma
+        author_keys += [
+            key for key in book["secondary_authors_keys"].split(", ") if key
+        ]
+        author_names += [name for name in book["secondary_authors"].split(", ") if name]
+
+        for key, name in zip(author_keys, author_names):
+            authors[key] = {"key": key, "name": name}
+
+        identifiers = {}
+        if book["goodreads_identifier"]:
+            identifiers["goodreads"] = [book["goodreads_identifier"]]
+        if book["librarything_identifier"]:
+            identifiers["librarything"] = [book["librarything_identifier"]]
+
+        edition = {
+            "key": book["open_lib_key"],
+            "title": book["title"],
+            "authors": [{"key": key} for key in author_keys],
+            "publish_date": book["edition_publish_date"],
+            "publishers": [book["publisher"]],
+            "isbn_13": [book["isbn_13"]],
+            "identifiers": identifiers,
+        }
+        if book["number_of_pages"] != "":
+            edition["number_of_pages"] = int(book["number_of_pages"])
+
+        editions[book["isbn_13"]] = edition
+
+    return {"editions": editions, "authors": authors}
+
+
+class OpenLibServer(ThreadingHTTPServer):
+    """Class for serving fixtures in the same format as the open library.
+    Faults are picked at random from a seeded generator, so the same
+    share of requests fail on each run."""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        fixtures: Dict[str, Dict[str, dict]],
+        address: tuple = ("127.0.0.1", 0),
+        latency: float = 0,
+        error_rate: float = 0,
+        rate_limit_rate: float = 0,
+        retry_after: float = 1,
+        seed: int = 1,
+    ):
+        """Create new server listening on address, port 0 picks a free port.
+        The server is not started until start or serve_forever are called."""
+        super().__init__(address, OpenLibRequestHandler)
+        self.editions = fixtures.get("editions", {})
+        self.authors = fixtures.get("authors", {})
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+        # count of responses sent for each status code
+        self.stats = Counter()
+
+    @property
+    def url(self) -> str:
+        """Base url to pass to the open library client"""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def fault(self) -> int | None:
+        """Status code of fault to answer the next request with, if any"""
+        with self._lock:
+            roll = self._random.random()
+
+        if roll < self.rate_limit_rate:
+            return 429
+        if roll < self.rate_limit_rate + self.error_rate:
+            return 503
+        return None
+
+    def recordResponse(self, status_code: int):
+        with self._lock:
+            self.stats[status_code] += 1
+
+    def booksApiData(self, isbn: str) -> dict | None:
+        """Edition of isbn in the format of the books api with jscmd=data,
+        where authors are given by name and url."""
+        edition = self.editions.get(isbn)
+        if edition is None:
+            return None
+
+        authors = []
+        for author in edition.get("authors", []):
+            name = self.authors.get(author["key"], {}).get("name", "")
+            slug = name.replace(" ", "_")
+            authors.append({"url": f"{self.url}{author['key']}/{slug}", "name": name})
+
+        book = {
+            "url": f"{self.url}{edition['key']}",
+            "key": edition["key"],
+            "title": edition["title"],
+            "authors": authors,
+            "identifiers": dict(edition.get("identifiers", {}), isbn_13=[isbn]),
+            "publishers": [{"name": name} for name in edition.get("publishers", [])],
+            "publish_date": edition.get("publish_date", ""),
+        }
+        if "number_of_pages" in edition:
+            book["number_of_pages"] = edition["number_of_pages"]
+
+        return book
+
+    def start(self):
+        """Serve requests from a background thread, returns the server"""
+        # short poll interval so stopping the server does not hold up tests
+        self._thread = threading.Thread(
+            target=self.serve_forever,
+            kwargs={"poll_interval": 0.05},
+            name="openlib-server",
+            daemon=True,
+        )
+        self._thread.start()
+        logging.debug(self.__repr__())
+        return self
+
+    def stop(self):
+        """Stop serving requests and close the socket"""
+        if self._thread is not None:
+            self.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def __repr__(self):
+        """Return a string describing the server"""
+        return (
+            f"{self.__class__.__qualname__}({self.url}, {len(self.editions)} editions, "
+            f"latency={self.latency}, error_rate={self.error_rate}, "
+            f"rate_limit_rate={self.rate_limit_rate})"
+        )
+
+
+class OpenLibRequestHandler(BaseHTTPRequestHandler):
+    """Class for answering requests to the stand-in server"""
+
+    server: OpenLibServer
+
+    isbn_path = re.compile(r"^/isbn/(\w+)\.json$")
+    author_path = re.compile(r"^(/authors/\w+)\.json$")
+
+    def do_GET(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        fault = self.server.fault()
+        if fault == 429:
+            self.sendJSON(429, {"error": "rate limited"}, self.server.retry_after)
+            return
+        if fault is not None:
+            self.sendJSON(fault, {"error": "service unavailable"})
+            return
+
+        url = urlparse(self.path)
+
+        if url.path == "/api/books":
+            self.sendBooks(parse_qs(url.query))
+        elif match := self.isbn_path.match(url.path):
+            self.sendFixture(self.server.editions.get(match[1]))
+        elif match := self.author_path.match(url.path):
+            self.sendFixture(self.server.authors.get(match[1]))
+        else:
+            self.sendJSON(404, {"error": "notfound"})
+
+    def sendBooks(self, query: Dict[str, list]):
+        """Send books api data for each isbn in bibkeys that has an edition.
+        Like the open library, isbns without an edition are left out."""
+        books = {}
+        for bibkeys in query.get("bibkeys", []):
+            for bibkey in bibkeys.split(","):
+                book = self.server.booksApiData(bibkey.removeprefix("ISBN:"))
+                if book is not None:
+                    books[bibkey] = book
+
+        self.sendJSON(200, books)
+
+    def sendFixture(self, fixture: dict | None):
+        if fixture is None:
+            self.sendJSON(404, {"error": "notfound"})
+        else:
+            self.sendJSON(200, fixture)
+
+    def sendJSON(self, status_code: int, data, retry_after: float | None = None):
+        body = json.dumps(data).encode("utf-8")
+
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if retry_after is not None:
+            self.send_header("Retry-After", str(retry_after))
+        self.end_headers()
+        self.wfile.write(body)
+
+        self.server.recordResponse(status_code)
+
+    def log_message(self, format, *args):
+        """Log requests at debug level rather than writing to stderr"""
+        logging.debug("%s - %s", self.address_string(), format % args)
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO, format=" %(asctime)s -  %(levelname)s -  %(message)s"
+    )
+    args = parser.parse_args()
+
+    if args.generate:
+        from benchmark import generate_books
+
+        fixtures = fixtures_from_books(generate_books(args.generate, args.seed))
+    else:
+        fixtures = load_fixtures(args.fixtures)
+
+    server = OpenLibServer(
+        fixtures,
+        (args.host, args.port),
+        latency=args.latency,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        seed=args.seed,
+    )
+
+    logging.info("Serving %s", server)
+    logging.info("Use with: bookshelves.py --open_lib_url %s", server.url)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logging.info("Responses sent: %s", dict(server.stats))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Tests for benchmark script"""
+import unittest
+from unittest import mock
+
+from benchmark import (
+    STARTUP_COMMANDS,
+    generate_books,
+    over_budget,
+    run_benchmarks,
+    time_startup,
+)
+
+
+class TestGenerateBooks(unittest.TestCase):
+    """Tests for generating synthetic shelves"""
+
+    def test_generate_books(self):
+        books = list(generate_books(500))
+        self.assertEqual(len(books), 500)
+
+        print("testing some books are re-read")
+        titles = [book["title"] for book in books]
+        self.assertLess(len(set(titles)), len(titles))
+
+        print("testing shelves are repeatable")
+        self.assertEqual(books, list(generate_books(500)))
+        self.assertNotEqual(books, list(generate_books(500, seed=2)))
+
+
+class TestRunBenchmarks(unittest.TestCase):
+    """Tests for running benchmarks on a small shelf"""
+
+    @mock.patch("builtins.print")
+    def test_run_benchmarks(self, mocked_print):
+        results = run_benchmarks([50])
+
+        operations = [result["operation"] for result in results["results"]]
+        self.assertIn("import_csv", operations)
+        self.assertIn("export_csv", operations)
+        for result in results["results"]:
+            self.assertEqual(result["rows"], 50)
+            self.assertGreater(result["seconds"], 0)
+            self.assertGreater(result["peak_memory_bytes"], 0)
+
+
+class TestTimeStartup(unittest.TestCase):
+    """Tests guarding how long commands take to import what they need"""
+
+    def test_time_startup(self):
+        results = time_startup(50)
+
+        self.assertEqual(
+            [result["command"] for result in results], list(STARTUP_COMMANDS)
+        )
+        for result in results:
+            print(f"testing imports of {result['command']}")
+            self.assertIn("sqlite3", result["modules"])
+            self.assertEqual(result["lazy_modules_imported"], [])
+
+    def test_over_budget(self):
+        # import times depend on the machine, so budgets are only
+        # checked by benchmark.py --startup
+        results = [
+            {"command": "top", "import_ms": 80, "budget_ms": 75},
+            {"command": "export", "import_ms": 20, "budget_ms": 75},
+            {"command": "search", "import_ms": 20, "budget_ms": 75},
+        ]
+        for result in results:
+            result["lazy_modules_imported"] = []
+        results[2]["lazy_modules_imported"] = ["requests"]
+
+        self.assertEqual(over_budget(results), ["top", "search"])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
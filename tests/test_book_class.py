@@ -2,8 +2,9 @@
 import unittest
 from unittest import mock
 from datetime import datetime
+import sqlite3
 
-from bookshelves import Book
+from bookshelves import Book, BookRow, OpenLibClient
 
 
 class TestBookClass(unittest.TestCase):
@@ -81,6 +82,50 @@ class TestBookClass(unittest.TestCase):
 
         self.assertEqual(datestamp, default_dict["date_added"])
 
+    def test_complete_book_metadata(self):
+        book = Book(self.test_book_metadata)
+        complete_book_metadata = book.complete_book_metadata
+
+        self.assertEqual(list(complete_book_metadata), list(Book.setDefaultDict()))
+        self.assertEqual(list(complete_book_metadata.values()), list(book))
+        self.assertEqual(complete_book_metadata["title"], book.title)
+
+        print("testing books only keep schema values")
+        with self.assertRaises(AttributeError):
+            book.extra_value = "extra"
+
+    def test_book_keeps_blank_dates(self):
+        book = Book({"title": "Test", "date_added": "", "date_finished": "2023-01-01"})
+        self.assertEqual(book.date_added, "")
+        self.assertEqual(book.date_finished, "2023-01-01")
+
+    def test_book_row(self):
+        connection = sqlite3.connect(":memory:")
+        connection.row_factory = sqlite3.Row
+        columns = list(Book.setDefaultDict())
+        connection.execute(f"CREATE TABLE bookshelves ({', '.join(columns)})")
+        connection.execute(
+            f"INSERT INTO bookshelves VALUES ({', '.join('?' * len(columns))})",
+            list(Book(self.test_book_metadata)),
+        )
+
+        row = connection.execute("SELECT * FROM bookshelves").fetchone()
+        view = BookRow(row)
+        book = Book(self.test_book_metadata)
+
+        self.assertEqual(view.title, book.title)
+        self.assertEqual(list(view), list(book))
+        self.assertEqual(str(view), str(book))
+        self.assertEqual(view.complete_book_metadata, book.complete_book_metadata)
+        self.assertEqual(list(view.toBook()), list(book))
+
+        print("testing views are read only")
+        with self.assertRaises(AttributeError):
+            view.title = "Changed"
+        with self.assertRaises(AttributeError):
+            view.read_count
+        connection.close()
+
     def test_valid_isbn(self):
         valid_isbn = "9780747579885"
         self.assertTrue(Book.validateISBN(valid_isbn))
@@ -99,6 +144,83 @@ class TestBookClass(unittest.TestCase):
         book.addComments()
         self.assertEqual(book.comments, "test comment")
 
+    def test_openLibIsbnSearch(self):
+        """Test open library search with mocked responses"""
+        responses = {
+            "https://openlibrary.org/isbn/9781844088058.json": {
+                "title": "Lolly Willowes",
+                "authors": [
+                    {"key": "/authors/OL39232A"},
+                    {"key": "/authors/OL20510A"},
+                    {"key": "/authors/OL39232A"},
+                ],
+                "publish_date": "2012",
+                "publishers": ["Little, Brown Book Group Limited"],
+                "key": "/books/OL28472551M",
+            },
+            "https://openlibrary.org/authors/OL39232A.json": {
+                "name": "Sylvia Townsend Warner"
+            },
+            "https://openlibrary.org/authors/OL20510A.json": {"name": "Alison Light"},
+        }
+        client = OpenLibClient()
+
+        with mock.patch.object(client, "getJSON", side_effect=responses.get) as get:
+            book_metadata = Book.openLibIsbnSearch("9781844088058", client)
+
+        self.assertEqual(book_metadata["primary_author"], "Sylvia Townsend Warner")
+        self.assertEqual(
+            book_metadata["secondary_authors"],
+            ", Alison Light, Sylvia Townsend Warner",
+        )
+        self.assertEqual(
+            book_metadata["secondary_authors_keys"],
+            ", /authors/OL20510A, /authors/OL39232A",
+        )
+        self.assertEqual(book_metadata["number_of_pages"], "")
+        print("testing repeated author is only fetched once")
+        self.assertEqual(get.call_count, 3)
+
+    def test_openLibBatchSearch(self):
+        """Test open library books api search with mocked response"""
+        books_api_response = {
+            "ISBN:9780747579885": {
+                "key": "/books/OL7962789M",
+                "title": "Jonathan Strange and Mr. Norrell",
+                "authors": [
+                    {
+                        "url": "https://openlibrary.org/authors/OL1387961A/Susanna_Clarke",
+                        "name": "Susanna Clarke",
+                    }
+                ],
+                "number_of_pages": 1024,
+                "identifiers": {
+                    "goodreads": ["823763"],
+                    "librarything": ["1060"],
+                    "isbn_13": ["9780747579885"],
+                },
+                "publishers": [{"name": "Bloomsbury Publishing PLC"}],
+                "publish_date": "September 5, 2005",
+            }
+        }
+        client = OpenLibClient()
+        response = mock.Mock(status_code=200)
+        response.json.return_value = books_api_response
+
+        with mock.patch.object(client, "get", return_value=response) as get:
+            books_metadata = Book.openLibBatchSearch(
+                ["9780747579885", "9780000000002"], client
+            )
+
+        get.assert_called_once_with(
+            "https://openlibrary.org/api/books?bibkeys=ISBN:9780747579885,ISBN:9780000000002&format=json&jscmd=data"
+        )
+        self.assertEqual(books_metadata["9780747579885"], self.test_book_metadata)
+        self.assertIsNone(books_metadata["9780000000002"])
+
+    def test_booksApiMetadata_without_authors(self):
+        self.assertIsNone(Book.booksApiMetadata("9780747579885", {"title": "Test"}))
+
 
 if __name__ == "__main__":
     unittest.main(verbosity=2)
@@ -1,7 +1,20 @@
 """Tests for all stand alone functions"""
+import io
 import unittest
-
-from bookshelves import validate_date, confirm_user_input
+from unittest import mock
+from os.path import exists, join
+from os import remove
+
+from bookshelves import (
+    Bookshelves,
+    add_many_books,
+    confirm_user_input,
+    lookup_isbns,
+    make_parser,
+    positive_int,
+    read_isbns,
+    validate_date,
+)
 
 
 class TestValidateDate(unittest.TestCase):
@@ -20,6 +33,31 @@ class TestValidateDate(unittest.TestCase):
         self.assertTrue(valid_date)
 
 
+class TestPositiveInt(unittest.TestCase):
+    """Tests for positive int argument type"""
+
+    def test_positive_int(self):
+        self.assertEqual(positive_int("8"), 8)
+
+    @mock.patch("sys.stderr", new_callable=io.StringIO)
+    def test_workers_must_be_positive(self, mocked_stderr):
+        parser = make_parser()
+        for value in ["0", "-1", "eight"]:
+            print(f"testing -w {value} is a usage error")
+            with self.assertRaises(SystemExit):
+                parser.parse_args(["-t", "-w", value])
+        self.assertIn("must be a positive integer", mocked_stderr.getvalue())
+
+    @mock.patch("sys.stderr", new_callable=io.StringIO)
+    def test_lookup_batch_size_must_be_positive(self, mocked_stderr):
+        parser = make_parser()
+        for value in ["0", "-20"]:
+            print(f"testing -l {value} is a usage error")
+            with self.assertRaises(SystemExit):
+                parser.parse_args(["-i", "books.csv", "-l", value])
+        self.assertIn("must be a positive integer", mocked_stderr.getvalue())
+
+
 class TestConfirmUserInput(unittest.TestCase):
     """Tests for confirm user input function"""
 
@@ -48,5 +86,95 @@ class TestConfirmUserInput(unittest.TestCase):
         self.assertEqual(command.exception.code, 1)
 
 
+class TestReadIsbns(unittest.TestCase):
+    """Tests for read isbns function"""
+
+    def test_read_isbns(self):
+        lines = io.StringIO("9780747579885 978-0-14-044913-6\n\n9781000000001,bad\n")
+        isbns = read_isbns(lines)
+        self.assertEqual(isbns, ["9780747579885", "9780140449136", "9781000000001"])
+
+
+def fake_batch_search(isbns):
+    """Find every isbn except those ending in 0,
+    and fail batches including an isbn ending in 9"""
+    if any(isbn.endswith("9") for isbn in isbns):
+        raise ConnectionError("lookup failed")
+    return {
+        isbn: None
+        if isbn.endswith("0")
+        else {"title": f"Title {isbn}", "isbn_13": isbn}
+        for isbn in isbns
+    }
+
+
+class TestAddManyBooks(unittest.TestCase):
+    """Tests for looking up and adding many books"""
+
+    def setUp(self):
+        self.path_to_test_db = join("tests", "test-add-many.db")
+        self.isbns = [f"978100000000{num}" for num in range(10)]
+
+    def tearDown(self):
+        if exists(self.path_to_test_db):
+            remove(self.path_to_test_db)
+
+    @mock.patch("bookshelves.Book.openLibBatchSearch", side_effect=fake_batch_search)
+    def test_lookup_isbns(self, mocked_search):
+        books_metadata = lookup_isbns(self.isbns, lookup_batch_size=3, workers=2)
+
+        self.assertEqual(set(books_metadata), set(self.isbns))
+        self.assertIsNone(books_metadata["9781000000000"])
+        # the last batch failed so its isbns are not found
+        self.assertIsNone(books_metadata["9781000000009"])
+        self.assertEqual(
+            books_metadata["9781000000005"]["title"], "Title 9781000000005"
+        )
+        self.assertEqual(mocked_search.call_count, 4)
+
+        print("testing batch sizes below 1 are rejected")
+        for lookup_batch_size in [0, -1]:
+            with self.assertRaises(ValueError):
+                lookup_isbns(self.isbns, lookup_batch_size=lookup_batch_size)
+
+    @mock.patch("bookshelves.input", create=True)
+    @mock.patch("bookshelves.Book.openLibBatchSearch", side_effect=fake_batch_search)
+    def test_add_many_books_without_confirm(self, mocked_search, mocked_input):
+        with mock.patch("bookshelves.PATH_TO_DATABASE", self.path_to_test_db):
+            added = add_many_books(
+                self.isbns,
+                "2023-12-01",
+                "read on holiday",
+                lookup_batch_size=3,
+                workers=2,
+                confirm=False,
+            )
+
+        mocked_input.assert_not_called()
+        self.assertEqual(added, 8)
+        with Bookshelves(self.path_to_test_db) as bookshelves:
+            connection, cursor = bookshelves.getConnection()
+            rows = cursor.execute(
+                """SELECT isbn_13, date_finished, comments FROM bookshelves"""
+            ).fetchall()
+
+        self.assertEqual(
+            [row["isbn_13"] for row in rows],
+            [isbn for isbn in self.isbns[1:] if not isbn.endswith("9")],
+        )
+        self.assertEqual(rows[0]["date_finished"], "2023-12-01")
+        self.assertEqual(rows[0]["comments"], "read on holiday")
+
+    @mock.patch("bookshelves.input", create=True, side_effect=["y", "n"])
+    @mock.patch("bookshelves.Book.openLibBatchSearch", side_effect=fake_batch_search)
+    def test_add_many_books_with_confirm(self, mocked_search, mocked_input):
+        with mock.patch("bookshelves.PATH_TO_DATABASE", self.path_to_test_db):
+            added = add_many_books(self.isbns[1:3], comments="")
+
+        self.assertEqual(added, 1)
+        # comments were passed so only the confirmation is asked
+        self.assertEqual(mocked_input.call_count, 2)
+
+
 if __name__ == "__main__":
     unittest.main(verbosity=2)
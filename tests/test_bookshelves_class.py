@@ -1,11 +1,29 @@
 """Tests for bookshelves class"""
+
 import csv
+import gzip
+import io
+import sqlite3
+import threading
+import time
 import unittest
 from unittest import mock
 from os.path import exists, join
 from os import remove
 
-from bookshelves import Bookshelves, Book
+import requests
+
+from bookshelves import (
+    Bookshelves,
+    Book,
+    FailedImports,
+    ImportCheckpoint,
+    IMPORT_CHUNK_SIZE,
+    IMPORT_QUEUE_CHUNKS,
+    MIGRATIONS,
+    PRIMARY_AUTHOR_READS,
+    classify_error,
+)
 
 
 class TestBookshelvesClass(unittest.TestCase):
@@ -40,6 +58,10 @@ class TestBookshelvesClass(unittest.TestCase):
     def tearDownClass(cls):
         """Once run is finished delete test db"""
         remove(join("tests", "test.db"))
+        # write ahead log left by connections that were never closed
+        for suffix in ("-wal", "-shm"):
+            if exists(join("tests", "test.db" + suffix)):
+                remove(join("tests", "test.db" + suffix))
         remove(join("tests", "test-import.csv"))
         remove(join("tests", "test-export.csv"))
 
@@ -53,12 +75,13 @@ class TestBookshelvesClass(unittest.TestCase):
         """Tests newly made db schema"""
         bookshelves = Bookshelves(self.path_to_test_db)
         connection, cursor = bookshelves.getConnection()
-        query = cursor.execute("""SELECT name FROM sqlite_master WHERE type='table'""")
+        query = cursor.execute(
+            """SELECT type FROM sqlite_master WHERE name = 'bookshelves'"""
+        )
         result = query.fetchone()
-        print("testing table name is correctly set")
-        self.assertEqual((result["name"]), "bookshelves")
-        query
-        print("testing table headers are correctly set")
+        print("testing bookshelves view is correctly set")
+        self.assertEqual((result["type"]), "view")
+        print("testing view headers are correctly set")
         for db_row, expected_header in zip(
             connection.execute("pragma table_info('bookshelves')").fetchall(),
             self.db_headers,
@@ -198,5 +221,1214 @@ class TestBookshelvesClass(unittest.TestCase):
                 self.assertEqual(row["isbn_13"], test_book2_metadata["isbn_13"])
 
 
+class TestBookshelvesBulkUpsert(unittest.TestCase):
+    """Tests for writing many books at once with upsertBooks."""
+
+    def setUp(self):
+        self.path_to_test_db = join("tests", "test-bulk.db")
+        self.bookshelves = Bookshelves(self.path_to_test_db)
+        self.books_metadata = [
+            {
+                "title": f"Test Book {num}",
+                "primary_author": "Test Author",
+                "isbn_13": "9780747579885",
+                "date_added": "2023-10-23",
+                "date_finished": "2023-10-23",
+            }
+            for num in range(5)
+        ]
+
+    def tearDown(self):
+        self.bookshelves.close()
+        remove(self.path_to_test_db)
+
+    def get_rows(self):
+        connection, cursor = self.bookshelves.getConnection()
+        return cursor.execute("""SELECT * FROM bookshelves ORDER BY id""").fetchall()
+
+    def test_upsertBooks_inserts_new_books(self):
+        books = (Book(book_metadata) for book_metadata in self.books_metadata)
+        row_count = self.bookshelves.upsertBooks(books)
+
+        self.assertEqual(row_count, 5)
+        rows = self.get_rows()
+        self.assertEqual([row["id"] for row in rows], [1, 2, 3, 4, 5])
+        self.assertEqual(rows[4]["title"], "Test Book 4")
+
+    def test_upsertBooks_updates_existing_ids(self):
+        self.bookshelves.upsertBooks(Book(metadata) for metadata in self.books_metadata)
+
+        updated_metadata = dict(self.books_metadata[1], id="2", comments="re-read")
+        new_metadata = dict(self.books_metadata[0], title="New Book")
+        row_count = self.bookshelves.upsertBooks(
+            [Book(updated_metadata), Book(new_metadata)], batch_size=1
+        )
+
+        self.assertEqual(row_count, 2)
+        rows = self.get_rows()
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[1]["comments"], "re-read")
+        self.assertEqual(rows[1]["title"], "Test Book 1")
+        self.assertEqual(rows[5]["title"], "New Book")
+
+    def test_upsertBooks_rolls_back_failed_transaction(self):
+        def books():
+            yield Book(self.books_metadata[0])
+            raise ValueError("bad row")
+
+        with self.assertRaises(ValueError):
+            self.bookshelves.upsertBooks(books())
+
+        self.assertEqual(len(self.get_rows()), 0)
+
+
+class TestBookshelvesConnection(unittest.TestCase):
+    """Tests for the connections owned by the Bookshelves class."""
+
+    def setUp(self):
+        self.path_to_test_db = join("tests", "test-connection.db")
+
+    def tearDown(self):
+        remove(self.path_to_test_db)
+
+    def test_connection_is_reused(self):
+        with Bookshelves(self.path_to_test_db) as bookshelves:
+            connection, cursor = bookshelves.getConnection()
+            self.assertIs(bookshelves.getConnection()[0], connection)
+            self.assertIs(bookshelves.connection, connection)
+
+    def test_connection_per_thread(self):
+        with Bookshelves(self.path_to_test_db) as bookshelves:
+            thread_connections = []
+            thread = threading.Thread(
+                target=lambda: thread_connections.append(bookshelves.connection)
+            )
+            thread.start()
+            thread.join()
+
+            self.assertIsNot(thread_connections[0], bookshelves.connection)
+
+    def test_close(self):
+        bookshelves = Bookshelves(self.path_to_test_db)
+        connection = bookshelves.connection
+        bookshelves.close()
+
+        with self.assertRaises(sqlite3.ProgrammingError):
+            connection.execute("""SELECT id FROM bookshelves""")
+
+        # a closed bookshelves object reconnects on next use
+        self.assertFalse(bookshelves.checkIfIDExists("1"))
+        bookshelves.close()
+
+    def test_context_manager_closes_connection(self):
+        with Bookshelves(self.path_to_test_db) as bookshelves:
+            connection = bookshelves.connection
+
+        with self.assertRaises(sqlite3.ProgrammingError):
+            connection.execute("""SELECT id FROM bookshelves""")
+
+
+class TestBookshelvesMigrations(unittest.TestCase):
+    """Tests for migrating databases to the latest schema version"""
+
+    def setUp(self):
+        self.path_to_test_db = join("tests", "test-migrations.db")
+
+        # database in the original untyped schema
+        connection = sqlite3.connect(self.path_to_test_db)
+        connection.execute(
+            "CREATE TABLE bookshelves(id integer primary key autoincrement, title, primary_author_key, primary_author, secondary_authors_keys, secondary_authors,isbn_13, edition_publish_date, number_of_pages, publisher, open_lib_key, goodreads_identifier, librarything_identifier, date_added, date_finished, comments)"
+        )
+        connection.execute(
+            """INSERT INTO bookshelves (title, isbn_13, number_of_pages) VALUES ('Lolly Willowes', '9781844088058', '224')"""
+        )
+        connection.commit()
+        connection.close()
+
+    def tearDown(self):
+        remove(self.path_to_test_db)
+
+    def test_migrate_old_database(self):
+        with Bookshelves(self.path_to_test_db) as bookshelves:
+            self.assertEqual(bookshelves.getSchemaVersion(), len(MIGRATIONS))
+
+            connection, cursor = bookshelves.getConnection()
+            print("testing columns are typed and in the same order")
+            table_info = cursor.execute("pragma table_info('bookshelves')").fetchall()
+            self.assertEqual(
+                [column["name"] for column in table_info],
+                list(Book.setDefaultDict().keys()),
+            )
+            self.assertEqual(table_info[8]["type"], "INTEGER")
+
+            print("testing data is kept")
+            row = cursor.execute("""SELECT * FROM bookshelves""").fetchone()
+            self.assertEqual(row["title"], "Lolly Willowes")
+            self.assertEqual(row["number_of_pages"], 224)
+
+            print("testing read counts are filled from existing rows")
+            top_books = bookshelves.getTopBooks()
+            self.assertEqual(top_books[0][0].title, "Lolly Willowes")
+            self.assertEqual(top_books[0][1], 1)
+
+            print("testing existing rows can be searched")
+            self.assertEqual(bookshelves.search("lolly")[0].title, "Lolly Willowes")
+
+            print("testing new rows continue from existing ids")
+            bookshelves.addToDatabase(Book({"title": "Test"}))
+            ids = [row["id"] for row in cursor.execute("SELECT id FROM bookshelves")]
+            self.assertEqual(ids, [1, 2])
+
+    def test_migrate_keeps_deleted_ids(self):
+        connection = sqlite3.connect(self.path_to_test_db)
+        connection.execute("""INSERT INTO bookshelves (title) VALUES ('Deleted')""")
+        connection.execute("""DELETE FROM bookshelves WHERE title = 'Deleted'""")
+        connection.commit()
+        connection.close()
+
+        with Bookshelves(self.path_to_test_db) as bookshelves:
+            print("testing ids of rows deleted before migrating aren't reused")
+            bookshelves.addToDatabase(Book({"title": "Test"}))
+            connection, cursor = bookshelves.getConnection()
+            ids = [row["id"] for row in cursor.execute("SELECT id FROM bookshelves")]
+            self.assertEqual(ids, [1, 3])
+
+    def test_migrate_is_only_applied_once(self):
+        Bookshelves(self.path_to_test_db).close()
+
+        mocked_migrations = [mock.Mock() for _ in MIGRATIONS]
+        with mock.patch("bookshelves.MIGRATIONS", mocked_migrations):
+            Bookshelves(self.path_to_test_db).close()
+
+        for migration in mocked_migrations:
+            migration.assert_not_called()
+
+    def test_lookup_indexes_are_used(self):
+        with Bookshelves(self.path_to_test_db) as bookshelves:
+            connection, cursor = bookshelves.getConnection()
+
+            indexes = {
+                "isbn_13": "editions_isbn_13",
+                "title": "editions_title",
+                "date_finished": "reads_date_finished",
+            }
+            for column, index in indexes.items():
+                query_plan = cursor.execute(
+                    f"""EXPLAIN QUERY PLAN SELECT * FROM bookshelves WHERE {column} = ?""",
+                    ("",),
+                ).fetchall()
+                self.assertIn(f"INDEX {index}", query_plan[0]["detail"])
+
+            print("testing primary author lookups use the authors indexes")
+            query_plan = cursor.execute(
+                f"""EXPLAIN QUERY PLAN SELECT reads.id {PRIMARY_AUTHOR_READS}""",
+                ("",),
+            ).fetchall()
+            self.assertIn("INDEX authors_name", query_plan[0]["detail"])
+            self.assertIn("INDEX edition_authors_author_id", query_plan[1]["detail"])
+
+
+class TestBookshelvesNormalizedSchema(unittest.TestCase):
+    """Tests for the editions, authors and reads behind the bookshelves view"""
+
+    def setUp(self):
+        self.path_to_test_db = join("tests", "test-normalized.db")
+        self.path_to_export = join("tests", "test-normalized-export.csv")
+        self.book_metadata = {
+            "title": "Good Omens",
+            "primary_author_key": "/authors/OL1A",
+            "primary_author": "Terry Pratchett",
+            # open library lists of secondary authors start with ", "
+            "secondary_authors_keys": ", /authors/OL2A",
+            "secondary_authors": ", Neil Gaiman",
+            "isbn_13": "9780552137034",
+            "number_of_pages": "412",
+        }
+
+    def tearDown(self):
+        for path in (self.path_to_test_db, self.path_to_export):
+            if exists(path):
+                remove(path)
+
+    def count(self, cursor, table):
+        return cursor.execute(f"""SELECT count(*) FROM {table}""").fetchone()[0]
+
+    def test_rereads_share_edition(self):
+        with Bookshelves(self.path_to_test_db) as bookshelves:
+            bookshelves.upsertBooks(
+                Book(dict(self.book_metadata, date_finished=date))
+                for date in ["2021-01-01", "2022-01-01", "2023-01-01"]
+            )
+            connection, cursor = bookshelves.getConnection()
+
+            self.assertEqual(self.count(cursor, "reads"), 3)
+            self.assertEqual(self.count(cursor, "editions"), 1)
+            self.assertEqual(self.count(cursor, "authors"), 2)
+
+            print("testing authors are found without scanning the shelf")
+            query_plan = cursor.execute(
+                """EXPLAIN QUERY PLAN SELECT id FROM authors WHERE name = ?""",
+                ("Neil Gaiman",),
+            ).fetchall()
+            self.assertIn("INDEX authors_name", query_plan[0]["detail"])
+
+            top_books = bookshelves.getTopBooks(10, None, "Terry Pratchett")
+            self.assertEqual(top_books[0][0].secondary_authors, ", Neil Gaiman")
+            self.assertEqual(top_books[0][1], 3)
+
+    def test_rows_are_unchanged(self):
+        rows = [
+            self.book_metadata,
+            {"title": "No authors"},
+            {"title": "Blank authors", "primary_author": "", "secondary_authors": ""},
+            {
+                "title": "Awkward names",
+                "primary_author": None,
+                "primary_author_key": "/authors/OL3A",
+                "secondary_authors_keys": "/authors/OL4A",
+                "secondary_authors": 'A "quoted", back\\slash, new\nline, ',
+                "number_of_pages": "unknown",
+            },
+        ]
+        columns = list(Book.setDefaultDict().keys())
+
+        with Bookshelves(self.path_to_test_db) as bookshelves:
+            connection, cursor = bookshelves.getConnection()
+            for row in rows:
+                cursor.execute(
+                    f"""INSERT INTO bookshelves ({", ".join(row)}) VALUES ({", ".join("?" * len(row))})""",
+                    list(row.values()),
+                )
+            connection.commit()
+
+            for row, db_row in zip(
+                rows, cursor.execute("""SELECT * FROM bookshelves ORDER BY id""")
+            ):
+                expected = dict.fromkeys(columns[1:], None)
+                expected.update(row)
+                if expected["number_of_pages"] == "412":
+                    expected["number_of_pages"] = 412
+                self.assertEqual(
+                    {column: db_row[column] for column in columns[1:]}, expected
+                )
+
+    def test_names_with_commas_are_not_paired(self):
+        book_metadata = dict(
+            self.book_metadata,
+            title="Why We Can't Wait",
+            secondary_authors_keys="/authors/OL5A, /authors/OL6A",
+            secondary_authors="Martin Luther King, Jr., Coretta Scott King",
+        )
+
+        with Bookshelves(self.path_to_test_db) as bookshelves:
+            bookshelves.upsertBooks([Book(book_metadata)])
+            connection, cursor = bookshelves.getConnection()
+
+            print("testing lists of different lengths don't make authors")
+            names = [row["name"] for row in cursor.execute("SELECT name FROM authors")]
+            self.assertEqual(names, ["Terry Pratchett"])
+            self.assertEqual(self.count(cursor, "edition_authors"), 1)
+
+            print("testing they are kept unsplit on the edition")
+            row = cursor.execute("""SELECT * FROM bookshelves""").fetchone()
+            self.assertEqual(
+                row["secondary_authors_keys"], "/authors/OL5A, /authors/OL6A"
+            )
+            self.assertEqual(
+                row["secondary_authors"], "Martin Luther King, Jr., Coretta Scott King"
+            )
+
+            print("testing rereads still share the edition")
+            bookshelves.upsertBooks([Book(book_metadata)])
+            self.assertEqual(self.count(cursor, "editions"), 1)
+
+    def test_unused_authors_are_removed(self):
+        with Bookshelves(self.path_to_test_db) as bookshelves:
+            bookshelves.upsertBooks(
+                [
+                    Book(self.book_metadata),
+                    Book({"title": "Mort", "primary_author": "Terry Pratchett"}),
+                ]
+            )
+            connection, cursor = bookshelves.getConnection()
+
+            def author_names():
+                return sorted(
+                    row["name"] for row in cursor.execute("SELECT name FROM authors")
+                )
+
+            print("testing authors are kept while another edition has them")
+            cursor.execute("""DELETE FROM bookshelves WHERE id = 1""")
+            connection.commit()
+            self.assertEqual(author_names(), ["Terry Pratchett"])
+
+            print("testing authors are removed when their editions are")
+            bookshelves.updateValues(
+                Book({"id": "2", "title": "Mort", "primary_author": "T. Pratchett"})
+            )
+            self.assertEqual(author_names(), ["T. Pratchett"])
+            cursor.execute("""DELETE FROM bookshelves WHERE id = 2""")
+            connection.commit()
+            self.assertEqual(author_names(), [])
+
+            print("testing authors are unique by key and name")
+            cursor.execute(
+                """INSERT INTO authors (author_key, name) VALUES ('/authors/OL1A', 'A')"""
+            )
+            with self.assertRaises(sqlite3.IntegrityError):
+                cursor.execute(
+                    """INSERT INTO authors (author_key, name) VALUES ('/authors/OL1A', 'A')"""
+                )
+            connection.rollback()
+
+    def test_changing_one_read_keeps_the_others(self):
+        with Bookshelves(self.path_to_test_db) as bookshelves:
+            bookshelves.upsertBooks(
+                [Book(self.book_metadata), Book(self.book_metadata)]
+            )
+            connection, cursor = bookshelves.getConnection()
+
+            print("testing a changed read gets its own edition")
+            bookshelves.updateValues(
+                Book(dict(self.book_metadata, id="2", title="Good Omens (TV)"))
+            )
+            titles = cursor.execute(
+                """SELECT title FROM bookshelves ORDER BY id"""
+            ).fetchall()
+            self.assertEqual(
+                [row["title"] for row in titles], ["Good Omens", "Good Omens (TV)"]
+            )
+            self.assertEqual(self.count(cursor, "editions"), 2)
+            self.assertEqual(bookshelves.search("tv")[0].id, 2)
+
+            print("testing editions no longer read are removed")
+            cursor.execute("""DELETE FROM bookshelves WHERE id = 1""")
+            connection.commit()
+            self.assertEqual(self.count(cursor, "editions"), 1)
+            # primary author, the blank first entry and the secondary author
+            self.assertEqual(self.count(cursor, "edition_authors"), 3)
+            self.assertEqual(bookshelves.search("omens")[0].id, 2)
+
+            print("testing upserting an unchanged row keeps it")
+            read = cursor.execute("""SELECT * FROM bookshelves""").fetchone()
+            bookshelves.upsertBooks([Book(dict(read))])
+            self.assertEqual(self.count(cursor, "reads"), 1)
+            self.assertEqual(bookshelves.getTopBooks()[0][1], 1)
+
+    def test_migrate_keeps_export(self):
+        # database at the schema version before normalizing
+        with mock.patch("bookshelves.MIGRATIONS", MIGRATIONS[:-1]):
+            with Bookshelves(self.path_to_test_db) as bookshelves:
+                bookshelves.upsertBooks(
+                    Book(dict(self.book_metadata, date_finished=date))
+                    for date in ["2021-01-01", "2022-01-01"]
+                )
+                bookshelves.upsertBooks([Book({"title": "Lolly Willowes"})])
+                bookshelves.exportToCSV(self.path_to_export)
+                stats = bookshelves.getStats()
+
+        with open(self.path_to_export, "rb") as export:
+            unnormalized_export = export.read()
+
+        with Bookshelves(self.path_to_test_db) as bookshelves:
+            self.assertEqual(bookshelves.getSchemaVersion(), len(MIGRATIONS))
+            bookshelves.exportToCSV(self.path_to_export)
+            self.assertEqual(bookshelves.getStats(), stats)
+            self.assertEqual(bookshelves.search("lolly")[0].id, 3)
+
+            connection, cursor = bookshelves.getConnection()
+            self.assertEqual(self.count(cursor, "editions"), 2)
+
+        with open(self.path_to_export, "rb") as export:
+            self.assertEqual(export.read(), unnormalized_export)
+
+
+class TestBookshelvesTopBooks(unittest.TestCase):
+    """Tests for top books and the read count tables behind them"""
+
+    def setUp(self):
+        self.path_to_test_db = join("tests", "test-top-books.db")
+        self.bookshelves = Bookshelves(self.path_to_test_db)
+
+        reads = [
+            ("Lolly Willowes", "Sylvia Townsend Warner", "2022-01-01"),
+            ("Lolly Willowes", "Sylvia Townsend Warner", "2023-01-01"),
+            ("Lolly Willowes", "Sylvia Townsend Warner", "2023-06-01"),
+            ("Summer Will Show", "Sylvia Townsend Warner", "2023-03-01"),
+            ("Piranesi", "Susanna Clarke", "2022-02-01"),
+            ("Piranesi", "Susanna Clarke", "2022-05-01"),
+        ]
+        self.bookshelves.upsertBooks(
+            Book({"title": title, "primary_author": author, "date_finished": date})
+            for title, author, date in reads
+        )
+
+    def tearDown(self):
+        self.bookshelves.close()
+        remove(self.path_to_test_db)
+
+    def top_titles(self, *args):
+        return [
+            (book.title, count) for book, count in self.bookshelves.getTopBooks(*args)
+        ]
+
+    def test_getTopBooks(self):
+        self.assertEqual(
+            self.top_titles(),
+            [("Lolly Willowes", 3), ("Piranesi", 2), ("Summer Will Show", 1)],
+        )
+        self.assertEqual(self.top_titles(1), [("Lolly Willowes", 3)])
+
+    def test_getTopBooks_by_year(self):
+        self.assertEqual(
+            self.top_titles(10, "2023"),
+            [("Lolly Willowes", 2), ("Summer Will Show", 1)],
+        )
+
+    def test_getTopBooks_by_author(self):
+        self.assertEqual(self.top_titles(10, None, "Susanna Clarke"), [("Piranesi", 2)])
+        self.assertEqual(
+            self.top_titles(10, "2022", "Sylvia Townsend Warner"),
+            [("Lolly Willowes", 1)],
+        )
+
+    def test_read_counts_follow_updates_and_deletes(self):
+        connection, cursor = self.bookshelves.getConnection()
+
+        print("testing updating title moves the read")
+        piranesi = Book(
+            {"id": "5", "title": "Jonathan Strange", "date_finished": "2022-02-01"}
+        )
+        self.bookshelves.updateValues(piranesi)
+        self.assertIn(("Jonathan Strange", 1), self.top_titles())
+        self.assertIn(("Piranesi", 1), self.top_titles())
+
+        print("testing deleting the last read removes the title")
+        cursor.execute("""DELETE FROM bookshelves WHERE title = 'Piranesi'""")
+        connection.commit()
+        self.assertNotIn("Piranesi", [title for title, count in self.top_titles()])
+
+        print("testing counts match a full recount")
+        recount = cursor.execute(
+            """SELECT title, count(*) FROM bookshelves GROUP BY title"""
+        ).fetchall()
+        read_counts = cursor.execute(
+            """SELECT title, read_count FROM read_counts"""
+        ).fetchall()
+        self.assertEqual(sorted(map(tuple, recount)), sorted(map(tuple, read_counts)))
+
+    def test_printTopBooks(self):
+        with mock.patch("builtins.print") as mocked_print:
+            self.bookshelves.printTopBooks(2, "2022")
+
+        printed = [call.args[0] for call in mocked_print.call_args_list]
+        self.assertEqual(printed[0], "\nTOP 2 IN 2022")
+        self.assertIn("Piranesi by Susanna Clarke", printed[2])
+
+
+class TestBookshelvesSearch(unittest.TestCase):
+    """Tests for full text search of the database"""
+
+    def setUp(self):
+        self.path_to_test_db = join("tests", "test-search.db")
+        self.bookshelves = Bookshelves(self.path_to_test_db)
+        books = [
+            {
+                "title": "Jonathan Strange and Mr. Norrell",
+                "primary_author": "Susanna Clarke",
+                "publisher": "Bloomsbury Publishing PLC",
+            },
+            {
+                "title": "Piranesi",
+                "primary_author": "Susanna Clarke",
+                "comments": "Strange and lovely",
+            },
+            {
+                "title": "Lolly Willowes",
+                "primary_author": "Sylvia Townsend Warner",
+                "secondary_authors": ", Alison Light",
+            },
+        ]
+        self.bookshelves.upsertBooks(Book(book) for book in books)
+
+    def tearDown(self):
+        self.bookshelves.close()
+        remove(self.path_to_test_db)
+
+    def search_titles(self, query):
+        return [book.title for book in self.bookshelves.search(query)]
+
+    def test_search(self):
+        self.assertEqual(self.search_titles("piranesi"), ["Piranesi"])
+        self.assertEqual(self.search_titles("alison light"), ["Lolly Willowes"])
+        self.assertEqual(
+            self.search_titles("bloomsbury clarke"),
+            ["Jonathan Strange and Mr. Norrell"],
+        )
+        self.assertEqual(self.search_titles("tolkien"), [])
+        self.assertEqual(self.search_titles("  "), [])
+
+    def test_search_prefix(self):
+        self.assertEqual(
+            sorted(self.search_titles("susa cla")),
+            ["Jonathan Strange and Mr. Norrell", "Piranesi"],
+        )
+
+    def test_search_ranks_titles_above_comments(self):
+        self.assertEqual(
+            self.search_titles("strange"),
+            ["Jonathan Strange and Mr. Norrell", "Piranesi"],
+        )
+
+    def test_search_syntax_is_matched_as_text(self):
+        self.assertEqual(
+            self.search_titles('mr. "norrell'), ["Jonathan Strange and Mr. Norrell"]
+        )
+        self.assertEqual(self.search_titles("NOT OR"), [])
+
+    def test_search_follows_updates_and_deletes(self):
+        connection, cursor = self.bookshelves.getConnection()
+
+        self.bookshelves.updateValues(Book({"id": "2", "title": "The Ladies of Grace"}))
+        self.assertEqual(self.search_titles("grace"), ["The Ladies of Grace"])
+        self.assertEqual(self.search_titles("piranesi"), [])
+
+        cursor.execute("""DELETE FROM bookshelves WHERE id = 2""")
+        connection.commit()
+        self.assertEqual(self.search_titles("grace"), [])
+
+
+class TestBookshelvesStats(unittest.TestCase):
+    """Tests for reading stats and the stats tables behind them"""
+
+    def setUp(self):
+        self.path_to_test_db = join("tests", "test-stats.db")
+        self.bookshelves = Bookshelves(self.path_to_test_db)
+
+        reads = [
+            ("Lolly Willowes", "Sylvia Townsend Warner", "Chatto", 224, "2022-01-03"),
+            ("Lolly Willowes", "Sylvia Townsend Warner", "Virago", 256, "2023-01-20"),
+            ("Summer Will Show", "Sylvia Townsend Warner", "Virago", "", "2023-03-01"),
+            ("Piranesi", "Susanna Clarke", "Bloomsbury", 272, "2023-03-15"),
+        ]
+        self.bookshelves.upsertBooks(
+            Book(
+                {
+                    "title": title,
+                    "primary_author": author,
+                    "publisher": publisher,
+                    "number_of_pages": pages,
+                    "date_finished": date,
+                }
+            )
+            for title, author, publisher, pages, date in reads
+        )
+
+    def tearDown(self):
+        self.bookshelves.close()
+        remove(self.path_to_test_db)
+
+    def test_getStats(self):
+        stats = self.bookshelves.getStats()
+
+        self.assertEqual(stats["books"], 4)
+        self.assertEqual(stats["pages"], 752)
+        print("testing books without page counts are left out of average")
+        self.assertAlmostEqual(stats["average_pages"], 752 / 3)
+        self.assertEqual(stats["years"], [("2022", 1, 224), ("2023", 3, 528)])
+        self.assertEqual(
+            stats["months"],
+            [("2022", "01", 1, 224), ("2023", "01", 1, 256), ("2023", "03", 2, 272)],
+        )
+        self.assertEqual(
+            stats["top_authors"],
+            [("Sylvia Townsend Warner", 3, 480), ("Susanna Clarke", 1, 272)],
+        )
+        self.assertEqual(stats["top_publishers"][0], ("Virago", 2, 256))
+
+    def test_getStats_for_year(self):
+        stats = self.bookshelves.getStats("2022")
+        self.assertEqual(stats["months"], [("2022", "01", 1, 224)])
+
+    def test_getStats_empty_database(self):
+        connection, cursor = self.bookshelves.getConnection()
+        cursor.execute("""DELETE FROM bookshelves""")
+        connection.commit()
+
+        stats = self.bookshelves.getStats()
+        self.assertEqual((stats["books"], stats["pages"]), (0, 0))
+        self.assertEqual(stats["average_pages"], 0)
+        self.assertEqual(stats["top_authors"], [])
+
+    def test_stats_follow_updates(self):
+        self.bookshelves.updateValues(
+            Book(
+                {
+                    "id": "4",
+                    "title": "Piranesi",
+                    "primary_author": "Susanna Clarke",
+                    "publisher": "Bloomsbury",
+                    "number_of_pages": 300,
+                    "date_finished": "2023-04-01",
+                }
+            )
+        )
+
+        stats = self.bookshelves.getStats("2023")
+        self.assertEqual(stats["pages"], 780)
+        self.assertEqual(
+            stats["months"],
+            [("2023", "01", 1, 256), ("2023", "03", 1, 0), ("2023", "04", 1, 300)],
+        )
+
+    def test_rebuildStats(self):
+        connection, cursor = self.bookshelves.getConnection()
+        expected_stats = self.bookshelves.getStats()
+        expected_top_books = [
+            (book.id, count) for book, count in self.bookshelves.getTopBooks()
+        ]
+
+        cursor.execute("""UPDATE monthly_stats SET books = 100""")
+        cursor.execute("""UPDATE author_stats SET pages = 100""")
+        cursor.execute("""UPDATE read_counts SET read_count = 100""")
+        cursor.execute("""DELETE FROM publisher_stats""")
+        cursor.execute("""DELETE FROM year_read_counts""")
+        connection.commit()
+
+        self.bookshelves.rebuildStats()
+
+        self.assertEqual(self.bookshelves.getStats(), expected_stats)
+        self.assertEqual(
+            [(book.id, count) for book, count in self.bookshelves.getTopBooks()],
+            expected_top_books,
+        )
+        self.assertEqual(len(self.bookshelves.getTopBooks(10, "2023")), 3)
+
+
+class TestBookshelvesStreamingExport(unittest.TestCase):
+    """Tests for exporting to compressed files and stdout"""
+
+    def setUp(self):
+        self.path_to_test_db = join("tests", "test-export-stream.db")
+        self.path_to_csv = join("tests", "test-export-stream.csv.gz")
+        self.bookshelves = Bookshelves(self.path_to_test_db)
+        self.bookshelves.upsertBooks(
+            Book({"title": f"Test Book {num}"}) for num in range(2500)
+        )
+
+    def tearDown(self):
+        self.bookshelves.close()
+        remove(self.path_to_test_db)
+        if exists(self.path_to_csv):
+            remove(self.path_to_csv)
+
+    def test_exportToCSV_gzip(self):
+        row_count = self.bookshelves.exportToCSV(self.path_to_csv)
+        self.assertEqual(row_count, 2500)
+
+        with gzip.open(self.path_to_csv, "rt", encoding="utf-8", newline="") as file:
+            rows = list(csv.DictReader(file))
+
+        self.assertEqual(len(rows), 2500)
+        self.assertEqual(rows[2499]["title"], "Test Book 2499")
+
+    def test_exportToCSV_stdout(self):
+        stdout = io.TextIOWrapper(io.BytesIO(), encoding="utf-8")
+
+        with mock.patch("sys.stdout", stdout):
+            self.bookshelves.exportToCSV("-")
+
+        output = stdout.buffer.getvalue().decode("utf-8")
+        rows = list(csv.DictReader(io.StringIO(output, newline="")))
+        self.assertEqual(len(rows), 2500)
+        self.assertEqual(rows[0]["id"], "1")
+
+
+class TestBookshelvesStreamingImport(unittest.TestCase):
+    """Tests for importing csv rows matching the database schema"""
+
+    def setUp(self):
+        self.path_to_test_db = join("tests", "test-streaming-import.db")
+        self.bookshelves = Bookshelves(self.path_to_test_db)
+        self.db_headers = list(Book.setDefaultDict().keys())
+
+    def tearDown(self):
+        self.bookshelves.close()
+        remove(self.path_to_test_db)
+
+    def test_importBooks(self):
+        csv_file = io.StringIO()
+        writer = csv.writer(csv_file)
+        writer.writerow(self.db_headers)
+        for num in range(2500):
+            writer.writerow(["", f"Test Book {num}"] + [""] * 14)
+        writer.writerow(["", "Extra Value"] + [""] * 15)
+        writer.writerow(["", "Missing Value"])
+        writer.writerow(["one", "Invalid Id"] + [""] * 14)
+        csv_file.seek(0)
+
+        success_count, fail_count = self.bookshelves.importBooks(
+            csv.DictReader(csv_file), batch_size=1000
+        )
+
+        self.assertEqual(success_count, 2500)
+        self.assertEqual(fail_count, 3)
+        connection, cursor = self.bookshelves.getConnection()
+        failures = cursor.execute(
+            """SELECT error_class, error_message, transient FROM failed_imports"""
+        ).fetchall()
+        self.assertEqual(
+            {failure["error_class"] for failure in failures}, {"invalid_row"}
+        )
+        self.assertFalse(any(failure["transient"] for failure in failures))
+        self.assertEqual(
+            [failure["error_message"] for failure in failures],
+            [
+                "Row has more values than headings",
+                "Row has fewer values than headings",
+                "Invalid id",
+            ],
+        )
+
+        connection, cursor = self.bookshelves.getConnection()
+        count = cursor.execute("""SELECT count(*) FROM bookshelves""").fetchone()[0]
+        self.assertEqual(count, 2500)
+
+    def test_importBooks_reads_while_writing(self):
+        rows_read = 0
+        rows_read_when_writing = []
+
+        def rows():
+            nonlocal rows_read
+            for num in range(20000):
+                rows_read += 1
+                yield dict(Book.setDefaultDict(), title=f"Test Book {num}")
+
+        def slow_upsert(books, batch_size=0, before_commit=None):
+            count = 0
+            for book in books:
+                if count == 0:
+                    # give the reader time to fill the queue
+                    time.sleep(0.2)
+                    rows_read_when_writing.append(rows_read)
+                count += 1
+            return count
+
+        with mock.patch.object(self.bookshelves, "upsertBooks", slow_upsert):
+            success_count, fail_count = self.bookshelves.importBooks(rows())
+
+        self.assertEqual(success_count, 20000)
+        print("testing reading waits for the writer to catch up")
+        self.assertLessEqual(
+            rows_read_when_writing[0], (IMPORT_QUEUE_CHUNKS + 3) * IMPORT_CHUNK_SIZE
+        )
+
+
+class TestBookshelvesOpenLibImport(unittest.TestCase):
+    """Tests for importing isbns with concurrent open library lookups.
+    The open library search is mocked so these tests run offline."""
+
+    def setUp(self):
+        self.path_to_test_db = join("tests", "test-openlib-import.db")
+        self.bookshelves = Bookshelves(self.path_to_test_db)
+
+    def tearDown(self):
+        self.bookshelves.close()
+        remove(self.path_to_test_db)
+
+    @staticmethod
+    def fake_batch_search(isbns):
+        if "9780000000002" in isbns:
+            raise ConnectionError("connection dropped")
+
+        books_metadata = {}
+        for isbn in isbns:
+            if isbn == "9780000000003":
+                books_metadata[isbn] = None
+            else:
+                books_metadata[isbn] = {"title": f"Title {isbn}", "isbn_13": isbn}
+        return books_metadata
+
+    @mock.patch("bookshelves.Book.openLibBatchSearch")
+    def test_importFromOpenLib(self, mocked_search):
+        mocked_search.side_effect = self.fake_batch_search
+        rows = [
+            {"isbn_13": f"97810000000{num:02}", "comments": f"comment {num}"}
+            for num in range(20)
+        ]
+        rows += [
+            {"isbn_13": "9780000000002", "comments": ""},
+            {"isbn_13": "9780000000003", "comments": ""},
+            {"isbn_13": "not an isbn", "comments": ""},
+        ]
+
+        success_count, fail_count = self.bookshelves.importFromOpenLib(
+            rows, workers=4, lookup_batch_size=1
+        )
+
+        self.assertEqual(success_count, 20)
+        self.assertEqual(fail_count, 3)
+        connection, cursor = self.bookshelves.getConnection()
+        failures = cursor.execute(
+            """SELECT isbn_13, error_class, transient FROM failed_imports"""
+        )
+        self.assertEqual(
+            {tuple(failure) for failure in failures},
+            {
+                ("9780000000002", "network", 1),
+                ("9780000000003", "not_found", 0),
+                ("not an isbn", "invalid_isbn", 0),
+            },
+        )
+
+        connection, cursor = self.bookshelves.getConnection()
+        query = cursor.execute("""SELECT isbn_13, comments FROM bookshelves""")
+        result = {row["isbn_13"]: row["comments"] for row in query.fetchall()}
+        self.assertEqual(len(result), 20)
+        self.assertEqual(result["9781000000007"], "comment 7")
+
+    @mock.patch("bookshelves.Book.openLibBatchSearch")
+    def test_importFromOpenLib_batches(self, mocked_search):
+        mocked_search.side_effect = self.fake_batch_search
+        rows = [{"isbn_13": f"97810000000{num:02}"} for num in range(45)]
+
+        success_count, fail_count = self.bookshelves.importFromOpenLib(
+            rows, lookup_batch_size=20
+        )
+
+        self.assertEqual((success_count, fail_count), (45, 0))
+        batch_sizes = sorted(len(call.args[0]) for call in mocked_search.call_args_list)
+        self.assertEqual(batch_sizes, [5, 20, 20])
+
+        print("testing batch sizes below 1 are rejected before importing")
+        for lookup_batch_size in [0, -1]:
+            with self.assertRaises(ValueError):
+                self.bookshelves.importFromOpenLib(
+                    rows, lookup_batch_size=lookup_batch_size
+                )
+        self.assertEqual(mocked_search.call_count, 3)
+
+
+class TestBookshelvesFailedImports(unittest.TestCase):
+    """Tests for recording and retrying failed imports.
+    The open library search is mocked so these tests run offline."""
+
+    def setUp(self):
+        self.path_to_test_db = join("tests", "test-failed-imports.db")
+        self.bookshelves = Bookshelves(self.path_to_test_db)
+        self.rows = [
+            {"isbn_13": "9781000000001", "comments": "read twice"},
+            {"isbn_13": "9780000000002", "comments": ""},
+            {"isbn_13": "9780000000003", "comments": ""},
+        ]
+
+    def tearDown(self):
+        self.bookshelves.close()
+        remove(self.path_to_test_db)
+
+    @staticmethod
+    def search(isbns, failing=("9781000000001", "9780000000002")):
+        if any(isbn in failing for isbn in isbns):
+            raise ConnectionError("connection dropped")
+        return {isbn: None for isbn in isbns}
+
+    def failures(self):
+        connection, cursor = self.bookshelves.getConnection()
+        return cursor.execute(
+            """SELECT run_id, isbn_13, error_class FROM failed_imports ORDER BY isbn_13"""
+        ).fetchall()
+
+    @mock.patch("bookshelves.Bookshelves.exportFailedImports")
+    @mock.patch("bookshelves.Book.openLibBatchSearch")
+    def test_retryFailedImports(self, mocked_search, _):
+        mocked_search.side_effect = self.search
+        self.bookshelves.importFromOpenLib(self.rows, lookup_batch_size=1)
+        first_run = self.failures()[0]["run_id"]
+
+        print("testing failures that happen again are recorded for the new run")
+        mocked_search.side_effect = lambda isbns: self.search(isbns, ["9780000000002"])
+        result = self.bookshelves.retryFailedImports(lookup_batch_size=1)
+
+        self.assertEqual(result, (0, 2))
+        failures = self.failures()
+        self.assertEqual(
+            [(failure["isbn_13"], failure["error_class"]) for failure in failures],
+            [
+                ("9780000000002", "network"),
+                ("9780000000003", "not_found"),
+                ("9781000000001", "not_found"),
+            ],
+        )
+        self.assertNotEqual(failures[0]["run_id"], first_run)
+
+        print("testing only transient failures are retried")
+        mocked_search.side_effect = None
+        mocked_search.return_value = {
+            "9780000000002": {"title": "Retried", "isbn_13": "9780000000002"}
+        }
+        self.assertEqual(self.bookshelves.retryFailedImports(), (1, 0))
+        mocked_search.assert_called_with(["9780000000002"])
+        self.assertEqual(len(self.failures()), 2)
+        self.assertEqual(self.bookshelves.retryFailedImports(), (0, 0))
+
+    @mock.patch("bookshelves.Book.openLibBatchSearch")
+    def test_exportFailedImports(self, mocked_search):
+        mocked_search.side_effect = self.search
+        failed_imports = FailedImports("test-run")
+        self.bookshelves.importFromOpenLib(
+            self.rows, lookup_batch_size=1, failed_imports=failed_imports
+        )
+
+        path_to_csv = self.bookshelves.exportFailedImports("test-run")
+        self.assertEqual(path_to_csv, join("tests", "failed-imports-test-run.csv"))
+
+        with open(path_to_csv, "r", encoding="utf-8", newline="") as csv_file:
+            rows = list(csv.DictReader(csv_file))
+        remove(path_to_csv)
+
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(
+            list(rows[0]), ["isbn_13", "comments", "error_class", "error_message"]
+        )
+        self.assertIn(
+            {
+                "isbn_13": "9781000000001",
+                "comments": "read twice",
+                "error_class": "network",
+                "error_message": "connection dropped",
+            },
+            rows,
+        )
+
+    def test_classify_error(self):
+        def http_error(status_code):
+            response = requests.Response()
+            response.status_code = status_code
+            return requests.HTTPError(response=response)
+
+        self.assertEqual(classify_error(http_error(429)), "rate_limited")
+        self.assertEqual(classify_error(http_error(503)), "server_error")
+        self.assertEqual(classify_error(http_error(404)), "http_error")
+        self.assertEqual(classify_error(requests.Timeout()), "network")
+        self.assertEqual(classify_error(ConnectionError()), "network")
+        self.assertEqual(classify_error(KeyError("title")), "error")
+
+
+class TestBookshelvesResumableImport(unittest.TestCase):
+    """Tests for resuming interrupted csv imports from a checkpoint.
+    The open library search is mocked so these tests run offline."""
+
+    def setUp(self):
+        self.path_to_test_db = join("tests", "test-resume.db")
+        self.path_to_test_csv = join("tests", "test-resume.csv")
+        self.bookshelves = Bookshelves(self.path_to_test_db)
+
+        self.isbns = [f"97810000000{num:02}" for num in range(100)]
+        self.isbns[4] = "not an isbn"
+        with open(self.path_to_test_csv, "w", encoding="utf-8", newline="") as output:
+            writer = csv.writer(output)
+            writer.writerow(["isbn_13"])
+            writer.writerows([isbn] for isbn in self.isbns)
+
+    def tearDown(self):
+        self.bookshelves.close()
+        remove(self.path_to_test_db)
+        remove(self.path_to_test_csv)
+
+    def test_checkpoint(self):
+        checkpoint = ImportCheckpoint("hash", rows_done=2, done_after=[4])
+        rows = [{"isbn_13": str(num)} for num in range(1, 7)]
+        self.assertEqual(
+            [row_number for row_number, row in checkpoint.remaining(rows)], [3, 5, 6]
+        )
+
+        print("testing rows finished out of order")
+        checkpoint.markDone(5)
+        self.assertEqual((checkpoint.rows_done, checkpoint.done_after), (2, {4, 5}))
+        checkpoint.markDone(3)
+        self.assertEqual((checkpoint.rows_done, checkpoint.done_after), (5, set()))
+
+    def written_isbns(self):
+        connection, cursor = self.bookshelves.getConnection()
+        return [
+            row["isbn_13"] for row in cursor.execute("SELECT isbn_13 FROM bookshelves")
+        ]
+
+    @staticmethod
+    def search(isbns):
+        return {isbn: {"title": f"Title {isbn}", "isbn_13": isbn} for isbn in isbns}
+
+    @mock.patch("bookshelves.input", create=True, return_value="y")
+    @mock.patch("bookshelves.Bookshelves.exportFailedImports")
+    @mock.patch("bookshelves.Book.openLibBatchSearch")
+    def test_importFromCSV_resume(self, mocked_search, mocked_export_failed, _):
+        searches = 0
+
+        def interrupted_search(isbns):
+            nonlocal searches
+            searches += 1
+            if searches == 4:
+                raise KeyboardInterrupt
+            return self.search(isbns)
+
+        mocked_search.side_effect = interrupted_search
+        import_args = (self.path_to_test_csv, 10, 1, 10)
+
+        with self.assertRaises(KeyboardInterrupt):
+            self.bookshelves.importFromCSV(*import_args)
+
+        written_before_resume = self.written_isbns()
+        self.assertGreater(len(written_before_resume), 0)
+        self.assertLess(len(written_before_resume), 99)
+
+        mocked_search.side_effect = self.search
+        mocked_search.reset_mock()
+        self.bookshelves.importFromCSV(*import_args, resume=True)
+
+        print("testing only unfinished rows are imported again")
+        written = self.written_isbns()
+        self.assertEqual(sorted(written), sorted(self.isbns[:4] + self.isbns[5:]))
+        searched = [
+            isbn for call in mocked_search.call_args_list for isbn in call.args[0]
+        ]
+        self.assertEqual(set(searched) & set(written_before_resume), set())
+        connection, cursor = self.bookshelves.getConnection()
+        failures = cursor.execute("""SELECT count(*) FROM failed_imports""")
+        self.assertEqual(failures.fetchone()[0], 1)
+
+        print("testing finished imports are skipped")
+        mocked_search.reset_mock()
+        self.bookshelves.importFromCSV(*import_args, resume=True)
+        mocked_search.assert_not_called()
+        self.assertEqual(len(self.written_isbns()), 99)
+
+    @mock.patch("bookshelves.RESUMABLE_BATCH_SIZE", 10)
+    @mock.patch("bookshelves.input", create=True, return_value="y")
+    def test_importFromCSV_resume_schema_csv(self, _):
+        with open(self.path_to_test_csv, "w", encoding="utf-8", newline="") as output:
+            writer = csv.DictWriter(output, list(Book.setDefaultDict().keys()))
+            writer.writeheader()
+            writer.writerows(
+                dict(Book.setDefaultDict(), id="", title=f"Title {num}")
+                for num in range(45)
+            )
+
+        save = ImportCheckpoint.save
+        saves = 0
+
+        def interrupted_save(checkpoint, cursor):
+            nonlocal saves
+            saves += 1
+            if saves == 3:
+                raise KeyboardInterrupt
+            save(checkpoint, cursor)
+
+        with mock.patch.object(
+            ImportCheckpoint, "save", autospec=True, side_effect=interrupted_save
+        ):
+            with self.assertRaises(KeyboardInterrupt):
+                self.bookshelves.importFromCSV(self.path_to_test_csv)
+
+        print("testing schema csv imports commit every batch by default")
+        connection, cursor = self.bookshelves.getConnection()
+        count = cursor.execute("""SELECT count(*) FROM bookshelves""").fetchone()[0]
+        self.assertEqual(count, 20)
+
+        print("testing they resume from the last commit")
+        self.bookshelves.importFromCSV(self.path_to_test_csv, resume=True)
+        titles = [
+            row["title"] for row in cursor.execute("SELECT title FROM bookshelves")
+        ]
+        self.assertEqual(sorted(titles), sorted(f"Title {num}" for num in range(45)))
+
+
+class TestBookshelvesConcurrentWriters(unittest.TestCase):
+    """Tests for several connections, like those of separate processes,
+    reading and writing the same database"""
+
+    def setUp(self):
+        self.path_to_test_db = join("tests", "test-concurrent.db")
+        self.bookshelves = Bookshelves(self.path_to_test_db)
+        self.book = Book({"title": "Test Book", "isbn_13": "9780747579885"})
+        # another process holding the write lock
+        self.other_writer = Bookshelves(self.path_to_test_db)
+
+    def tearDown(self):
+        self.other_writer.close()
+        self.bookshelves.close()
+        remove(self.path_to_test_db)
+
+    def count_books(self, bookshelves: Bookshelves) -> int:
+        connection, cursor = bookshelves.getConnection()
+        return cursor.execute("""SELECT count(*) FROM bookshelves""").fetchone()[0]
+
+    def hold_write_lock(self, seconds: float) -> threading.Thread:
+        """Add a book in a write transaction kept open for seconds"""
+        locked = threading.Event()
+
+        def write():
+            with self.other_writer.writeTransaction() as cursor:
+                cursor.execute("""INSERT INTO bookshelves (title) VALUES ('Other')""")
+                locked.set()
+                time.sleep(seconds)
+            self.other_writer.close()
+
+        thread = threading.Thread(target=write)
+        thread.start()
+        locked.wait()
+        return thread
+
+    def test_connection_settings(self):
+        connection, cursor = self.bookshelves.getConnection()
+        self.assertEqual(cursor.execute("""PRAGMA journal_mode""").fetchone()[0], "wal")
+        # NORMAL is level 1
+        self.assertEqual(cursor.execute("""PRAGMA synchronous""").fetchone()[0], 1)
+
+        bookshelves = Bookshelves(self.path_to_test_db, synchronous="full", mmap_size=0)
+        connection, cursor = bookshelves.getConnection()
+        self.assertEqual(cursor.execute("""PRAGMA synchronous""").fetchone()[0], 2)
+        self.assertEqual(cursor.execute("""PRAGMA mmap_size""").fetchone()[0], 0)
+        bookshelves.close()
+
+        with self.assertRaises(ValueError):
+            Bookshelves(self.path_to_test_db, synchronous="sometimes")
+
+    def test_readers_do_not_wait_for_writers(self):
+        reader = Bookshelves(self.path_to_test_db, busy_timeout=0)
+        thread = self.hold_write_lock(0.5)
+
+        start_time = time.perf_counter()
+        # the uncommitted book isn't seen
+        self.assertEqual(self.count_books(reader), 0)
+        self.assertLess(time.perf_counter() - start_time, 0.5)
+
+        thread.join()
+        reader.close()
+
+    def test_writers_wait_for_lock(self):
+        thread = self.hold_write_lock(0.2)
+
+        self.bookshelves.upsertBooks([self.book])
+        self.bookshelves.addToDatabase(self.book)
+
+        thread.join()
+        self.assertEqual(self.count_books(self.bookshelves), 3)
+
+    def test_writer_gives_up_after_retries(self):
+        bookshelves = Bookshelves(self.path_to_test_db, busy_timeout=0.05)
+        thread = self.hold_write_lock(1)
+
+        with mock.patch("bookshelves.WRITE_RETRIES", 2), self.assertLogs(
+            level="WARNING"
+        ) as logs:
+            with self.assertRaises(sqlite3.OperationalError):
+                bookshelves.upsertBooks([self.book])
+
+        self.assertEqual(len(logs.records), 2)
+        thread.join()
+        bookshelves.close()
+        self.assertEqual(self.count_books(self.bookshelves), 1)
+
+
 if __name__ == "__main__":
     unittest.main(verbosity=2)
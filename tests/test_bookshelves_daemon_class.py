@@ -0,0 +1,254 @@
+"""Tests for bookshelves api and daemon classes"""
+
+import argparse
+import json
+import os
+import stat
+import threading
+import unittest
+from unittest import mock
+from os.path import abspath, exists, join
+from os import remove
+
+from bookshelves import (
+    Book,
+    Bookshelves,
+    BookshelvesAPI,
+    BookshelvesDaemon,
+    connect_to_daemon,
+    daemon_request,
+    daemon_running,
+    forward_command,
+    is_loopback_host,
+    parse_tcp_address,
+)
+
+
+def fake_batch_search(isbns):
+    """Find every isbn"""
+    return {isbn: {"title": f"Title {isbn}", "isbn_13": isbn} for isbn in isbns}
+
+
+class TestBookshelvesAPI(unittest.TestCase):
+    """Tests for answering api requests without a daemon"""
+
+    def setUp(self):
+        self.path_to_test_db = join("tests", "test-api.db")
+        self.path_to_export = abspath(join("tests", "test-api-export.csv"))
+        self.bookshelves = Bookshelves(self.path_to_test_db)
+        self.bookshelves.upsertBooks(
+            Book({"title": title, "primary_author": author, "date_finished": date})
+            for title, author, date in [
+                ("Piranesi", "Susanna Clarke", "2022-02-01"),
+                ("Piranesi", "Susanna Clarke", "2023-05-01"),
+                ("Lolly Willowes", "Sylvia Townsend Warner", "2023-01-01"),
+            ]
+        )
+        self.api = BookshelvesAPI(
+            self.bookshelves, lookup_batch_size=2, workers=2, folder="tests"
+        )
+
+    def tearDown(self):
+        self.bookshelves.close()
+        for path in (self.path_to_test_db, self.path_to_export):
+            if exists(path):
+                remove(path)
+
+    def test_health(self):
+        status_code, data = self.api.handle("GET", "/health")
+        self.assertEqual(status_code, 200)
+        self.assertEqual(data["database"], self.path_to_test_db)
+
+    def test_search(self):
+        status_code, data = self.api.handle("GET", "/search?q=lolly")
+        self.assertEqual(status_code, 200)
+        self.assertEqual([book["title"] for book in data["books"]], ["Lolly Willowes"])
+
+    def test_top(self):
+        status_code, data = self.api.handle("GET", "/top?limit=1&year=2023")
+        self.assertEqual(status_code, 200)
+        self.assertEqual(len(data["books"]), 1)
+        self.assertEqual(data["books"][0]["read_count"], 1)
+
+        status_code, data = self.api.handle("GET", "/top")
+        self.assertEqual(data["books"][0]["book"]["title"], "Piranesi")
+        self.assertEqual(data["books"][0]["read_count"], 2)
+
+    def test_stats(self):
+        status_code, data = self.api.handle("GET", "/stats?year=2023")
+        self.assertEqual(status_code, 200)
+        self.assertEqual(data, self.bookshelves.getStats("2023"))
+
+    @mock.patch("bookshelves.Book.openLibBatchSearch", side_effect=fake_batch_search)
+    def test_add(self, mocked_search):
+        body = json.dumps(
+            {"isbns": ["9781000000001", "9781000000002"], "date_finished": "2024-01-01"}
+        )
+        status_code, data = self.api.handle("POST", "/add", body.encode("utf-8"))
+        self.assertEqual(status_code, 200)
+        self.assertEqual(data, {"added": 2, "isbns": 2})
+        self.assertEqual(len(self.bookshelves.search("title")), 2)
+
+    def test_export(self):
+        body = json.dumps({"path": self.path_to_export}).encode("utf-8")
+        status_code, data = self.api.handle("POST", "/export", body)
+        self.assertEqual(status_code, 200)
+        self.assertEqual(data, {"rows": 3})
+        self.assertTrue(exists(self.path_to_export))
+
+        print("testing existing files are not overwritten")
+        status_code, data = self.api.handle("POST", "/export", body)
+        self.assertEqual(status_code, 400)
+        self.assertIn("already exists", data["error"])
+
+    def test_paths_outside_folder(self):
+        print("testing files outside the api folder can't be imported or exported")
+        for path in [abspath("bookshelves.py"), abspath(join("tests", "..", "x.csv"))]:
+            body = json.dumps({"path": path}).encode("utf-8")
+            for route in ["/import", "/export"]:
+                status_code, data = self.api.handle("POST", route, body)
+                self.assertEqual(status_code, 400)
+                self.assertIn("must be inside", data["error"])
+
+        print("testing missing files can't be imported")
+        body = json.dumps({"path": abspath(join("tests", "missing.csv"))})
+        status_code, data = self.api.handle("POST", "/import", body.encode("utf-8"))
+        self.assertEqual(status_code, 400)
+        self.assertIn("does not exist", data["error"])
+
+    def test_invalid_requests(self):
+        print("testing unknown paths and methods are not found")
+        self.assertEqual(self.api.handle("GET", "/missing")[0], 404)
+        self.assertEqual(self.api.handle("GET", "/add")[0], 404)
+
+        print("testing bad parameters are rejected")
+        self.assertEqual(self.api.handle("GET", "/search")[0], 400)
+        self.assertEqual(self.api.handle("GET", "/top?limit=ten")[0], 400)
+        self.assertEqual(self.api.handle("POST", "/add", b"not json")[0], 400)
+        self.assertEqual(self.api.handle("POST", "/add", b'{"isbns": ["1"]}')[0], 400)
+        self.assertEqual(
+            self.api.handle("POST", "/import", b'{"path": "relative.csv"}')[0], 400
+        )
+
+
+class TestBookshelvesDaemon(unittest.TestCase):
+    """Tests for serving the api and forwarding commands to it"""
+
+    def setUp(self):
+        self.path_to_test_db = join("tests", "test-daemon.db")
+        self.path_to_socket = join("tests", "test-daemon.sock")
+        self.bookshelves = Bookshelves(self.path_to_test_db)
+        self.bookshelves.upsertBooks(
+            [Book({"title": "Piranesi", "primary_author": "Susanna Clarke"})]
+        )
+        self.api = BookshelvesAPI(self.bookshelves, workers=2)
+
+    def tearDown(self):
+        self.bookshelves.close()
+        remove(self.path_to_test_db)
+
+    def test_parse_tcp_address(self):
+        self.assertEqual(parse_tcp_address("127.0.0.1:8765"), ("127.0.0.1", 8765))
+        self.assertEqual(parse_tcp_address(":0"), ("127.0.0.1", 0))
+        self.assertIsNone(parse_tcp_address("data/bookshelves.sock"))
+        self.assertIsNone(parse_tcp_address("data/host:1"))
+
+    def test_only_loopback_hosts(self):
+        self.assertTrue(is_loopback_host("127.0.0.1"))
+        self.assertTrue(is_loopback_host("localhost"))
+        self.assertTrue(is_loopback_host("::1"))
+        self.assertFalse(is_loopback_host("0.0.0.0"))
+        self.assertFalse(is_loopback_host("example.com"))
+
+        for address in ["0.0.0.0:0", "192.0.2.1:0"]:
+            with self.assertRaises(ValueError):
+                BookshelvesDaemon(self.api, address)
+
+    def test_truncated_body(self):
+        with BookshelvesDaemon(
+            self.api, "127.0.0.1:0", workers=1, request_timeout=0.2
+        ) as daemon:
+            with connect_to_daemon(daemon.address, timeout=5) as connection:
+                # body is shorter than its Content-Length
+                connection.sendall(
+                    b"POST /add HTTP/1.0\r\nContent-Length: 10\r\n\r\n{}"
+                )
+                response = connection.recv(4096)
+            self.assertTrue(response.startswith(b"HTTP/1.0 408"))
+
+            print("testing the worker is free to answer other requests")
+            data = daemon_request(daemon.address, "GET", "/health")
+            self.assertEqual(data["status"], "ok")
+
+    def test_serve_tcp(self):
+        with BookshelvesDaemon(self.api, "127.0.0.1:0", workers=2) as daemon:
+            data = daemon_request(daemon.address, "GET", "/search", {"q": "piranesi"})
+            self.assertEqual(data["books"][0]["title"], "Piranesi")
+
+            with self.assertRaises(RuntimeError):
+                daemon_request(daemon.address, "GET", "/missing")
+
+    def test_serve_unix_socket(self):
+        with BookshelvesDaemon(self.api, self.path_to_socket, workers=2) as daemon:
+            self.assertTrue(daemon_running(self.path_to_socket))
+
+            print("testing only the owner can use the socket")
+            self.assertEqual(stat.S_IMODE(os.stat(self.path_to_socket).st_mode), 0o600)
+
+            print("testing a second daemon can't take over the socket")
+            with self.assertRaises(OSError):
+                BookshelvesDaemon(self.api, self.path_to_socket)
+
+            print("testing concurrent requests are all answered")
+            results = []
+
+            def request():
+                results.append(daemon_request(daemon.address, "GET", "/top"))
+
+            threads = [threading.Thread(target=request) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            self.assertEqual(len(results), 8)
+            self.assertTrue(
+                all(result["books"][0]["read_count"] == 1 for result in results)
+            )
+
+        self.assertFalse(exists(self.path_to_socket))
+        self.assertFalse(daemon_running(self.path_to_socket))
+
+    def test_forward_command(self):
+        args = argparse.Namespace(
+            add=None,
+            export=False,
+            import_csv=None,
+            search=None,
+            stats=False,
+            rebuild=False,
+            top_ten=True,
+            top=None,
+            year=None,
+            author=None,
+            yes=False,
+        )
+
+        with BookshelvesDaemon(self.api, "127.0.0.1:0", workers=2) as daemon:
+            args.daemon = daemon.address
+            with mock.patch("builtins.print") as mocked_print:
+                self.assertTrue(forward_command(args))
+
+            printed = [call.args[0] for call in mocked_print.call_args_list]
+            self.assertEqual(printed[0], "\nTOP TEN")
+            self.assertIn("Piranesi by Susanna Clarke", printed[2])
+            self.assertTrue(printed[2].endswith("has been read 1 times."))
+
+            print("testing commands that would prompt are not forwarded")
+            args.top_ten = False
+            args.add = ["9781000000001"]
+            self.assertFalse(forward_command(args))
+
+
+if __name__ == "__main__":
+    unittest.main()
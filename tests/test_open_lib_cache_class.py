@@ -0,0 +1,119 @@
+"""Tests for open library cache class"""
+import json
+import unittest
+from unittest import mock
+from os.path import join
+from os import remove
+
+from bookshelves import OpenLibCache, OpenLibClient
+
+
+class TestOpenLibCacheClass(unittest.TestCase):
+    """This is used to test the OpenLibCache Class and all its methods."""
+
+    def setUp(self):
+        self.path_to_test_cache = join("tests", "test-cache.db")
+        self.url = "https://openlibrary.org/isbn/9780747579885.json"
+        self.response = json.dumps({"title": "Jonathan Strange and Mr. Norrell"})
+
+    def tearDown(self):
+        remove(self.path_to_test_cache)
+
+    def test_get_missing_url(self):
+        cache = OpenLibCache(self.path_to_test_cache)
+        self.assertIsNone(cache.get(self.url))
+        self.assertEqual(cache.misses, 1)
+        cache.close()
+
+    def test_set_and_get(self):
+        cache = OpenLibCache(self.path_to_test_cache)
+        cache.set(self.url, self.response)
+        self.assertEqual(cache.get(self.url), self.response)
+        self.assertEqual(cache.hits, 1)
+        cache.close()
+
+        print("testing responses persist between cache objects")
+        cache = OpenLibCache(self.path_to_test_cache)
+        self.assertEqual(cache.get(self.url), self.response)
+        cache.close()
+
+    def test_expired_response(self):
+        cache = OpenLibCache(self.path_to_test_cache, ttl=-1)
+        cache.set(self.url, self.response)
+        self.assertIsNone(cache.get(self.url))
+        cache.close()
+
+    def test_evict_oldest_over_max_entries(self):
+        cache = OpenLibCache(self.path_to_test_cache, max_entries=2)
+        with mock.patch("bookshelves.time.time", side_effect=[1e10, 2e10, 3e10]):
+            for num in range(3):
+                cache.set(f"{self.url}?{num}", self.response)
+
+        cache.evict()
+
+        self.assertIsNone(cache.get(f"{self.url}?0"))
+        self.assertEqual(cache.get(f"{self.url}?2"), self.response)
+        cache.close()
+
+
+class TestOpenLibClientCache(unittest.TestCase):
+    """Tests for the open library client reading and writing the cache"""
+
+    def setUp(self):
+        self.path_to_test_cache = join("tests", "test-client-cache.db")
+        self.cache = OpenLibCache(self.path_to_test_cache)
+        self.url = "https://openlibrary.org/authors/OL1387961A.json"
+        self.response = mock.Mock(status_code=200, text='{"name": "Susanna Clarke"}')
+        self.response.json.return_value = {"name": "Susanna Clarke"}
+
+    def tearDown(self):
+        self.cache.close()
+        remove(self.path_to_test_cache)
+
+    @mock.patch("requests.Session.get")
+    def test_getJSON_uses_cache(self, mocked_get):
+        mocked_get.return_value = self.response
+        client = OpenLibClient(self.cache)
+
+        self.assertEqual(client.getJSON(self.url)["name"], "Susanna Clarke")
+        self.assertEqual(client.getJSON(self.url)["name"], "Susanna Clarke")
+        self.assertEqual(mocked_get.call_count, 1)
+
+    @mock.patch("requests.Session.get")
+    def test_getJSON_refresh(self, mocked_get):
+        mocked_get.return_value = self.response
+        self.cache.set(self.url, '{"name": "Old Name"}')
+        client = OpenLibClient(self.cache, refresh=True)
+
+        self.assertEqual(client.getJSON(self.url)["name"], "Susanna Clarke")
+        self.assertEqual(mocked_get.call_count, 1)
+        self.assertEqual(self.cache.get(self.url), self.response.text)
+
+    @mock.patch("requests.Session.get")
+    def test_getJSON_does_not_cache_errors(self, mocked_get):
+        mocked_get.return_value = mock.Mock(status_code=404, text="{}")
+        client = OpenLibClient(self.cache)
+
+        client.getJSON(self.url)
+        self.assertIsNone(self.cache.get(self.url))
+
+    def test_getBooksByIsbn_caches_each_isbn(self):
+        response = mock.Mock(status_code=200)
+        response.json.return_value = {
+            "ISBN:9780747579885": {"title": "Jonathan Strange and Mr. Norrell"},
+            "ISBN:9781844088058": {"title": "Lolly Willowes"},
+        }
+        client = OpenLibClient(self.cache)
+
+        with mock.patch.object(client, "get", return_value=response) as get:
+            client.getBooksByIsbn(["9780747579885", "9781844088058"])
+            books = client.getBooksByIsbn(["9781844088058", "9780000000002"])
+
+        print("testing only uncached isbns are requested")
+        self.assertEqual(get.call_count, 2)
+        self.assertEqual(get.call_args.args[0], client.booksApiUrl(["9780000000002"]))
+        self.assertEqual(books["9781844088058"]["title"], "Lolly Willowes")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,163 @@
+"""Tests for open library client class"""
+import threading
+import unittest
+from unittest import mock
+
+import requests
+
+from bookshelves import OpenLibClient
+
+
+class TestOpenLibClientAuthors(unittest.TestCase):
+    """Tests for memoized author lookups in the OpenLibClient class.
+    Requests are mocked so these tests run offline."""
+
+    def setUp(self):
+        self.client = OpenLibClient()
+        self.author_key = "/authors/OL1387961A"
+
+    @mock.patch("bookshelves.OpenLibClient.getJSON")
+    def test_getAuthorName(self, mocked_get_json):
+        mocked_get_json.return_value = {"name": "Susanna Clarke"}
+
+        self.assertEqual(self.client.getAuthorName(self.author_key), "Susanna Clarke")
+        mocked_get_json.assert_called_once_with(
+            "https://openlibrary.org/authors/OL1387961A.json"
+        )
+
+    @mock.patch("bookshelves.OpenLibClient.getJSON")
+    def test_getAuthorName_is_memoized(self, mocked_get_json):
+        mocked_get_json.return_value = {"name": "Susanna Clarke"}
+
+        for _ in range(40):
+            self.client.getAuthorName(self.author_key)
+
+        self.assertEqual(mocked_get_json.call_count, 1)
+        self.assertEqual(self.client.author_lookups, 40)
+        self.assertEqual(self.client.author_fetches, 1)
+        self.assertEqual(self.client.author_fetches_saved, 39)
+
+    @mock.patch("bookshelves.OpenLibClient.getJSON")
+    def test_getAuthorName_coalesces_concurrent_lookups(self, mocked_get_json):
+        release_request = threading.Event()
+
+        def slow_get_json(url):
+            release_request.wait(5)
+            return {"name": "Susanna Clarke"}
+
+        mocked_get_json.side_effect = slow_get_json
+
+        names = []
+        threads = [
+            threading.Thread(
+                target=lambda: names.append(self.client.getAuthorName(self.author_key))
+            )
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+
+        release_request.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(names, ["Susanna Clarke"] * 8)
+        self.assertEqual(mocked_get_json.call_count, 1)
+
+    @mock.patch("bookshelves.OpenLibClient.getJSON")
+    def test_getAuthorName_failure_is_not_memoized(self, mocked_get_json):
+        mocked_get_json.side_effect = [KeyError("name"), {"name": "Susanna Clarke"}]
+
+        with self.assertRaises(KeyError):
+            self.client.getAuthorName(self.author_key)
+
+        self.assertEqual(self.client.getAuthorName(self.author_key), "Susanna Clarke")
+        self.assertEqual(mocked_get_json.call_count, 2)
+
+
+class TestOpenLibClientRetries(unittest.TestCase):
+    """Tests for retrying failed requests in the OpenLibClient class.
+    Requests and sleeps are mocked so these tests run offline and instantly."""
+
+    def setUp(self):
+        self.client = OpenLibClient(retries=2, timeout=3)
+        self.url = "https://openlibrary.org/isbn/9780747579885.json"
+
+    @staticmethod
+    def make_response(status_code, headers=None):
+        response = requests.Response()
+        response.status_code = status_code
+        response.headers.update(headers or {})
+        return response
+
+    @mock.patch("bookshelves.time.sleep")
+    @mock.patch("requests.Session.get")
+    def test_get_success(self, mocked_get, mocked_sleep):
+        mocked_get.return_value = self.make_response(200)
+
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        mocked_get.assert_called_once_with(self.url, timeout=3)
+        mocked_sleep.assert_not_called()
+
+    @mock.patch("bookshelves.time.sleep")
+    @mock.patch("requests.Session.get")
+    def test_get_retries_server_errors(self, mocked_get, mocked_sleep):
+        mocked_get.side_effect = [
+            self.make_response(503),
+            requests.ConnectionError("connection reset"),
+            self.make_response(200),
+        ]
+
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.assertEqual(mocked_get.call_count, 3)
+        self.assertEqual(mocked_sleep.call_count, 2)
+
+    @mock.patch("bookshelves.time.sleep")
+    @mock.patch("requests.Session.get")
+    def test_get_honours_retry_after(self, mocked_get, mocked_sleep):
+        mocked_get.side_effect = [
+            self.make_response(429, {"Retry-After": "7"}),
+            self.make_response(200),
+        ]
+
+        self.client.get(self.url)
+        mocked_sleep.assert_called_once_with(7.0)
+
+    @mock.patch("bookshelves.time.sleep")
+    @mock.patch("requests.Session.get")
+    def test_get_raises_when_out_of_retries(self, mocked_get, mocked_sleep):
+        mocked_get.return_value = self.make_response(500)
+
+        with self.assertRaises(requests.HTTPError):
+            self.client.get(self.url)
+
+        self.assertEqual(mocked_get.call_count, 3)
+
+    @mock.patch("bookshelves.time.sleep")
+    @mock.patch("requests.Session.get")
+    def test_get_does_not_retry_client_errors(self, mocked_get, mocked_sleep):
+        mocked_get.return_value = self.make_response(404)
+
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        mocked_get.assert_called_once()
+
+    def test_backoff(self):
+        for attempt in range(10):
+            delay = OpenLibClient.backoff(attempt)
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, min(60, 0.5 * 2**attempt))
+
+    def test_retryAfter(self):
+        self.assertEqual(
+            OpenLibClient.retryAfter(self.make_response(429, {"Retry-After": "3"})), 3
+        )
+        self.assertIsNone(OpenLibClient.retryAfter(self.make_response(429)))
+        print("testing dates in the past do not wait")
+        past_date = {"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"}
+        self.assertEqual(
+            OpenLibClient.retryAfter(self.make_response(503, past_date)), 0
+        )
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,129 @@
+"""Tests for open library index class"""
+import gzip
+import json
+import unittest
+from unittest import mock
+from os.path import join
+from os import remove
+
+from bookshelves import (
+    Book,
+    OpenLibClient,
+    OpenLibIndex,
+    edition_isbns,
+    isbn_10_to_13,
+    read_open_lib_dump,
+)
+
+
+def dump_line(record_type: str, record: dict) -> str:
+    """Line of an open library dump for record"""
+    return "\t".join(
+        [record_type, record["key"], "1", "2023-01-01T00:00:00", json.dumps(record)]
+    )
+
+
+class TestOpenLibIndexClass(unittest.TestCase):
+    """This is used to test the OpenLibIndex Class and all its methods,
+    with dumps made in the same format as the open library dumps."""
+
+    def setUp(self):
+        self.path_to_test_index = join("tests", "test-index.db")
+        self.path_to_test_dump = join("tests", "test-dump.txt.gz")
+
+        self.edition = {
+            "key": "/books/OL7962789M",
+            "title": "Jonathan Strange and Mr. Norrell",
+            "authors": [{"key": "/authors/OL1387961A"}],
+            "publish_date": "September 5, 2005",
+            "publishers": ["Bloomsbury Publishing PLC"],
+            "number_of_pages": 1024,
+            "isbn_10": ["0747579881"],
+            "isbn_13": ["9780747579885"],
+            "identifiers": {"goodreads": ["823763"], "librarything": ["1060"]},
+            "covers": [1234],
+        }
+        self.author = {"key": "/authors/OL1387961A", "name": "Susanna Clarke"}
+        self.work = {"key": "/works/OL1W", "title": "Jonathan Strange"}
+
+        lines = [
+            dump_line("/type/edition", self.edition),
+            dump_line("/type/work", self.work),
+            dump_line("/type/author", self.author),
+            "/type/edition\tmalformed line",
+        ]
+        with gzip.open(self.path_to_test_dump, "wt", encoding="utf-8") as dump:
+            dump.write("\n".join(lines) + "\n")
+
+        self.index = OpenLibIndex(self.path_to_test_index)
+
+    def tearDown(self):
+        self.index.close()
+        remove(self.path_to_test_index)
+        remove(self.path_to_test_dump)
+
+    def test_read_open_lib_dump(self):
+        records = list(read_open_lib_dump(self.path_to_test_dump))
+
+        print("testing works and malformed lines are skipped")
+        self.assertEqual(
+            records,
+            [("/type/edition", self.edition), ("/type/author", self.author)],
+        )
+
+    def test_importDump(self):
+        self.assertEqual(self.index.importDump(self.path_to_test_dump), (1, 1))
+
+        edition = self.index.getEdition("9780747579885")
+        self.assertEqual(edition["title"], self.edition["title"])
+        self.assertNotIn("covers", edition)
+        self.assertEqual(
+            self.index.getAuthorName("/authors/OL1387961A"), "Susanna Clarke"
+        )
+
+        print("testing missing values")
+        self.assertIsNone(self.index.getEdition("9780000000002"))
+        self.assertIsNone(self.index.getAuthorName("/authors/OL1A"))
+        self.assertEqual(self.index.hits, 2)
+        self.assertEqual(self.index.misses, 2)
+
+    def test_edition_isbns(self):
+        self.assertEqual(edition_isbns(self.edition), ["9780747579885"])
+        self.assertEqual(
+            edition_isbns({"isbn_10": ["0-7475-7988-1", "invalid"]}),
+            ["9780747579885"],
+        )
+        self.assertEqual(isbn_10_to_13("0747579881"), "9780747579885")
+        self.assertEqual(isbn_10_to_13("074757988"), "")
+
+    @mock.patch("requests.Session.get")
+    def test_client_uses_index(self, mocked_get):
+        self.index.importDump(self.path_to_test_dump)
+        client = OpenLibClient(index=self.index)
+
+        book_metadata = Book.openLibIsbnSearch("9780747579885", client)
+        self.assertEqual(book_metadata["primary_author"], "Susanna Clarke")
+        self.assertEqual(book_metadata["number_of_pages"], 1024)
+        self.assertEqual(book_metadata["goodreads_identifier"], "823763")
+
+        books_metadata = Book.openLibBatchSearch(["9780747579885"], client)
+        self.assertEqual(books_metadata["9780747579885"], book_metadata)
+
+        mocked_get.assert_not_called()
+
+    def test_client_requests_isbns_missing_from_index(self):
+        self.index.importDump(self.path_to_test_dump)
+        client = OpenLibClient(index=self.index)
+
+        with mock.patch.object(client, "getBooksByIsbn", return_value={}) as get:
+            books_metadata = Book.openLibBatchSearch(
+                ["9780747579885", "9780000000002"], client
+            )
+
+        get.assert_called_once_with(["9780000000002"])
+        self.assertIsNotNone(books_metadata["9780747579885"])
+        self.assertIsNone(books_metadata["9780000000002"])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
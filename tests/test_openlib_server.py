@@ -0,0 +1,132 @@
+"""Tests for open library stand-in server"""
+import unittest
+from unittest import mock
+
+import requests
+
+from benchmark import generate_books
+from bookshelves import Book, OpenLibClient
+from openlib_server import (
+    PATH_TO_FIXTURES,
+    OpenLibServer,
+    fixtures_from_books,
+    load_fixtures,
+)
+
+
+class TestOpenLibServer(unittest.TestCase):
+    """Tests for looking up books from the stand-in server
+    with a client pointed at its url."""
+
+    def setUp(self):
+        self.server = OpenLibServer(load_fixtures(PATH_TO_FIXTURES)).start()
+        self.client = OpenLibClient(base_url=self.server.url)
+        self.test_book_metadata = {
+            "title": "Jonathan Strange and Mr. Norrell",
+            "primary_author_key": "/authors/OL1387961A",
+            "primary_author": "Susanna Clarke",
+            "secondary_authors_keys": "",
+            "secondary_authors": "",
+            "isbn_13": "9780747579885",
+            "edition_publish_date": "September 5, 2005",
+            "number_of_pages": 1024,
+            "publisher": "Bloomsbury Publishing PLC",
+            "open_lib_key": "/books/OL7962789M",
+            "goodreads_identifier": "823763",
+            "librarything_identifier": "1060",
+        }
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def test_client_urls(self):
+        self.assertEqual(
+            self.client.isbnUrl("9780747579885"),
+            f"{self.server.url}/isbn/9780747579885.json",
+        )
+        self.assertEqual(
+            self.client.authorUrl("/authors/OL1387961A"),
+            f"{self.server.url}/authors/OL1387961A.json",
+        )
+        print("testing live open library is used by default")
+        self.assertEqual(
+            OpenLibClient().isbnUrl("9780747579885"),
+            "https://openlibrary.org/isbn/9780747579885.json",
+        )
+
+    def test_openLibIsbnSearch(self):
+        self.assertEqual(
+            Book.openLibIsbnSearch("9780747579885", self.client),
+            self.test_book_metadata,
+        )
+
+    def test_openLibBatchSearch(self):
+        books_metadata = Book.openLibBatchSearch(
+            ["9780747579885", "9780000000002"], self.client
+        )
+
+        self.assertEqual(books_metadata["9780747579885"], self.test_book_metadata)
+        self.assertIsNone(books_metadata["9780000000002"])
+
+    def test_missing_isbn(self):
+        response = self.client.get(self.client.isbnUrl("9780000000002"))
+        self.assertEqual(response.status_code, 404)
+
+    def test_generated_fixtures(self):
+        books = list(generate_books(50))
+        with OpenLibServer(fixtures_from_books(books)) as server:
+            client = OpenLibClient(base_url=server.url)
+            isbns = [book["isbn_13"] for book in books]
+            books_metadata = Book.openLibBatchSearch(isbns, client)
+            client.close()
+
+        for book in books:
+            book_metadata = books_metadata[book["isbn_13"]]
+            for key, value in book_metadata.items():
+                self.assertEqual(value, book[key])
+
+
+class TestOpenLibServerFaults(unittest.TestCase):
+    """Tests for retrying faults injected by the stand-in server"""
+
+    def setUp(self):
+        self.fixtures = load_fixtures(PATH_TO_FIXTURES)
+        self.url_path = "/isbn/9780747579885.json"
+
+    def test_rate_limits_are_retried(self):
+        with OpenLibServer(self.fixtures, rate_limit_rate=0.5, retry_after=0) as server:
+            client = OpenLibClient(base_url=server.url, retries=20)
+            for _ in range(20):
+                self.assertEqual(
+                    client.get(server.url + self.url_path).status_code, 200
+                )
+            client.close()
+
+        self.assertEqual(server.stats[200], 20)
+        self.assertGreater(server.stats[429], 0)
+
+    @mock.patch("bookshelves.time.sleep")
+    def test_errors_raise_when_out_of_retries(self, mocked_sleep):
+        with OpenLibServer(self.fixtures, error_rate=1) as server:
+            client = OpenLibClient(base_url=server.url, retries=2)
+            with self.assertRaises(requests.HTTPError):
+                client.get(server.url + self.url_path)
+            client.close()
+
+        self.assertEqual(server.stats[503], 3)
+        self.assertEqual(mocked_sleep.call_count, 2)
+
+    def test_faults_are_seeded(self):
+        def faults(seed):
+            server = OpenLibServer(self.fixtures, error_rate=0.3, seed=seed)
+            server.stop()
+            return [server.fault() for _ in range(50)]
+
+        self.assertEqual(faults(1), faults(1))
+        self.assertNotEqual(faults(1), faults(2))
+        self.assertIn(503, faults(1))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,132 @@
+"""Tests for profiler class"""
+import argparse
+import io
+import json
+import time
+import unittest
+from unittest import mock
+from os.path import exists, join
+from os import remove
+
+from bookshelves import NULL_PHASE, Book, Bookshelves, Profiler, profile_command
+
+
+class TestProfilerClass(unittest.TestCase):
+    """This is used to test the Profiler Class and all its methods."""
+
+    def setUp(self):
+        self.profiler = Profiler(enabled=True)
+
+    def test_disabled_profiler_records_nothing(self):
+        profiler = Profiler()
+        rows = ["row"]
+
+        self.assertIs(profiler.phase("http"), NULL_PHASE)
+        with profiler.phase("http"):
+            profiler.count("http_requests")
+        self.assertIs(profiler.timeIter(rows, "csv_read", "csv_rows_read"), rows)
+
+        report = profiler.report()
+        self.assertEqual(report["phases"], {})
+        self.assertEqual(report["counters"], {})
+
+    def test_phase(self):
+        for _ in range(2):
+            with self.profiler.phase("http"):
+                time.sleep(0.01)
+
+        print("testing phase is recorded when code raises")
+        with self.assertRaises(ValueError):
+            with self.profiler.phase("sqlite_write"):
+                raise ValueError("failed write")
+
+        phases = self.profiler.report()["phases"]
+        self.assertEqual(phases["http"]["calls"], 2)
+        self.assertGreaterEqual(phases["http"]["seconds"], 0.02)
+        self.assertEqual(phases["sqlite_write"]["calls"], 1)
+        # phases are listed slowest first
+        self.assertEqual(list(phases), ["http", "sqlite_write"])
+
+    def test_count(self):
+        self.profiler.count("rows_written", 10)
+        self.profiler.count("rows_written")
+        self.assertEqual(self.profiler.report()["counters"], {"rows_written": 11})
+
+    def test_timeIter(self):
+        rows = self.profiler.timeIter(iter(range(3)), "csv_read", "csv_rows_read")
+
+        self.assertEqual(list(rows), [0, 1, 2])
+        report = self.profiler.report()
+        # the final call that finds the end of the rows is timed too
+        self.assertEqual(report["phases"]["csv_read"]["calls"], 4)
+        self.assertEqual(report["counters"]["csv_rows_read"], 3)
+
+    def test_printReport(self):
+        with self.profiler.phase("http"):
+            self.profiler.count("http_requests")
+
+        output = io.StringIO()
+        self.profiler.printReport(output)
+
+        self.assertIn("PROFILE:", output.getvalue())
+        self.assertRegex(output.getvalue(), r"http\s+1\s+\d+\.\d{3}")
+        self.assertRegex(output.getvalue(), r"http_requests\s+1")
+
+
+class TestProfileCommand(unittest.TestCase):
+    """Tests for profiling bookshelves commands"""
+
+    def setUp(self):
+        self.path_to_test_db = join("tests", "test-profile.db")
+        self.path_to_export = join("tests", "test-profile-export.csv")
+        self.path_to_profile = join("tests", "test-profile.json")
+
+        book = Book(
+            {
+                "title": "Jonathan Strange and Mr. Norrell",
+                "primary_author": "Susanna Clarke",
+                "isbn_13": "9780747579885",
+            }
+        )
+        with Bookshelves(self.path_to_test_db) as bookshelves:
+            bookshelves.upsertBooks([book, book])
+
+    def tearDown(self):
+        for path in (self.path_to_test_db, self.path_to_export, self.path_to_profile):
+            if exists(path):
+                remove(path)
+
+    def test_export_is_profiled(self):
+        profiler = Profiler(enabled=True)
+
+        with mock.patch("bookshelves.profiler", profiler):
+            with Bookshelves(self.path_to_test_db) as bookshelves:
+                bookshelves.exportToCSV(self.path_to_export)
+
+        report = profiler.report()
+        self.assertIn("sqlite_read", report["phases"])
+        self.assertIn("csv_write", report["phases"])
+        self.assertEqual(report["counters"]["rows_exported"], 2)
+        self.assertGreater(report["counters"]["bytes_exported"], 0)
+
+    def test_profile_command_json(self):
+        args = argparse.Namespace(profile="json", profile_output=self.path_to_profile)
+
+        def run_command(args):
+            with Bookshelves(self.path_to_test_db) as bookshelves:
+                bookshelves.exportToCSV(self.path_to_export)
+
+        with mock.patch("bookshelves.profiler", Profiler()), mock.patch(
+            "bookshelves.run_command", run_command
+        ):
+            profile_command(args)
+
+        with open(self.path_to_profile, "r", encoding="utf-8") as profile_file:
+            report = json.load(profile_file)
+
+        self.assertGreater(report["seconds"], 0)
+        self.assertEqual(report["counters"]["rows_exported"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)